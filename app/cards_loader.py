@@ -13,37 +13,39 @@ from config import (
     read_env_file,
     strip_quotes,
     upsert_env_lines,
+    write_env_file,
 )
 from cards import (
     Card,
     build_card_index,
     compute_default_drop_chances,
+    dump_cards_json,
     format_drop_chance,
     load_drop_chances,
     merge_cards,
+    parse_cards_json,
     parse_drop_chance,
     scan_card_files,
 )
 
 
 def load_cards() -> Tuple[Dict[str, Card], Dict[str, List[Card]], Dict[str, float]]:
-    lines, env = read_env_file(ENV_PATH)
-    lines, env = ensure_env_defaults(lines, env)
+    original_lines, env = read_env_file(ENV_PATH)
+    lines, env = ensure_env_defaults(original_lines, env)
     raw_cards = env.get("SOSISKA_CARDS", "")
     cards_data: Dict[str, List[Dict[str, object]]] = {}
     if raw_cards:
         try:
-            cards_data = json.loads(strip_quotes(raw_cards))
+            cards_data = parse_cards_json(strip_quotes(raw_cards))
         except json.JSONDecodeError:
             cards_data = {}
     for rarity in RARITY_ORDER:
         cards_data.setdefault(rarity, [])
     scanned = scan_card_files()
     merged = merge_cards(cards_data, scanned)
-    updated_cards_json = json.dumps(merged, ensure_ascii=False)
     updates = {}
-    if env.get("SOSISKA_CARDS") != updated_cards_json:
-        updates["SOSISKA_CARDS"] = updated_cards_json
+    if cards_data != merged or "SOSISKA_CARDS" not in env:
+        updates["SOSISKA_CARDS"] = dump_cards_json(merged)
 
     default_drop = compute_default_drop_chances(merged)
     if "meme" in default_drop and "platinum" in default_drop:
@@ -56,7 +58,8 @@ def load_cards() -> Tuple[Dict[str, Card], Dict[str, List[Card]], Dict[str, floa
     if updates:
         lines = upsert_env_lines(lines, updates)
         env.update(updates)
-    ENV_PATH.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    if lines != original_lines:
+        write_env_file(ENV_PATH, lines)
 
     card_map, cards_by_rarity = build_card_index(merged)
     if RARITY_PRICE_MULTIPLIERS:
@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-import json
 import secrets
 from datetime import date, datetime
 from pathlib import Path
@@ -8,7 +7,8 @@ from typing import Any, Dict, Optional
 
 import asyncpg
 
-from config import DB_PATH, DATABASE_URL
+from config import DB_JOURNAL_PATH, DB_PATH, DATABASE_URL
+from storage import read_db_file
 
 
 def _parse_int(value: Any, default: int = 0) -> int:
@@ -306,9 +306,13 @@ async def migrate_from_json(pool: asyncpg.Pool, path: Optional[Path] = None) ->
         path = DB_PATH
     if not path.exists():
         return False
+    if path == DB_PATH:
+        journal_path = DB_JOURNAL_PATH
+    else:
+        journal_path = path.with_name(path.name + ".log")
     try:
-        raw = json.loads(path.read_text(encoding="utf-8"))
-    except json.JSONDecodeError:
+        raw = read_db_file(path, journal_path)
+    except ValueError:
         return False
     users = raw.get("users", {}) if isinstance(raw, dict) else {}
     trades = raw.get("trades", {}) if isinstance(raw, dict) else {}
@@ -15,6 +15,7 @@ from config import (
     GIVEAWAY_START_HOUR,
     EXCLUSIVE_STOCK_LIMIT,
     RARITY_NAMES,
+    RARITY_INDEX,
     RARITY_ORDER,
 )
 from app.repo import (
@@ -73,10 +74,9 @@ def _extract_schedule_for_date(
 
 
 def pick_giveaway_card(cards_by_rarity: Dict[str, List[Card]]) -> Optional[Card]:
-    if GIVEAWAY_MIN_RARITY in RARITY_ORDER:
-        min_index = RARITY_ORDER.index(GIVEAWAY_MIN_RARITY)
-    else:
-        min_index = RARITY_ORDER.index("epic")
+    min_index = RARITY_INDEX.get(GIVEAWAY_MIN_RARITY)
+    if min_index is None:
+        min_index = RARITY_INDEX["epic"]
     pool: List[Card] = []
     for rarity in RARITY_ORDER[min_index:]:
         if rarity == "exclusive":
@@ -8,6 +8,7 @@ import subprocess
 import tempfile
 import textwrap
 import unicodedata
+from functools import lru_cache
 from io import BytesIO
 from pathlib import Path
 from typing import Callable, Dict, List, Optional, Tuple
@@ -62,6 +63,7 @@ from config import (
     FONT_CANDIDATES,
     CJK_FONT_NAMES,
     RARITY_NAMES,
+    filter_existing_paths,
 )
 from app.utils import build_kazik_text_line
 
@@ -120,14 +122,14 @@ def pick_font_from_candidates(
     size: int, candidates: List[Path]
 ) -> ImageFont.FreeTypeFont:
     for font_path in candidates:
-        if font_path.exists():
-            try:
-                return load_truetype_font(font_path, size=size)
-            except Exception:
-                continue
+        try:
+            return load_truetype_font(font_path, size=size)
+        except Exception:
+            continue
     return ImageFont.load_default()
 
 
+@lru_cache(maxsize=1)
 def collect_font_candidates() -> List[Path]:
     env_paths = []
     if SOSISKI_FONT_PATH:
@@ -136,7 +138,7 @@ def collect_font_candidates() -> List[Path]:
         env_paths.extend(
             Path(part.strip()) for part in SOSISKI_FONT_PATHS.split(";") if part.strip()
         )
-    return env_paths + FONT_CANDIDATES
+    return filter_existing_paths(env_paths + FONT_CANDIDATES)
 
 
 def split_text_by_script(text: str) -> List[Tuple[str, str]]:
@@ -465,14 +467,14 @@ def pick_font_bundle(size: int) -> Tuple[ImageFont.FreeTypeFont, ImageFont.FreeT
     cjk_font = base_font
     symbol_font = base_font
     for font_path in candidates:
-        if font_path.name in CJK_FONT_NAMES and font_path.exists():
+        if font_path.name in CJK_FONT_NAMES:
             try:
                 cjk_font = load_truetype_font(font_path, size=size)
                 break
             except Exception:
                 continue
     for font_path in candidates:
-        if font_path.name in SYMBOL_FONT_NAMES and font_path.exists():
+        if font_path.name in SYMBOL_FONT_NAMES:
             try:
                 symbol_font = load_truetype_font(font_path, size=size)
                 break
@@ -523,15 +525,14 @@ def pick_font_for_text(text: str, size: int) -> ImageFont.FreeTypeFont:
     if not text:
         return pick_font(size)
     for font_path in collect_font_candidates():
-        if font_path.exists():
-            try:
-                font = load_truetype_font(font_path, size=size)
-            except Exception:
-                continue
-            if "\u4e00" <= max(text) <= "\u9fff":
-                return font
-            if font.getmask(text).getbbox():
-                return font
+        try:
+            font = load_truetype_font(font_path, size=size)
+        except Exception:
+            continue
+        if "\u4e00" <= max(text) <= "\u9fff":
+            return font
+        if font.getmask(text).getbbox():
+            return font
     return pick_font(size)
 
 
@@ -40,6 +40,7 @@ from app.cards_loader import load_cards
 from app.background import run_background_tasks
 from app.db import create_pool, init_db, migrate_from_json
 from app.handlers import routers
+from app.images import collect_font_candidates
 from app.miniapp import setup_miniapp
 from app.ratelimit import RateLimiter
 from app.repo import sync_exclusive_stock
@@ -95,6 +96,8 @@ async def run_webhook(
 async def main() -> None:
     ensure_utf8()
     ensure_fonts(BASE_DIR)
+    collect_font_candidates.cache_clear()
+    collect_font_candidates()
     setup_logging()
     if not BOT_TOKEN:
         raise SystemExit("BOT_TOKEN is not set")
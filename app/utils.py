@@ -8,7 +8,14 @@ from typing import Dict, List, Optional
 from zoneinfo import ZoneInfo
 
 from cards import Card, card_currency, card_display_name
-from config import KAZIK_DIGITS, KAZIK_WIN_WEIGHTS, RARITY_NAMES, RARITY_ORDER, TIMEZONE
+from config import (
+    KAZIK_DIGITS,
+    KAZIK_WIN_WEIGHTS,
+    RARITY_INDEX,
+    RARITY_NAMES,
+    RARITY_ORDER,
+    TIMEZONE,
+)
 
 
 def format_duration(seconds: int) -> str:
@@ -181,9 +188,9 @@ def build_upgrade_fail_caption(user_label: str) -> str:
 def get_next_rarity(
     rarity: str, *, allow_exclusive: bool = False, allow_meme: bool = False
 ) -> Optional[str]:
-    if rarity not in RARITY_ORDER:
+    index = RARITY_INDEX.get(rarity)
+    if index is None:
         return None
-    index = RARITY_ORDER.index(rarity)
     for next_rarity in RARITY_ORDER[index + 1 :]:
         if next_rarity == "meme" and not allow_meme:
             continue
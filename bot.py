@@ -2,6 +2,7 @@ import asyncio
 import json
 import logging
 import os
+import pickle
 import random
 import secrets
 import time
@@ -9,15 +10,17 @@ import fcntl
 import html
 import shutil
 import subprocess
+import sys
 import tempfile
+import threading
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
-from collections import deque
+from collections import OrderedDict, deque
+from functools import lru_cache
 from io import BytesIO
 from pathlib import Path
 from typing import Callable, Deque, Dict, List, Optional, Tuple, Union
 
-from dotenv import load_dotenv
 from PIL import Image, ImageDraw, ImageFilter, ImageFont, ImageOps, ImageStat, ImageSequence
 from telegram import (
     BotCommand,
@@ -52,6 +55,8 @@ from cards import (
     card_display_name,
     card_file_path,
     compute_default_drop_chances,
+    display_name_for,
+    dump_cards_json,
     filter_existing_cards,
     format_amount,
     format_card_price,
@@ -61,6 +66,7 @@ from cards import (
     format_stars,
     load_drop_chances,
     merge_cards,
+    parse_cards_json,
     parse_drop_chance,
     parse_price,
     pick_random_card,
@@ -69,6 +75,7 @@ from cards import (
 )
 from config import *  # noqa: F403
 from storage import (
+    compact_db,
     compute_leaderboard,
     compute_rank,
     ensure_user,
@@ -86,6 +93,7 @@ from storage import (
     make_inventory_item,
     now_utc,
     parse_iso,
+    remove_inventory_item,
     save_db,
     sync_exclusive_stock,
     total_wealth,
@@ -245,10 +253,12 @@ def format_duration(seconds: int) -> str:
     return " ".join(parts)
 
 
+@lru_cache(maxsize=4096)
 def escape_html(text: str) -> str:
     return html.escape(text or "")
 
 
+@lru_cache(maxsize=4096)
 def format_short_amount(value: Optional[int], currency: str) -> str:
     if value is None:
         return "не задана"
@@ -258,8 +268,14 @@ def format_short_amount(value: Optional[int], currency: str) -> str:
 
 
 def format_card_label(card: Card) -> str:
-    rarity = RARITY_NAMES.get(card.rarity, card.rarity)
-    return f"({rarity}) {card_display_name(card)}"
+    return format_card_label_cached(card.rarity, card.file, card.name)
+
+
+@lru_cache(maxsize=4096)
+def format_card_label_cached(rarity: str, file: str, name: Optional[str]) -> str:
+    rarity_name = RARITY_NAMES.get(rarity, rarity)
+    display_name = display_name_for(file, name)
+    return f"({rarity_name}) {display_name}"
 
 
 def format_price_with_old_html(
@@ -393,8 +409,9 @@ def load_discount_data() -> Dict[str, object]:
 
 def save_discount_data(data: Dict[str, object]) -> None:
     DISCOUNT_FILE.parent.mkdir(parents=True, exist_ok=True)
+    payload = {key: value for key, value in data.items() if not key.startswith("_")}
     DISCOUNT_FILE.write_text(
-        json.dumps(data, ensure_ascii=False, indent=2),
+        json.dumps(payload, ensure_ascii=False, indent=2),
         encoding="utf-8",
     )
 
@@ -415,7 +432,10 @@ def build_discount_index(discounts: Dict[str, object]) -> Dict[str, Dict[str, ob
 def get_discount_item(
     discounts: Dict[str, object], card_file: str
 ) -> Optional[Dict[str, object]]:
-    index = build_discount_index(discounts)
+    index = discounts.get("_by_file")
+    if not isinstance(index, dict):
+        index = build_discount_index(discounts)
+        discounts["_by_file"] = index
     return index.get(card_file)
 
 
@@ -493,17 +513,24 @@ def generate_discounts(cards_by_rarity: Dict[str, List[Card]]) -> Dict[str, obje
     }
 
 
+def get_current_discounts(bot_data: Dict[str, object]) -> Dict[str, object]:
+    today = discount_day_key()
+    discounts = bot_data.get("discounts")
+    if isinstance(discounts, dict) and discounts.get("date") == today:
+        return discounts
+    discounts = load_discount_data()
+    if discounts.get("date") != today:
+        discounts = generate_discounts(bot_data["cards_by_rarity"])
+        save_discount_data(discounts)
+    bot_data["discounts"] = discounts
+    bot_data["discounts_dirty"] = False
+    return discounts
+
+
 async def ensure_discounts(context: ContextTypes.DEFAULT_TYPE) -> Dict[str, object]:
     lock = context.application.bot_data.setdefault("discount_lock", asyncio.Lock())
     async with lock:
-        discounts = load_discount_data()
-        today = discount_day_key()
-        if discounts.get("date") != today:
-            cards_by_rarity = context.application.bot_data["cards_by_rarity"]
-            discounts = generate_discounts(cards_by_rarity)
-            save_discount_data(discounts)
-        context.application.bot_data["discounts"] = discounts
-    return discounts
+        return get_current_discounts(context.application.bot_data)
 
 
 def load_giveaway_data() -> Dict[str, object]:
@@ -549,10 +576,9 @@ def giveaway_phase(now: Optional[datetime] = None) -> str:
 
 
 def pick_giveaway_card(cards_by_rarity: Dict[str, List[Card]]) -> Optional[Card]:
-    if GIVEAWAY_MIN_RARITY in RARITY_ORDER:
-        min_index = RARITY_ORDER.index(GIVEAWAY_MIN_RARITY)
-    else:
-        min_index = RARITY_ORDER.index("epic")
+    min_index = RARITY_INDEX.get(GIVEAWAY_MIN_RARITY)
+    if min_index is None:
+        min_index = RARITY_INDEX["epic"]
     pool: List[Card] = []
     for rarity in RARITY_ORDER[min_index:]:
         if rarity == "exclusive":
@@ -946,9 +972,9 @@ def build_kazik_text_line(digits: List[int], revealed: int) -> str:
 
 
 def get_next_rarity(rarity: str, *, allow_exclusive: bool = False) -> Optional[str]:
-    if rarity not in RARITY_ORDER:
+    index = RARITY_INDEX.get(rarity)
+    if index is None:
         return None
-    index = RARITY_ORDER.index(rarity)
     for next_rarity in RARITY_ORDER[index + 1 :]:
         if next_rarity == "exclusive" and not allow_exclusive:
             continue
@@ -996,14 +1022,14 @@ def pick_font_from_candidates(
     size: int, candidates: List[Path]
 ) -> ImageFont.FreeTypeFont:
     for font_path in candidates:
-        if font_path.exists():
-            try:
-                return load_truetype_font(font_path, size=size)
-            except Exception:
-                continue
+        try:
+            return load_truetype_font(font_path, size=size)
+        except Exception:
+            continue
     return ImageFont.load_default()
 
 
+@lru_cache(maxsize=1)
 def collect_font_candidates() -> List[Path]:
     env_paths = []
     env_single = os.getenv("SOSISKI_FONT_PATH", "").strip()
@@ -1016,7 +1042,7 @@ def collect_font_candidates() -> List[Path]:
             for part in env_multi.split(";")
             if part.strip()
         )
-    return env_paths + FONT_CANDIDATES
+    return filter_existing_paths(env_paths + FONT_CANDIDATES)
 
 
 def contains_cjk(text: str) -> bool:
@@ -1447,6 +1473,43 @@ def get_card_media_path(card: Card) -> Path:
     if card.rarity == "exclusive":
         return get_exclusive_media_path(path)
     return path
+
+
+CARD_MEDIA_CACHE_MAX_BYTES = 64 * 1024 * 1024
+CARD_MEDIA_CACHE_MAX_FILE_BYTES = 8 * 1024 * 1024
+_card_media_cache: "OrderedDict[Path, Tuple[int, int, bytes]]" = OrderedDict()
+_card_media_cache_bytes = 0
+_card_media_cache_lock = threading.Lock()
+
+
+def read_card_media_bytes(path: Path) -> bytes:
+    global _card_media_cache_bytes
+    stat = path.stat()
+    with _card_media_cache_lock:
+        cached = _card_media_cache.get(path)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            _card_media_cache.move_to_end(path)
+            return cached[2]
+    data = path.read_bytes()
+    if len(data) > CARD_MEDIA_CACHE_MAX_FILE_BYTES:
+        return data
+    with _card_media_cache_lock:
+        previous = _card_media_cache.pop(path, None)
+        if previous:
+            _card_media_cache_bytes -= len(previous[2])
+        _card_media_cache[path] = (stat.st_mtime_ns, stat.st_size, data)
+        _card_media_cache_bytes += len(data)
+        while _card_media_cache_bytes > CARD_MEDIA_CACHE_MAX_BYTES:
+            _, evicted = _card_media_cache.popitem(last=False)
+            _card_media_cache_bytes -= len(evicted[2])
+    return data
+
+
+async def load_card_media(path: Path) -> BytesIO:
+    data = await asyncio.to_thread(read_card_media_bytes, path)
+    payload = BytesIO(data)
+    payload.name = path.name
+    return payload
 
 
 def build_profile_image(
@@ -2251,8 +2314,24 @@ async def edit_message_text(
     except Exception:
         pass
     await message.edit_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
-
-
+
+
+async def edit_caption_if_changed(
+    message,
+    caption: str,
+    reply_markup: Optional[InlineKeyboardMarkup],
+) -> None:
+    if message.caption == caption and message.reply_markup == reply_markup:
+        return
+    await message.edit_caption(caption=caption, reply_markup=reply_markup)
+
+
+BACK_TO_MY_MENU_MARKUP = InlineKeyboardMarkup(
+    [[InlineKeyboardButton("\u041d\u0430\u0437\u0430\u0434", callback_data="my_menu")]]
+)
+
+
+@lru_cache(maxsize=None)
 def build_main_menu_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
@@ -2284,6 +2363,7 @@ def build_main_menu_keyboard() -> InlineKeyboardMarkup:
     )
 
 
+@lru_cache(maxsize=None)
 def build_roll_menu_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
@@ -2303,6 +2383,7 @@ def build_roll_menu_keyboard() -> InlineKeyboardMarkup:
     )
 
 
+@lru_cache(maxsize=None)
 def build_sausages_menu_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
@@ -2332,6 +2413,7 @@ def build_sausages_menu_keyboard() -> InlineKeyboardMarkup:
     )
 
 
+@lru_cache(maxsize=None)
 def build_donate_menu_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
@@ -2346,6 +2428,7 @@ def build_donate_menu_keyboard() -> InlineKeyboardMarkup:
     )
 
 
+@lru_cache(maxsize=None)
 def build_donate_stars_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
@@ -2387,6 +2470,7 @@ def build_rarity_keyboard(
     return InlineKeyboardMarkup(rows)
 
 
+@lru_cache(maxsize=None)
 def build_shop_menu_keyboard() -> InlineKeyboardMarkup:
     rarities = list(RARITY_ORDER)
     base = build_rarity_keyboard(
@@ -2641,6 +2725,7 @@ def build_skidki_keyboard(total: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(rows)
 
 
+@lru_cache(maxsize=None)
 def build_discount_view_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [[InlineKeyboardButton("\u041d\u0430\u0437\u0430\u0434", callback_data="skidki_menu")]]
@@ -2889,11 +2974,12 @@ async def roll_menu_command(
         pressed_by = tg_user
     db = context.application.bot_data["db"]
     user = ensure_user(db, tg_user)
-    cooldown = get_cooldown_seconds(user)
+    utc_now = now_utc()
+    cooldown = get_cooldown_seconds(user, utc_now)
     last_roll = parse_iso(user.get("last_roll_at"))
     roll_left = 0
     if last_roll:
-        diff = now_utc() - last_roll
+        diff = utc_now - last_roll
         roll_left = max(0, cooldown - int(diff.total_seconds()))
     now = now_local()
     free_left = kazik_free_spins_left(user, now)
@@ -3227,20 +3313,20 @@ async def sosiska_command(
     tg_user = update.effective_user
     db = context.application.bot_data["db"]
     by_rarity = context.application.bot_data["cards_by_rarity"]
-    drop_chances = context.application.bot_data["drop_chances"]
     user = ensure_user(db, tg_user)
-    if not is_vip(user):
-        drop_chances = boost_drop_chances(
-            drop_chances, NON_VIP_DROP_NERF_RARITIES, NON_VIP_DROP_CHANCE_MULTIPLIER
-        )
+    now = now_utc()
+    if is_vip(user, now):
+        drop_chances = context.application.bot_data["drop_chances"]
+    else:
+        drop_chances = context.application.bot_data["non_vip_drop_chances"]
 
     free_rolls = int(user.get("free_rolls", 0))
     use_free_roll = free_rolls > 0
     if not use_free_roll:
-        cooldown = get_cooldown_seconds(user)
+        cooldown = get_cooldown_seconds(user, now)
         last_roll = parse_iso(user.get("last_roll_at"))
         if last_roll:
-            diff = now_utc() - last_roll
+            diff = now - last_roll
             if diff.total_seconds() < cooldown:
                 left = cooldown - int(diff.total_seconds())
                 await message.reply_text(
@@ -4309,9 +4395,7 @@ async def show_inventory_card(
                 "\u0423 \u0442\u0435\u0431\u044f \u043d\u0435\u0442 \u0441\u043e\u0441\u0438\u0441\u043e\u043a \u044d\u0442\u043e\u0439 \u0440\u0435\u0434\u043a\u043e\u0441\u0442\u0438.",
                 pressed_by,
             ),
-            InlineKeyboardMarkup(
-                [[InlineKeyboardButton("\u041d\u0430\u0437\u0430\u0434", callback_data="my_menu")]]
-            ),
+            BACK_TO_MY_MENU_MARKUP,
         )
         return
     index = max(0, min(index, len(items) - 1))
@@ -4342,16 +4426,16 @@ async def show_inventory_card(
             None,
         )
         return
-    with path.open("rb") as photo:
-        await send_or_edit_photo(
-            message,
-            photo,
-            caption,
-            keyboard,
-            prefer_edit=True,
-            context=context,
-            owner_id=pressed_by.id if pressed_by else None,
-        )
+    photo = await load_card_media(path)
+    await send_or_edit_photo(
+        message,
+        photo,
+        caption,
+        keyboard,
+        prefer_edit=True,
+        context=context,
+        owner_id=pressed_by.id if pressed_by else None,
+    )
 
 
 async def edit_inventory_card(
@@ -4370,9 +4454,7 @@ async def edit_inventory_card(
                 "\u0423 \u0442\u0435\u0431\u044f \u043d\u0435\u0442 \u0441\u043e\u0441\u0438\u0441\u043e\u043a \u044d\u0442\u043e\u0439 \u0440\u0435\u0434\u043a\u043e\u0441\u0442\u0438.",
                 pressed_by,
             ),
-            InlineKeyboardMarkup(
-                [[InlineKeyboardButton("\u041d\u0430\u0437\u0430\u0434", callback_data="my_menu")]]
-            ),
+            BACK_TO_MY_MENU_MARKUP,
         )
         return
     index = max(0, min(index, len(items) - 1))
@@ -4403,14 +4485,14 @@ async def edit_inventory_card(
             None,
         )
         return
-    with path.open("rb") as photo:
-        await send_or_edit_photo(
-            message,
-            photo,
-            caption,
-            keyboard,
-            prefer_edit=True,
-        )
+    photo = await load_card_media(path)
+    await send_or_edit_photo(
+        message,
+        photo,
+        caption,
+        keyboard,
+        prefer_edit=True,
+    )
 
 
 async def show_shop_card(
@@ -4465,17 +4547,17 @@ async def show_shop_card(
             None,
         )
         return
-    with path.open("rb") as photo:
-        await send_or_edit_photo(
-            message,
-            photo,
-            caption,
-            keyboard,
-            prefer_edit=True,
-            context=context,
-            owner_id=pressed_by.id if pressed_by else None,
-            parse_mode=ParseMode.HTML,
-        )
+    photo = await load_card_media(path)
+    await send_or_edit_photo(
+        message,
+        photo,
+        caption,
+        keyboard,
+        prefer_edit=True,
+        context=context,
+        owner_id=pressed_by.id if pressed_by else None,
+        parse_mode=ParseMode.HTML,
+    )
 
 
 async def edit_shop_card(
@@ -4530,17 +4612,17 @@ async def edit_shop_card(
             None,
         )
         return
-    with path.open("rb") as photo:
-        await send_or_edit_photo(
-            message,
-            photo,
-            caption,
-            keyboard,
-            prefer_edit=True,
-            context=context,
-            owner_id=pressed_by.id if pressed_by else None,
-            parse_mode=ParseMode.HTML,
-        )
+    photo = await load_card_media(path)
+    await send_or_edit_photo(
+        message,
+        photo,
+        caption,
+        keyboard,
+        prefer_edit=True,
+        context=context,
+        owner_id=pressed_by.id if pressed_by else None,
+        parse_mode=ParseMode.HTML,
+    )
 
 
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -4549,7 +4631,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
     data = query.data or ""
     parts = data.split("|")
-    action = parts[0]
+    action = sys.intern(parts[0])
     tg_user = update.effective_user
     pressed_by = tg_user
     if query.message:
@@ -4634,25 +4716,9 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if action == "skidki_menu":
         await skidki_command(update, context, pressed_by=pressed_by)
         return
-
-    db = context.application.bot_data["db"]
-    card_map = context.application.bot_data["card_map"]
-    by_rarity = context.application.bot_data["cards_by_rarity"]
-    drop_chances = context.application.bot_data["drop_chances"]
-    user = ensure_user(db, tg_user)
-
     if action == "stars_menu":
         await stars_menu_command(update, context, pressed_by=pressed_by)
         return
-    if action == "stars_buy" and len(parts) > 1:
-        try:
-            amount = int(parts[1])
-        except ValueError:
-            return
-        if amount not in STARS_TOPUP_AMOUNTS:
-            return
-        await send_stars_invoice(query.message, amount)
-        return
     if action == "vip_buy_balance":
         await vip_purchase_with_balance(update, context, pressed_by=pressed_by)
         return
@@ -4665,1641 +4731,1929 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if action == "vip_reward_menu":
         await vip_reward_menu_command(update, context, pressed_by=pressed_by)
         return
-    if action == "vip_reward_nav" and len(parts) > 1:
-        try:
-            index = int(parts[1])
-        except ValueError:
-            return
-        cards = filter_existing_cards(by_rarity).get("exclusive", [])
-        if not cards:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u041f\u043e\u043a\u0430 \u043d\u0435\u0442 \u044d\u043a\u0441\u043a\u043b\u044e\u0437\u0438\u0432\u043d\u044b\u0445 \u0441\u043e\u0441\u0438\u0441\u043e\u043a.",
-                    pressed_by,
-                )
+
+    db = context.application.bot_data["db"]
+    card_map = context.application.bot_data["card_map"]
+    by_rarity = context.application.bot_data["cards_by_rarity"]
+    user = ensure_user(db, tg_user)
+
+    entry = CALLBACK_ACTION_HANDLERS.get(action)
+    if entry:
+        min_parts, handler = entry
+        if len(parts) > min_parts:
+            await handler(
+                query,
+                parts,
+                user,
+                context,
+                card_map,
+                by_rarity,
+                pressed_by,
+                tg_user,
+                db,
             )
-            return
-        await edit_vip_reward_card(
-            query.message, cards, index, pressed_by=pressed_by, context=context
-        )
         return
-    if action == "vip_reward_pick" and len(parts) > 1:
-        if user.get("vip_reward_pending"):
-            user["vip_reward_pending"] = False
-            lock = context.application.bot_data["db_lock"]
-            async with lock:
-                save_db(db)
-        await query.message.reply_text(
-            apply_pressed_by(
-                "VIP \u043d\u0430\u0433\u0440\u0430\u0434\u044b \u043e\u0442\u043a\u043b\u044e\u0447\u0435\u043d\u044b. \u042d\u043a\u0441\u043a\u043b\u044e\u0437\u0438\u0432\u044b \u0434\u043e\u0441\u0442\u0443\u043f\u043d\u044b \u0442\u043e\u043b\u044c\u043a\u043e \u0432 \u043c\u0430\u0433\u0430\u0437\u0438\u043d\u0435.",
-                pressed_by,
-            )
-        )
-        return
-        try:
-            index = int(parts[1])
-        except ValueError:
-            return
-        if not user.get("vip_reward_pending"):
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u041d\u0430\u0433\u0440\u0430\u0434\u0430 VIP \u0443\u0436\u0435 \u043f\u043e\u043b\u0443\u0447\u0435\u043d\u0430.",
-                    pressed_by,
-                )
-            )
-            return
-        cards = filter_existing_cards(by_rarity).get("exclusive", [])
-        if not cards:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u041f\u043e\u043a\u0430 \u043d\u0435\u0442 \u044d\u043a\u0441\u043a\u043b\u044e\u0437\u0438\u0432\u043d\u044b\u0445 \u0441\u043e\u0441\u0438\u0441\u043e\u043a.",
-                    pressed_by,
-                )
-            )
-            return
-        index = max(0, min(index, len(cards) - 1))
-        card = cards[index]
-        user["inventory"].append(make_inventory_item(card.file))
-        user["vip_reward_pending"] = False
-        lock = context.application.bot_data["db_lock"]
-        async with lock:
-            save_db(db)
-        await query.message.reply_text(
+
+
+def resolve_inventory_item(
+    user: Dict[str, object],
+    item_id: str,
+    card_map: Dict[str, Card],
+    *,
+    require_price: bool = False,
+) -> Tuple[Optional[Dict[str, object]], Optional[Card], Optional[str]]:
+    item = find_inventory_item(user, item_id)
+    if not item:
+        return None, None, "\u042d\u0442\u0430 \u0441\u043e\u0441\u0438\u0441\u043a\u0430 \u0443\u0436\u0435 \u043f\u0440\u043e\u0434\u0430\u043d\u0430."
+    card = card_map.get(item.get("file"))
+    if require_price and (not card or card.price is None):
+        return item, None, "\u0426\u0435\u043d\u0430 \u043d\u0435 \u0437\u0430\u0434\u0430\u043d\u0430, \u043f\u0440\u043e\u0434\u0430\u0442\u044c \u043d\u0435\u043b\u044c\u0437\u044f."
+    if not card:
+        return item, None, "\u041a\u0430\u0440\u0442\u043e\u0447\u043a\u0430 \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d\u0430."
+    return item, card, None
+
+
+async def my_rarity_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    rarity = parts[1]
+    await show_inventory_card(
+        query.message,
+        user,
+        card_map,
+        rarity,
+        0,
+        pressed_by=pressed_by,
+        context=context,
+    )
+
+
+async def my_nav_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    rarity = parts[1]
+    index = int(parts[2])
+    await edit_inventory_card(
+        query.message, user, card_map, rarity, index, pressed_by=pressed_by
+    )
+
+
+async def my_sell_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    item_id = parts[1]
+    rarity = parts[2]
+    index = int(parts[3])
+    item, card, error = resolve_inventory_item(user, item_id, card_map, require_price=True)
+    if error:
+        await query.message.reply_text(apply_pressed_by(error, pressed_by))
+        return
+    sale_price = calc_sale_price(card) or 0
+    currency = card_currency(card)
+    sale_label = format_short_amount(sale_price, currency)
+    original_label = format_short_amount(card.price, currency)
+    confirm_caption = apply_pressed_by(
+        "\n".join(
+            [
+                "\u041f\u0440\u043e\u0434\u0430\u0442\u044c \u044d\u0442\u0443 \u0441\u043e\u0441\u0438\u0441\u043a\u0443?",
+                f"{escape_html(format_card_label(card))} - {sale_label} <s>{escape_html(original_label)}</s>",
+            ]
+        ),
+        pressed_by,
+    )
+    await query.message.edit_caption(
+        caption=confirm_caption,
+        reply_markup=build_my_sell_confirm_keyboard(item_id, rarity, index),
+        parse_mode=ParseMode.HTML,
+    )
+
+
+async def my_sell_cancel_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    rarity = parts[2]
+    index = int(parts[3])
+    await edit_inventory_card(
+        query.message,
+        user,
+        card_map,
+        rarity,
+        index,
+        pressed_by=pressed_by,
+    )
+
+
+async def my_sell_confirm_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    item_id = parts[1]
+    rarity = parts[2]
+    index = int(parts[3])
+    item, card, error = resolve_inventory_item(user, item_id, card_map, require_price=True)
+    if error:
+        await query.message.reply_text(apply_pressed_by(error, pressed_by))
+        return
+    sale_price = calc_sale_price(card) or 0
+    if card_currency(card) == "stars":
+        user["stars"] = get_star_balance(user) + sale_price
+    else:
+        user["balance"] = int(user.get("balance", 0)) + sale_price
+    remove_inventory_item(user, item)
+    mark_db_dirty(context)
+    items_left = filter_inventory_by_rarity(user, card_map, rarity)
+    if not items_left:
+        await query.message.edit_caption(
             apply_pressed_by(
-                f"VIP \u043d\u0430\u0433\u0440\u0430\u0434\u0430 \u043f\u043e\u043b\u0443\u0447\u0435\u043d\u0430: {card_display_name(card)}.",
+                "\u0421\u043e\u0441\u0438\u0441\u043e\u043a \u044d\u0442\u043e\u0439 \u0440\u0435\u0434\u043a\u043e\u0441\u0442\u0438 \u0431\u043e\u043b\u044c\u0448\u0435 \u043d\u0435\u0442.",
                 pressed_by,
-            )
+            ),
+            reply_markup=BACK_TO_MY_MENU_MARKUP,
+        )
+    else:
+        new_index = min(index, len(items_left) - 1)
+        await edit_inventory_card(
+            query.message,
+            user,
+            card_map,
+            rarity,
+            new_index,
+            pressed_by=pressed_by,
         )
+    await query.message.reply_text(
+        apply_pressed_by(
+            f"\u041f\u0440\u043e\u0434\u0430\u043d\u043e \u0437\u0430 {format_short_amount(sale_price, card_currency(card))}.",
+            pressed_by,
+        )
+    )
+
+
+async def my_upgrade_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    item_id = parts[1]
+    rarity = parts[2]
+    index = int(parts[3])
+    item, card, error = resolve_inventory_item(user, item_id, card_map)
+    if error:
+        await query.message.reply_text(apply_pressed_by(error, pressed_by))
         return
-    if action == "trade_accept_btn" and len(parts) > 1:
-        token = parts[1]
-        trade = db.get("trades", {}).get(token)
-        if not trade or trade.get("status") != "open":
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u0422\u0440\u0435\u0439\u0434 \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d \u0438\u043b\u0438 \u0437\u0430\u043a\u0440\u044b\u0442.",
-                    pressed_by,
-                )
-            )
-            return
-        if trade.get("to_id") != str(tg_user.id):
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u042d\u0442\u043e\u0442 \u0442\u0440\u0435\u0439\u0434 \u043f\u0440\u0435\u0434\u043d\u0430\u0437\u043d\u0430\u0447\u0435\u043d \u0434\u0440\u0443\u0433\u043e\u043c\u0443 \u0438\u0433\u0440\u043e\u043a\u0443.",
-                    pressed_by,
-                )
-            )
-            return
-        trade["status"] = "accepting"
-        lock = context.application.bot_data["db_lock"]
-        async with lock:
-            save_db(db)
-        from_id = trade.get("from_id")
-        from_user = db.get("users", {}).get(from_id, {})
-        offered_item = find_inventory_item(from_user, trade.get("from_item_id", ""))
-        if not offered_item:
-            db.get("trades", {}).pop(token, None)
-            lock = context.application.bot_data["db_lock"]
-            async with lock:
-                save_db(db)
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u0422\u0440\u0435\u0439\u0434 \u043e\u0442\u043c\u0435\u043d\u0451\u043d: \u0441\u043e\u0441\u0438\u0441\u043a\u0438 \u043d\u0435\u0442 \u0443 \u0430\u0432\u0442\u043e\u0440\u0430.",
-                    pressed_by,
-                )
-            )
-            return
-        offered_card = card_map.get(offered_item.get("file"))
-        offer_text = f"\u0422\u044b \u043f\u043e\u043b\u0443\u0447\u0438\u0448\u044c: {card_display_name(offered_card)}"
-        caption = apply_pressed_by(
-            "\n".join(
-                [
-                    f"\u0422\u0440\u0435\u0439\u0434 \u043e\u0442: {trade.get('from_tag') or trade.get('from_name') or from_id}",
-                    offer_text,
-                    "\u0412\u044b\u0431\u0435\u0440\u0438 \u0441\u0432\u043e\u044e \u0441\u043e\u0441\u0438\u0441\u043a\u0443 \u0434\u043b\u044f \u043e\u0431\u043c\u0435\u043d\u0430 \u0438\u043b\u0438 \u043d\u0430\u0436\u043c\u0438 \u00ab\u041d\u0438\u0447\u0435\u0433\u043e \u043d\u0435 \u0432\u044b\u0431\u0438\u0440\u0430\u0442\u044c\u00bb.",
-                ]
-            ),
-            pressed_by,
-        )
-        menu_path = get_cached_menu_image(
-            "trade_accept",
-            "\u0422\u0440\u0435\u0439\u0434",
-            "\u0412\u044b\u0431\u0435\u0440\u0438 \u0441\u043e\u0441\u0438\u0441\u043a\u0443",
-        )
-        with menu_path.open("rb") as photo:
-            await send_or_edit_photo(
-                query.message,
-                photo,
-                caption,
-                build_trade_rarity_keyboard(token, "accept"),
-                prefer_edit=False,
-                context=context,
-                owner_id=tg_user.id,
-            )
+    user_label = get_user_label(tg_user)
+    caption = apply_pressed_by(
+        build_upgrade_warning_caption(user_label, card),
+        pressed_by,
+    )
+    await query.message.edit_caption(
+        caption=caption,
+        reply_markup=build_my_upgrade_confirm_keyboard(item_id, rarity, index),
+    )
+
+
+async def my_upgrade_cancel_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    item_id = parts[1]
+    rarity = parts[2]
+    index = int(parts[3])
+    item, card, error = resolve_inventory_item(user, item_id, card_map)
+    if error:
+        await query.message.reply_text(apply_pressed_by(error, pressed_by))
         return
+    items_in_rarity = filter_inventory_by_rarity(user, card_map, rarity)
+    caption = apply_pressed_by(
+        build_inventory_caption(card, index, len(items_in_rarity)),
+        pressed_by,
+    )
+    await edit_caption_if_changed(
+        query.message,
+        caption,
+        build_inventory_keyboard(rarity, index, len(items_in_rarity), item_id),
+    )
 
-    if action == "trade_accept_none" and len(parts) > 1:
-        token = parts[1]
-        trade = db.get("trades", {}).get(token)
-        if not trade or trade.get("status") != "accepting":
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u0422\u0440\u0435\u0439\u0434 \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d \u0438\u043b\u0438 \u0437\u0430\u043a\u0440\u044b\u0442.",
-                    pressed_by,
-                )
-            )
-            return
-        if trade.get("to_id") != str(tg_user.id):
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u042d\u0442\u043e\u0442 \u0442\u0440\u0435\u0439\u0434 \u043f\u0440\u0435\u0434\u043d\u0430\u0437\u043d\u0430\u0447\u0435\u043d \u0434\u0440\u0443\u0433\u043e\u043c\u0443 \u0438\u0433\u0440\u043e\u043a\u0443.",
-                    pressed_by,
-                )
-            )
-            return
-        from_id = trade.get("from_id")
-        from_user = db.get("users", {}).get(from_id)
-        to_user = db.get("users", {}).get(str(tg_user.id))
-        if not from_user or not to_user:
-            return
-        offered_item = find_inventory_item(from_user, trade.get("from_item_id", ""))
-        if not offered_item:
-            db.get("trades", {}).pop(token, None)
-            lock = context.application.bot_data["db_lock"]
-            async with lock:
-                save_db(db)
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u0422\u0440\u0435\u0439\u0434 \u043e\u0442\u043c\u0435\u043d\u0451\u043d: \u0441\u043e\u0441\u0438\u0441\u043a\u0438 \u043d\u0435\u0442 \u0443 \u0430\u0432\u0442\u043e\u0440\u0430.",
-                    pressed_by,
-                )
-            )
-            return
-        trade["to_item_id"] = None
-        trade["status"] = "confirming"
-        lock = context.application.bot_data["db_lock"]
-        async with lock:
-            save_db(db)
-        offered_card = card_map.get(offered_item.get("file"))
-        from_label = trade_user_label(trade, "from")
-        to_label = trade_user_label(trade, "to")
-        offer_text = (
-            card_display_name(offered_card) if offered_card else "\u0441\u043e\u0441\u0438\u0441\u043a\u0443"
-        )
-        summary = "\n".join(
-            [
-                f"{from_label} \u043e\u0442\u0434\u0430\u0451\u0442: {offer_text}",
-                f"{to_label} \u043e\u0442\u0434\u0430\u0451\u0442: \u043d\u0438\u0447\u0435\u0433\u043e",
-                "\u041f\u043e\u0434\u0442\u0432\u0435\u0440\u0434\u0438 \u0442\u0440\u0435\u0439\u0434.",
-            ]
-        )
-        try:
-            sent = await context.bot.send_message(
-                chat_id=int(from_id),
-                text=summary,
-                reply_markup=build_trade_confirm_keyboard(token),
-            )
-            set_message_owner(
-                context.application.bot_data, sent, int(trade["from_id"])
-            )
-        except Exception:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u041d\u0435 \u0443\u0434\u0430\u043b\u043e\u0441\u044c \u043e\u0442\u043f\u0440\u0430\u0432\u0438\u0442\u044c \u0437\u0430\u043f\u0440\u043e\u0441 \u043d\u0430 \u043f\u043e\u0434\u0442\u0432\u0435\u0440\u0436\u0434\u0435\u043d\u0438\u0435.",
-                    pressed_by,
-                )
-            )
+
+async def my_upgrade_confirm_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    item_id = parts[1]
+    item, card, error = resolve_inventory_item(user, item_id, card_map)
+    if error:
+        await query.message.reply_text(apply_pressed_by(error, pressed_by))
+        return
+    next_rarity = get_next_rarity(card.rarity)
+    if not next_rarity:
         await query.message.reply_text(
             apply_pressed_by(
-                "\u0417\u0430\u043f\u0440\u043e\u0441 \u043e\u0442\u043f\u0440\u0430\u0432\u043b\u0435\u043d. \u0416\u0434\u0438 \u043f\u043e\u0434\u0442\u0432\u0435\u0440\u0436\u0434\u0435\u043d\u0438\u044f.",
+                "\u042d\u0442\u043e \u043c\u0430\u043a\u0441\u0438\u043c\u0430\u043b\u044c\u043d\u0430\u044f \u0440\u0435\u0434\u043a\u043e\u0441\u0442\u044c.",
                 pressed_by,
             )
         )
         return
-
-    if action == "trade_confirm" and len(parts) > 1:
-        token = parts[1]
-        trade = db.get("trades", {}).get(token)
-        if not trade or trade.get("status") != "confirming":
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u0422\u0440\u0435\u0439\u0434 \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d \u0438\u043b\u0438 \u0437\u0430\u043a\u0440\u044b\u0442.",
-                    pressed_by,
-                )
-            )
-            return
-        if trade.get("from_id") != str(tg_user.id):
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u042d\u0442\u043e \u043d\u0435 \u0442\u0432\u043e\u0439 \u0442\u0440\u0435\u0439\u0434.",
-                    pressed_by,
-                )
-            )
-            return
-        from_id = trade.get("from_id")
-        to_id = trade.get("to_id")
-        from_user = db.get("users", {}).get(from_id)
-        to_user = db.get("users", {}).get(to_id)
-        if not from_user or not to_user:
-            return
-        offered_item = find_inventory_item(from_user, trade.get("from_item_id", ""))
-        if not offered_item:
-            db.get("trades", {}).pop(token, None)
-            lock = context.application.bot_data["db_lock"]
-            async with lock:
-                save_db(db)
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u0422\u0440\u0435\u0439\u0434 \u043e\u0442\u043c\u0435\u043d\u0451\u043d: \u0441\u043e\u0441\u0438\u0441\u043a\u0438 \u043d\u0435\u0442 \u0443 \u0430\u0432\u0442\u043e\u0440\u0430.",
-                    pressed_by,
-                )
-            )
-            return
-        give_item = None
-        to_item_id = trade.get("to_item_id")
-        if to_item_id:
-            give_item = find_inventory_item(to_user, to_item_id)
-            if not give_item:
-                db.get("trades", {}).pop(token, None)
-                lock = context.application.bot_data["db_lock"]
-                async with lock:
-                    save_db(db)
-                await query.message.reply_text(
-                    apply_pressed_by(
-                        "\u0422\u0440\u0435\u0439\u0434 \u043e\u0442\u043c\u0435\u043d\u0451\u043d: \u0441\u043e\u0441\u0438\u0441\u043a\u0438 \u043d\u0435\u0442 \u0443 \u0432\u0442\u043e\u0440\u043e\u0439 \u0441\u0442\u043e\u0440\u043e\u043d\u044b.",
-                        pressed_by,
-                    )
-                )
-                return
-        from_user["inventory"] = [
-            item
-            for item in from_user.get("inventory", [])
-            if item.get("id") != offered_item.get("id")
-        ]
-        to_user.setdefault("inventory", []).append(offered_item)
-        if give_item:
-            to_user["inventory"] = [
-                item
-                for item in to_user.get("inventory", [])
-                if item.get("id") != give_item.get("id")
-            ]
-            from_user.setdefault("inventory", []).append(give_item)
-        db.get("trades", {}).pop(token, None)
-        lock = context.application.bot_data["db_lock"]
-        async with lock:
-            save_db(db)
-        offered_card = card_map.get(offered_item.get("file"))
-        give_card = card_map.get(give_item.get("file")) if give_item else None
-        receive_text = (
-            card_display_name(give_card) if give_card else "\u043d\u0438\u0447\u0435\u0433\u043e"
+    roll = random.getrandbits(1)
+    user_label = get_user_label(tg_user)
+    if roll == 0:
+        remove_inventory_item(user, item)
+        mark_db_dirty(context)
+        await query.message.edit_caption(
+            caption=apply_pressed_by(
+                build_upgrade_fail_caption(user_label),
+                pressed_by,
+            ),
+            reply_markup=BACK_TO_MY_MENU_MARKUP,
         )
+        return
+    available_by_rarity = filter_existing_cards(by_rarity)
+    next_cards = available_by_rarity.get(next_rarity, [])
+    if not next_cards:
         await query.message.reply_text(
             apply_pressed_by(
-                f"\u0422\u0440\u0435\u0439\u0434 \u0437\u0430\u0432\u0435\u0440\u0448\u0451\u043d. \u0422\u044b \u043f\u043e\u043b\u0443\u0447\u0438\u043b {receive_text}.",
+                "\u041d\u0435\u0442 \u043a\u0430\u0440\u0442\u043e\u0447\u0435\u043a \u0441\u043b\u0435\u0434\u0443\u044e\u0449\u0435\u0439 \u0440\u0435\u0434\u043a\u043e\u0441\u0442\u0438.",
                 pressed_by,
             )
         )
-        try:
-            offer_text = (
-                card_display_name(offered_card) if offered_card else "\u0441\u043e\u0441\u0438\u0441\u043a\u0443"
-            )
-            await context.bot.send_message(
-                chat_id=int(to_id),
-                text=f"\u0422\u0440\u0435\u0439\u0434 \u0437\u0430\u0432\u0435\u0440\u0448\u0451\u043d. \u0422\u044b \u043f\u043e\u043b\u0443\u0447\u0438\u043b {offer_text}.",
-            )
-        except Exception:
-            pass
         return
+    upgraded = random.choice(next_cards)
+    item["file"] = upgraded.file
+    mark_db_dirty(context)
+    items_in_new = filter_inventory_by_rarity(user, card_map, upgraded.rarity)
+    new_index = next(
+        (i for i, it in enumerate(items_in_new) if it.get("id") == item_id),
+        0,
+    )
+    await edit_inventory_card(
+        query.message,
+        user,
+        card_map,
+        upgraded.rarity,
+        new_index,
+        pressed_by=pressed_by,
+    )
 
-    if action == "trade_confirm_cancel" and len(parts) > 1:
-        token = parts[1]
-        trade = db.get("trades", {}).get(token)
-        if not trade:
-            return
-        if trade.get("from_id") != str(tg_user.id):
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u042d\u0442\u043e \u043d\u0435 \u0442\u0432\u043e\u0439 \u0442\u0440\u0435\u0439\u0434.",
-                    pressed_by,
-                )
-            )
-            return
-        to_id = trade.get("to_id")
-        db.get("trades", {}).pop(token, None)
-        lock = context.application.bot_data["db_lock"]
-        async with lock:
-            save_db(db)
+
+async def shop_rarity_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    rarity = parts[1]
+    await show_shop_card(
+        query.message,
+        rarity,
+        0,
+        by_rarity.get(rarity, []),
+        pressed_by=pressed_by,
+        context=context,
+    )
+
+
+async def shop_nav_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    rarity = parts[1]
+    index = int(parts[2])
+    await edit_shop_card(
+        query.message,
+        rarity,
+        index,
+        by_rarity.get(rarity, []),
+        pressed_by=pressed_by,
+        context=context,
+    )
+
+
+async def shop_buy_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    rarity = parts[1]
+    index = int(parts[2])
+    cards = by_rarity.get(rarity, [])
+    if not cards:
         await query.message.reply_text(
             apply_pressed_by(
-                "\u0422\u0440\u0435\u0439\u0434 \u043e\u0442\u043c\u0435\u043d\u0451\u043d.",
+                "\u041d\u0435\u0442 \u043a\u0430\u0440\u0442\u043e\u0447\u0435\u043a \u0434\u043b\u044f \u043f\u043e\u043a\u0443\u043f\u043a\u0438.",
                 pressed_by,
             )
         )
-        try:
-            if to_id:
-                await context.bot.send_message(
-                    chat_id=int(to_id),
-                    text="\u0422\u0440\u0435\u0439\u0434 \u043e\u0442\u043c\u0435\u043d\u0451\u043d.",
-                )
-        except Exception:
-            pass
         return
-
-    if action == "trade_rarity_menu" and len(parts) > 2:
-        role = parts[1]
-        token = parts[2]
-        trade = db.get("trades", {}).get(token)
-        if not trade:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u0422\u0440\u0435\u0439\u0434 \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d.",
-                    pressed_by,
-                )
-            )
-            return
-        if role == "offer" and trade.get("from_id") != str(tg_user.id):
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u042d\u0442\u043e \u043d\u0435 \u0442\u0432\u043e\u0439 \u0442\u0440\u0435\u0439\u0434.",
-                    pressed_by,
-                )
-            )
-            return
-        if role == "accept" and trade.get("to_id") != str(tg_user.id):
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u042d\u0442\u043e \u043d\u0435 \u0442\u0432\u043e\u0439 \u0442\u0440\u0435\u0439\u0434.",
-                    pressed_by,
-                )
-            )
-            return
-        expected_status = "draft" if role == "offer" else "accepting"
-        if trade.get("status") != expected_status:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u0422\u0440\u0435\u0439\u0434 \u043d\u0435 \u0433\u043e\u0442\u043e\u0432 \u043a \u044d\u0442\u043e\u043c\u0443 \u0434\u0435\u0439\u0441\u0442\u0432\u0438\u044e.",
-                    pressed_by,
-                )
+    index = max(0, min(index, len(cards) - 1))
+    card = cards[index]
+    if card.rarity == "exclusive":
+        lock = context.application.bot_data["db_lock"]
+        async with lock:
+            remaining, _ = get_exclusive_stock(db, card.file)
+            if remaining <= 0:
+                await query.message.reply_text(
+                    apply_pressed_by(
+                        "\u042d\u0442\u043e\u0442 \u044d\u043a\u0441\u043a\u043b\u044e\u0437\u0438\u0432 \u0443\u0436\u0435 \u0440\u0430\u0441\u043a\u0443\u043f\u0438\u043b\u0438.",
+                        pressed_by,
+                    )
+                )
+                return
+        if card.price is None:
+            await query.message.reply_text(
+                apply_pressed_by(
+                    "\u0426\u0435\u043d\u0430 \u043d\u0435 \u0437\u0430\u0434\u0430\u043d\u0430, \u043a\u0443\u043f\u0438\u0442\u044c \u043d\u0435\u043b\u044c\u0437\u044f.",
+                    pressed_by,
+                )
+            )
+            return
+        price_int = int(card.price)
+        stars = get_star_balance(user)
+        if stars < price_int:
+            await query.message.reply_text(
+                apply_pressed_by(
+                    f"\u041d\u0443\u0436\u043d\u043e {format_short_amount(price_int, 'stars')} \u0434\u043b\u044f \u043f\u043e\u043a\u0443\u043f\u043a\u0438.",
+                    pressed_by,
+                )
+            )
+            return
+        async with lock:
+            if not consume_exclusive_stock(db, card.file):
+                await query.message.reply_text(
+                    apply_pressed_by(
+                        "\u042d\u0442\u043e\u0442 \u044d\u043a\u0441\u043a\u043b\u044e\u0437\u0438\u0432 \u0443\u0436\u0435 \u0440\u0430\u0441\u043a\u0443\u043f\u0438\u043b\u0438.",
+                        pressed_by,
+                    )
+                )
+                return
+            user["stars"] = stars - price_int
+            user["inventory"].append(make_inventory_item(card.file))
+            mark_db_dirty(context)
+        await query.message.reply_text(
+            apply_pressed_by(
+                f"\u041a\u0443\u043f\u043b\u0435\u043d\u043e \u0437\u0430 {format_short_amount(price_int, 'stars')}.",
+                pressed_by,
+            )
+        )
+        return
+    if card.price is None:
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u0426\u0435\u043d\u0430 \u043d\u0435 \u0437\u0430\u0434\u0430\u043d\u0430, \u043a\u0443\u043f\u0438\u0442\u044c \u043d\u0435\u043b\u044c\u0437\u044f.",
+                pressed_by,
             )
-            return
-        await query.message.edit_reply_markup(
-            reply_markup=build_trade_rarity_keyboard(token, role)
         )
         return
-    if action == "trade_rarity" and len(parts) > 3:
-        role = parts[1]
-        token = parts[2]
-        rarity = parts[3]
-        trade = db.get("trades", {}).get(token)
-        if not trade:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u0422\u0440\u0435\u0439\u0434 \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d.",
-                    pressed_by,
-                )
-            )
-            return
-        if role == "offer" and trade.get("from_id") != str(tg_user.id):
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u042d\u0442\u043e \u043d\u0435 \u0442\u0432\u043e\u0439 \u0442\u0440\u0435\u0439\u0434.",
-                    pressed_by,
-                )
-            )
-            return
-        if role == "accept" and trade.get("to_id") != str(tg_user.id):
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u042d\u0442\u043e \u043d\u0435 \u0442\u0432\u043e\u0439 \u0442\u0440\u0435\u0439\u0434.",
-                    pressed_by,
-                )
-            )
-            return
-        expected_status = "draft" if role == "offer" else "accepting"
-        if trade.get("status") != expected_status:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u0422\u0440\u0435\u0439\u0434 \u043d\u0435 \u0433\u043e\u0442\u043e\u0432 \u043a \u044d\u0442\u043e\u043c\u0443 \u0434\u0435\u0439\u0441\u0442\u0432\u0438\u044e.",
-                    pressed_by,
-                )
+    price = int(card.price)
+    used_discount = False
+    discount_lock = context.application.bot_data.setdefault(
+        "discount_lock", asyncio.Lock()
+    )
+    async with discount_lock:
+        discounts = get_current_discounts(context.application.bot_data)
+        discount = get_discount_item(discounts, card.file)
+        if discount and is_discount_active(discount):
+            price = int(discount.get("discount_price", price))
+            remaining = int(discount.get("remaining", 0))
+            discount["remaining"] = max(0, remaining - 1)
+            used_discount = True
+            mark_discounts_dirty(context)
+    balance = int(user.get("balance", 0))
+    if balance < price:
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u041d\u0435\u0434\u043e\u0441\u0442\u0430\u0442\u043e\u0447\u043d\u043e \u0441\u0440\u0435\u0434\u0441\u0442\u0432.",
+                pressed_by,
             )
-            return
-        await show_trade_card(
-            query.message,
-            user,
-            card_map,
-            token,
-            role,
-            rarity,
-            0,
-            pressed_by=pressed_by,
-            prefer_edit=True,
-            context=context,
         )
         return
-    if action == "trade_nav" and len(parts) > 4:
-        role = parts[1]
-        token = parts[2]
-        rarity = parts[3]
-        try:
-            index = int(parts[4])
-        except ValueError:
-            return
-        trade = db.get("trades", {}).get(token)
-        if not trade:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u0422\u0440\u0435\u0439\u0434 \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d.",
-                    pressed_by,
-                )
-            )
-            return
-        if role == "offer" and trade.get("from_id") != str(tg_user.id):
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u042d\u0442\u043e \u043d\u0435 \u0442\u0432\u043e\u0439 \u0442\u0440\u0435\u0439\u0434.",
-                    pressed_by,
-                )
-            )
-            return
-        if role == "accept" and trade.get("to_id") != str(tg_user.id):
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u042d\u0442\u043e \u043d\u0435 \u0442\u0432\u043e\u0439 \u0442\u0440\u0435\u0439\u0434.",
-                    pressed_by,
-                )
-            )
-            return
-        expected_status = "draft" if role == "offer" else "accepting"
-        if trade.get("status") != expected_status:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u0422\u0440\u0435\u0439\u0434 \u043d\u0435 \u0433\u043e\u0442\u043e\u0432 \u043a \u044d\u0442\u043e\u043c\u0443 \u0434\u0435\u0439\u0441\u0442\u0432\u0438\u044e.",
-                    pressed_by,
-                )
-            )
-            return
-        await edit_trade_card(
-            query.message,
-            user,
-            card_map,
-            token,
-            role,
-            rarity,
-            index,
-            pressed_by=pressed_by,
-            context=context,
+    user["balance"] = balance - price
+    user["inventory"].append(make_inventory_item(card.file))
+    mark_db_dirty(context)
+    price_label = format_short_amount(price, "rub")
+    if used_discount:
+        price_label += " (\u0430\u043a\u0446\u0438\u044f)"
+    await query.message.reply_text(
+        apply_pressed_by(
+            f"\u041a\u0443\u043f\u043b\u0435\u043d\u043e \u0437\u0430 {price_label}.",
+            pressed_by,
         )
+    )
+
+
+async def discount_view_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    try:
+        view_index = int(parts[1]) - 1
+    except ValueError:
         return
-    if action == "trade_pick" and len(parts) > 5:
-        role = parts[1]
-        token = parts[2]
-        item_id = parts[3]
-        rarity = parts[4]
-        try:
-            index = int(parts[5])
-        except ValueError:
-            return
-        trade = db.get("trades", {}).get(token)
-        if not trade:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u0422\u0440\u0435\u0439\u0434 \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d.",
-                    pressed_by,
-                )
-            )
-            return
-        if role == "offer":
-            if trade.get("from_id") != str(tg_user.id):
-                await query.message.reply_text(
-                    apply_pressed_by(
-                        "\u042d\u0442\u043e \u043d\u0435 \u0442\u0432\u043e\u0439 \u0442\u0440\u0435\u0439\u0434.",
-                        pressed_by,
-                    )
-                )
-                return
-            if trade.get("status") != "draft":
-                await query.message.reply_text(
-                    apply_pressed_by(
-                        "\u0422\u0440\u0435\u0439\u0434 \u0443\u0436\u0435 \u043e\u0442\u043a\u0440\u044b\u0442.",
-                        pressed_by,
-                    )
-                )
-                return
-            item = find_inventory_item(user, item_id)
-            if not item:
-                await query.message.reply_text(
-                    apply_pressed_by(
-                        "\u042d\u0442\u0430 \u0441\u043e\u0441\u0438\u0441\u043a\u0430 \u0443\u0436\u0435 \u043d\u0435 \u0432 \u0438\u043d\u0432\u0435\u043d\u0442\u0430\u0440\u0435.",
-                        pressed_by,
-                    )
-                )
-                return
-            trade["from_item_id"] = item_id
-            trade["status"] = "open"
-            lock = context.application.bot_data["db_lock"]
-            async with lock:
-                save_db(db)
-            target_label = (
-                f"@{trade.get('to_tag')}"
-                if trade.get("to_tag")
-                else trade.get("to_name")
-            )
-            text = apply_pressed_by(
-                f"\u0422\u0440\u0435\u0439\u0434 \u043e\u0442\u043f\u0440\u0430\u0432\u043b\u0435\u043d \u0434\u043b\u044f {target_label}.",
+    discounts = await ensure_discounts(context)
+    items = discounts.get("items", [])
+    if not isinstance(items, list) or view_index < 0 or view_index >= len(items):
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u042d\u0442\u0430 \u0430\u043a\u0446\u0438\u044f \u0443\u0436\u0435 \u043d\u0435\u0434\u043e\u0441\u0442\u0443\u043f\u043d\u0430.",
                 pressed_by,
             )
-            await edit_message_text(
-                query.message,
-                text,
-                build_trade_accept_keyboard(token),
-            )
-            set_message_owner(
-                context.application.bot_data, query.message, int(trade["to_id"])
+        )
+        return
+    item = items[view_index]
+    filename = str(item.get("file") or "")
+    card = card_map.get(filename)
+    if not card:
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u041a\u0430\u0440\u0442\u043e\u0447\u043a\u0430 \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d\u0430.",
+                pressed_by,
             )
-            offered_card = card_map.get(item.get("file"))
-            offer_line = (
-                f"\u0422\u0435\u0431\u0435 \u043f\u0440\u0435\u0434\u043b\u0430\u0433\u0430\u044e\u0442: {card_display_name(offered_card)}"
-                if offered_card
-                else "\u0422\u0435\u0431\u0435 \u043f\u0440\u0435\u0434\u043b\u0430\u0433\u0430\u044e\u0442 \u0442\u0440\u0435\u0439\u0434."
+        )
+        return
+    caption = apply_pressed_by(
+        build_discount_caption(card, view_index, len(items), item),
+        pressed_by,
+    )
+    path = get_card_media_path(card)
+    if not path.exists():
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u0424\u043e\u0442\u043e \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d\u043e \u0434\u043b\u044f \u044d\u0442\u043e\u0439 \u043a\u0430\u0440\u0442\u043e\u0447\u043a\u0438.",
+                pressed_by,
             )
-            try:
-                sent = await context.bot.send_message(
-                    chat_id=int(trade["to_id"]),
-                    text="\n".join(
-                        [
-                            f"\u0422\u0440\u0435\u0439\u0434 \u043e\u0442: {trade.get('from_tag') or trade.get('from_name')}",
-                            offer_line,
-                        ]
-                    ),
-                    reply_markup=build_trade_accept_keyboard(token),
-                )
-                set_message_owner(
-                    context.application.bot_data, sent, int(trade["to_id"])
-                )
-            except (Forbidden, BadRequest) as exc:
-                message_text = str(exc).lower()
-                if isinstance(exc, Forbidden) or "chat not found" in message_text:
-                    username = os.getenv("PUBLIC_BOT_USERNAME", "sosiskikazikbot").lstrip("@")
-                    link = f"https://t.me/{username}?start=trade"
-                    await query.message.reply_text(
-                        apply_pressed_by(
-                            "\u041d\u0435 \u043c\u043e\u0433\u0443 \u043d\u0430\u043f\u0438\u0441\u0430\u0442\u044c \u043f\u043e\u043b\u044c\u0437\u043e\u0432\u0430\u0442\u0435\u043b\u044e \u0432 \u041b\u0421.\n"
-                            "\u041f\u0443\u0441\u0442\u044c \u043e\u043d \u0437\u0430\u0439\u0434\u0451\u0442 \u0432 \u043b\u0438\u0447\u043a\u0443 \u0441 \u0431\u043e\u0442\u043e\u043c \u0438 \u043d\u0430\u0436\u043c\u0451\u0442 /start:\n"
-                            f"{link}",
-                            pressed_by,
-                        )
-                    )
-                else:
-                    await query.message.reply_text(
-                        apply_pressed_by(
-                            "\u041d\u0435 \u0443\u0434\u0430\u043b\u043e\u0441\u044c \u043e\u0442\u043f\u0440\u0430\u0432\u0438\u0442\u044c \u0442\u0440\u0435\u0439\u0434 \u0432 \u043b\u0438\u0447\u043a\u0443.",
-                            pressed_by,
-                        )
-                    )
-            except Exception:
-                await query.message.reply_text(
-                    apply_pressed_by(
-                        "\u041d\u0435 \u0443\u0434\u0430\u043b\u043e\u0441\u044c \u043e\u0442\u043f\u0440\u0430\u0432\u0438\u0442\u044c \u0442\u0440\u0435\u0439\u0434 \u0432 \u043b\u0438\u0447\u043a\u0443.",
-                        pressed_by,
-                    )
-                )
-            return
-        if role == "accept":
-            if trade.get("to_id") != str(tg_user.id):
-                await query.message.reply_text(
-                    apply_pressed_by(
-                        "\u042d\u0442\u043e \u043d\u0435 \u0442\u0432\u043e\u0439 \u0442\u0440\u0435\u0439\u0434.",
-                        pressed_by,
-                    )
-                )
-                return
-            if trade.get("status") != "accepting":
-                await query.message.reply_text(
-                    apply_pressed_by(
-                        "\u0422\u0440\u0435\u0439\u0434 \u043d\u0435 \u0433\u043e\u0442\u043e\u0432 \u043a \u043e\u0431\u043c\u0435\u043d\u0443.",
-                        pressed_by,
-                    )
-                )
-                return
-            from_id = trade.get("from_id")
-            from_user = db.get("users", {}).get(from_id)
-            to_user = db.get("users", {}).get(str(tg_user.id))
-            if not from_user or not to_user:
-                return
-            offered_item = find_inventory_item(from_user, trade.get("from_item_id", ""))
-            if not offered_item:
-                db.get("trades", {}).pop(token, None)
-                lock = context.application.bot_data["db_lock"]
-                async with lock:
-                    save_db(db)
-                await query.message.reply_text(
-                    apply_pressed_by(
-                        "\u0422\u0440\u0435\u0439\u0434 \u043e\u0442\u043c\u0435\u043d\u0451\u043d: \u0441\u043e\u0441\u0438\u0441\u043a\u0438 \u043d\u0435\u0442 \u0443 \u0430\u0432\u0442\u043e\u0440\u0430.",
-                        pressed_by,
-                    )
-                )
-                return
-            offered_card = card_map.get(offered_item.get("file"))
-            give_item = find_inventory_item(to_user, item_id)
-            if not give_item:
-                await query.message.reply_text(
-                    apply_pressed_by(
-                        "\u042d\u0442\u0430 \u0441\u043e\u0441\u0438\u0441\u043a\u0430 \u0443\u0436\u0435 \u043d\u0435 \u0432 \u0438\u043d\u0432\u0435\u043d\u0442\u0430\u0440\u0435.",
-                        pressed_by,
-                    )
-                )
-                return
-            trade["to_item_id"] = give_item.get("id")
-            trade["status"] = "confirming"
-            lock = context.application.bot_data["db_lock"]
-            async with lock:
-                save_db(db)
-            give_card = card_map.get(give_item.get("file"))
-            from_label = trade_user_label(trade, "from")
-            to_label = trade_user_label(trade, "to")
-            offer_text = (
-                card_display_name(offered_card) if offered_card else "\u0441\u043e\u0441\u0438\u0441\u043a\u0443"
+        )
+        return
+    photo = await load_card_media(path)
+    await send_or_edit_photo(
+        query.message,
+        photo,
+        caption,
+        build_discount_view_keyboard(),
+        prefer_edit=True,
+        context=context,
+        owner_id=tg_user.id,
+        parse_mode=ParseMode.HTML,
+    )
+
+
+async def draw_sell_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    item_id = parts[1]
+    item, card, error = resolve_inventory_item(user, item_id, card_map, require_price=True)
+    if error:
+        await query.message.reply_text(apply_pressed_by(error, pressed_by))
+        return
+    sale_price = calc_sale_price(card) or 0
+    currency = card_currency(card)
+    sale_label = format_short_amount(sale_price, currency)
+    original_label = format_short_amount(card.price, currency)
+    confirm_caption = apply_pressed_by(
+        "\n".join(
+            [
+                "\u041f\u0440\u043e\u0434\u0430\u0442\u044c \u044d\u0442\u0443 \u0441\u043e\u0441\u0438\u0441\u043a\u0443?",
+                f"{escape_html(format_card_label(card))} - {sale_label} <s>{escape_html(original_label)}</s>",
+            ]
+        ),
+        pressed_by,
+    )
+    await query.message.edit_caption(
+        caption=confirm_caption,
+        reply_markup=build_draw_sell_confirm_keyboard(item_id),
+        parse_mode=ParseMode.HTML,
+    )
+
+
+async def draw_sell_cancel_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    item_id = parts[1]
+    item, card, error = resolve_inventory_item(user, item_id, card_map)
+    if error:
+        await query.message.reply_text(apply_pressed_by(error, pressed_by))
+        return
+    user_label = get_user_label(tg_user)
+    caption = apply_pressed_by(build_draw_caption(user_label, card), pressed_by)
+    await edit_caption_if_changed(
+        query.message, caption, build_draw_keyboard(item_id)
+    )
+
+
+async def draw_sell_confirm_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    item_id = parts[1]
+    item, card, error = resolve_inventory_item(user, item_id, card_map, require_price=True)
+    if error:
+        await query.message.reply_text(apply_pressed_by(error, pressed_by))
+        return
+    sale_price = calc_sale_price(card) or 0
+    if card_currency(card) == "stars":
+        user["stars"] = get_star_balance(user) + sale_price
+    else:
+        user["balance"] = int(user.get("balance", 0)) + sale_price
+    remove_inventory_item(user, item)
+    mark_db_dirty(context)
+    await query.message.edit_caption(
+        caption=apply_pressed_by(
+            f"\u041f\u0440\u043e\u0434\u0430\u043d\u043e \u0437\u0430 {format_short_amount(sale_price, card_currency(card))}.",
+            pressed_by,
+        ),
+        reply_markup=None,
+    )
+
+
+async def draw_upgrade_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    item_id = parts[1]
+    item, card, error = resolve_inventory_item(user, item_id, card_map)
+    if error:
+        await query.message.reply_text(apply_pressed_by(error, pressed_by))
+        return
+    user_label = get_user_label(tg_user)
+    caption = apply_pressed_by(
+        build_upgrade_warning_caption(user_label, card), pressed_by
+    )
+    await query.message.edit_caption(
+        caption=caption,
+        reply_markup=build_upgrade_confirm_keyboard(item_id),
+    )
+
+
+async def draw_upgrade_cancel_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    item_id = parts[1]
+    item, card, error = resolve_inventory_item(user, item_id, card_map)
+    if error:
+        await query.message.reply_text(apply_pressed_by(error, pressed_by))
+        return
+    user_label = get_user_label(tg_user)
+    caption = apply_pressed_by(build_draw_caption(user_label, card), pressed_by)
+    await edit_caption_if_changed(
+        query.message, caption, build_draw_keyboard(item_id)
+    )
+
+
+async def draw_upgrade_confirm_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    item_id = parts[1]
+    item, card, error = resolve_inventory_item(user, item_id, card_map)
+    if error:
+        await query.message.reply_text(apply_pressed_by(error, pressed_by))
+        return
+    next_rarity = get_next_rarity(card.rarity)
+    if not next_rarity:
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u042d\u0442\u043e \u043c\u0430\u043a\u0441\u0438\u043c\u0430\u043b\u044c\u043d\u0430\u044f \u0440\u0435\u0434\u043a\u043e\u0441\u0442\u044c.",
+                pressed_by,
             )
-            give_text = (
-                card_display_name(give_card) if give_card else "\u0441\u043e\u0441\u0438\u0441\u043a\u0443"
+        )
+        return
+    roll = random.getrandbits(1)
+    user_label = get_user_label(tg_user)
+    if roll == 0:
+        remove_inventory_item(user, item)
+        mark_db_dirty(context)
+        await query.message.edit_caption(
+            caption=apply_pressed_by(
+                build_upgrade_fail_caption(user_label),
+                pressed_by,
+            ),
+            reply_markup=None,
+        )
+        return
+    available_by_rarity = filter_existing_cards(by_rarity)
+    next_cards = available_by_rarity.get(next_rarity, [])
+    if not next_cards:
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u041d\u0435\u0442 \u043a\u0430\u0440\u0442\u043e\u0447\u0435\u043a \u0441\u043b\u0435\u0434\u0443\u044e\u0449\u0435\u0439 \u0440\u0435\u0434\u043a\u043e\u0441\u0442\u0438.",
+                pressed_by,
             )
-            summary = "\n".join(
-                [
-                    f"{from_label} \u043e\u0442\u0434\u0430\u0451\u0442: {offer_text}",
-                    f"{to_label} \u043e\u0442\u0434\u0430\u0451\u0442: {give_text}",
-                    "\u041f\u043e\u0434\u0442\u0432\u0435\u0440\u0434\u0438 \u0442\u0440\u0435\u0439\u0434.",
-                ]
+        )
+        return
+    upgraded = random.choice(next_cards)
+    item["file"] = upgraded.file
+    mark_db_dirty(context)
+    caption = apply_pressed_by(
+        build_upgrade_success_caption(user_label, upgraded),
+        pressed_by,
+    )
+    path = get_card_media_path(upgraded)
+    if not path.exists():
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u0424\u043e\u0442\u043e \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d\u043e \u0434\u043b\u044f \u043d\u043e\u0432\u043e\u0439 \u043a\u0430\u0440\u0442\u043e\u0447\u043a\u0438.",
+                pressed_by,
             )
-            try:
-                sent = await context.bot.send_message(
-                    chat_id=int(from_id),
-                    text=summary,
-                    reply_markup=build_trade_confirm_keyboard(token),
-                )
-                set_message_owner(
-                    context.application.bot_data, sent, int(trade["from_id"])
-                )
-            except Exception:
-                await query.message.reply_text(
-                    apply_pressed_by(
-                        "\u041d\u0435 \u0443\u0434\u0430\u043b\u043e\u0441\u044c \u043e\u0442\u043f\u0440\u0430\u0432\u0438\u0442\u044c \u0437\u0430\u043f\u0440\u043e\u0441 \u043d\u0430 \u043f\u043e\u0434\u0442\u0432\u0435\u0440\u0436\u0434\u0435\u043d\u0438\u0435.",
-                        pressed_by,
-                    )
-                )
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u0417\u0430\u043f\u0440\u043e\u0441 \u043e\u0442\u043f\u0440\u0430\u0432\u043b\u0435\u043d. \u0416\u0434\u0438 \u043f\u043e\u0434\u0442\u0432\u0435\u0440\u0436\u0434\u0435\u043d\u0438\u044f.",
-                    pressed_by,
-                )
+        )
+        return
+    photo = await load_card_media(path)
+    await send_or_edit_photo(
+        query.message,
+        photo,
+        caption,
+        build_draw_keyboard(item_id),
+        prefer_edit=True,
+    )
+
+
+async def stars_buy_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    try:
+        amount = int(parts[1])
+    except ValueError:
+        return
+    if amount not in STARS_TOPUP_AMOUNTS:
+        return
+    await send_stars_invoice(query.message, amount)
+
+
+async def vip_reward_nav_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    try:
+        index = int(parts[1])
+    except ValueError:
+        return
+    cards = filter_existing_cards(by_rarity).get("exclusive", [])
+    if not cards:
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u041f\u043e\u043a\u0430 \u043d\u0435\u0442 \u044d\u043a\u0441\u043a\u043b\u044e\u0437\u0438\u0432\u043d\u044b\u0445 \u0441\u043e\u0441\u0438\u0441\u043e\u043a.",
+                pressed_by,
             )
-            return
-    if action == "trade_cancel" and len(parts) > 1:
-        token = parts[1]
-        trade = db.get("trades", {}).get(token)
-        if not trade or trade.get("from_id") != str(tg_user.id):
-            return
-        db.get("trades", {}).pop(token, None)
-        lock = context.application.bot_data["db_lock"]
-        async with lock:
-            save_db(db)
+        )
+        return
+    await edit_vip_reward_card(
+        query.message, cards, index, pressed_by=pressed_by, context=context
+    )
+
+
+async def vip_reward_pick_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    if user.get("vip_reward_pending"):
+        user["vip_reward_pending"] = False
+        lock = context.application.bot_data["db_lock"]
+        async with lock:
+            save_db(db)
+    await query.message.reply_text(
+        apply_pressed_by(
+            "VIP \u043d\u0430\u0433\u0440\u0430\u0434\u044b \u043e\u0442\u043a\u043b\u044e\u0447\u0435\u043d\u044b. \u042d\u043a\u0441\u043a\u043b\u044e\u0437\u0438\u0432\u044b \u0434\u043e\u0441\u0442\u0443\u043f\u043d\u044b \u0442\u043e\u043b\u044c\u043a\u043e \u0432 \u043c\u0430\u0433\u0430\u0437\u0438\u043d\u0435.",
+            pressed_by,
+        )
+    )
+    return
+    try:
+        index = int(parts[1])
+    except ValueError:
+        return
+    if not user.get("vip_reward_pending"):
         await query.message.reply_text(
             apply_pressed_by(
-                "\u0422\u0440\u0435\u0439\u0434 \u043e\u0442\u043c\u0435\u043d\u0451\u043d.",
+                "\u041d\u0430\u0433\u0440\u0430\u0434\u0430 VIP \u0443\u0436\u0435 \u043f\u043e\u043b\u0443\u0447\u0435\u043d\u0430.",
                 pressed_by,
             )
         )
         return
-    if action == "trade_decline" and len(parts) > 1:
-        token = parts[1]
-        trade = db.get("trades", {}).get(token)
-        if not trade:
-            return
-        if trade.get("to_id") != str(tg_user.id):
-            return
-        from_id = trade.get("from_id")
-        db.get("trades", {}).pop(token, None)
-        lock = context.application.bot_data["db_lock"]
-        async with lock:
-            save_db(db)
+    cards = filter_existing_cards(by_rarity).get("exclusive", [])
+    if not cards:
         await query.message.reply_text(
             apply_pressed_by(
-                "\u0422\u0440\u0435\u0439\u0434 \u043e\u0442\u043c\u0435\u043d\u0451\u043d.",
+                "\u041f\u043e\u043a\u0430 \u043d\u0435\u0442 \u044d\u043a\u0441\u043a\u043b\u044e\u0437\u0438\u0432\u043d\u044b\u0445 \u0441\u043e\u0441\u0438\u0441\u043e\u043a.",
                 pressed_by,
             )
         )
-        try:
-            if from_id:
-                await context.bot.send_message(
-                    chat_id=int(from_id),
-                    text="\u0422\u0440\u0435\u0439\u0434 \u043e\u0442\u043a\u043b\u043e\u043d\u0451\u043d.",
-                )
-        except Exception:
-            pass
         return
-    if action == "gift_pick" and len(parts) > 2:
-        token = parts[1]
-        try:
-            pick = int(parts[2])
-        except ValueError:
-            return
-        if pick < 1 or pick > GIFT_BUTTONS:
-            return
-        session = user.get("kazik_session") or {}
-        if (
-            not session
-            or session.get("token") != token
-            or session.get("used")
-            or not session.get("win_index")
-        ):
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u0421\u0435\u0441\u0441\u0438\u044f \u043f\u043e\u0434\u0430\u0440\u043a\u0430 \u0443\u0441\u0442\u0430\u0440\u0435\u043b\u0430.",
-                    pressed_by,
-                )
+    index = max(0, min(index, len(cards) - 1))
+    card = cards[index]
+    user["inventory"].append(make_inventory_item(card.file))
+    user["vip_reward_pending"] = False
+    lock = context.application.bot_data["db_lock"]
+    async with lock:
+        save_db(db)
+    await query.message.reply_text(
+        apply_pressed_by(
+            f"VIP \u043d\u0430\u0433\u0440\u0430\u0434\u0430 \u043f\u043e\u043b\u0443\u0447\u0435\u043d\u0430: {card_display_name(card)}.",
+            pressed_by,
+        )
+    )
+
+
+async def trade_accept_btn_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    token = parts[1]
+    trade = db.get("trades", {}).get(token)
+    if not trade or trade.get("status") != "open":
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u0422\u0440\u0435\u0439\u0434 \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d \u0438\u043b\u0438 \u0437\u0430\u043a\u0440\u044b\u0442.",
+                pressed_by,
             )
-            return
-        session["used"] = True
-        user["kazik_session"] = None
-        user["last_kazik_at"] = now_utc().isoformat()
-
-        if pick == int(session.get("win_index")):
-            available_by_rarity = filter_existing_cards(by_rarity)
-            won_cards = []
-            for _ in range(GIFT_REWARD_COUNT):
-                card = pick_random_card(available_by_rarity, drop_chances)
-                if not card:
-                    break
-                user["inventory"].append(make_inventory_item(card.file))
-                won_cards.append(card)
-            lock = context.application.bot_data["db_lock"]
-            async with lock:
-                save_db(db)
-            await query.message.edit_reply_markup(reply_markup=None)
-            if won_cards:
-                lines = [
-                    "\u041f\u043e\u0434\u0430\u0440\u043e\u043a \u043f\u043e\u043b\u0443\u0447\u0435\u043d!",
-                    "\u041f\u043e\u043b\u0443\u0447\u0435\u043d\u043e \u0441\u043e\u0441\u0438\u0441\u043e\u043a: "
-                    f"{len(won_cards)}",
-                ]
-                for index, card in enumerate(won_cards, start=1):
-                    lines.append(
-                        f"{index}. {card_display_name(card)} ({RARITY_NAMES[card.rarity]})"
-                    )
-                await query.message.reply_text(
-                    apply_pressed_by("\n".join(lines), pressed_by)
-                )
-            else:
-                await query.message.reply_text(
-                    apply_pressed_by(
-                        "\u041f\u043e\u0434\u0430\u0440\u043e\u043a \u0435\u0441\u0442\u044c, \u043d\u043e \u043a\u0430\u0440\u0442\u043e\u0447\u0435\u043a \u043f\u043e\u043a\u0430 \u043d\u0435\u0442.",
-                        pressed_by,
-                    )
-                )
-        else:
-            lock = context.application.bot_data["db_lock"]
-            async with lock:
-                save_db(db)
-            await query.message.edit_reply_markup(reply_markup=None)
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u041d\u0435 \u043f\u043e\u0432\u0435\u0437\u043b\u043e. \u041f\u043e\u043f\u0440\u043e\u0431\u0443\u0439 \u0441\u043d\u043e\u0432\u0430 \u0447\u0435\u0440\u0435\u0437 5 \u0447\u0430\u0441\u043e\u0432.",
-                    pressed_by,
-                )
+        )
+        return
+    if trade.get("to_id") != str(tg_user.id):
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u042d\u0442\u043e\u0442 \u0442\u0440\u0435\u0439\u0434 \u043f\u0440\u0435\u0434\u043d\u0430\u0437\u043d\u0430\u0447\u0435\u043d \u0434\u0440\u0443\u0433\u043e\u043c\u0443 \u0438\u0433\u0440\u043e\u043a\u0443.",
+                pressed_by,
             )
+        )
         return
-
-    if action == "kazik_spin":
-        now = now_local()
-        daily_key = kazik_daily_key(now)
-        if str(user.get("kazik_daily_date") or "") != daily_key:
-            user["kazik_daily_date"] = daily_key
-            user["kazik_daily_used"] = 0
-
-        bonus_spins = int(user.get("kazik_bonus_spins", 0) or 0)
-        daily_used = int(user.get("kazik_daily_used", 0) or 0)
-        daily_limit = kazik_free_spins_limit(user)
-
-        spent_free = False
-        if bonus_spins > 0:
-            user["kazik_bonus_spins"] = bonus_spins - 1
-            spent_free = True
-        elif daily_used < daily_limit:
-            user["kazik_daily_used"] = daily_used + 1
-            spent_free = True
-        if not spent_free:
-            stars = get_star_balance(user)
-            if stars < KAZIK_STAR_SPIN_COST:
-                reset_in = max(
-                    0,
-                    int(
-                        (
-                            (now + timedelta(days=1)).replace(
-                                hour=0, minute=0, second=0, microsecond=0
-                            )
-                            - now
-                        ).total_seconds()
-                    ),
-                )
-                await edit_message_text(
-                    query.message,
-                    apply_pressed_by(
-                        "\n".join(
-                            [
-                                "\u0424\u0440\u0438 \u0441\u043f\u0438\u043d\u044b \u0437\u0430\u043a\u043e\u043d\u0447\u0438\u043b\u0438\u0441\u044c.",
-                                f"\u041d\u0443\u0436\u043d\u043e {KAZIK_STAR_SPIN_COST}\u2b50 \u0434\u043b\u044f \u043a\u0440\u0443\u0442\u043a\u0438.",
-                                f"\u0421\u0431\u0440\u043e\u0441 \u0447\u0435\u0440\u0435\u0437: {format_duration(reset_in)}",
-                            ]
-                        ),
-                        pressed_by,
-                    ),
-                    build_kazik_spin_keyboard(kazik_spin_button_label(user)),
-                )
-                return
-            user["stars"] = stars - KAZIK_STAR_SPIN_COST
-        digits = roll_kazik_digits(win_chance=get_kazik_win_chance(user))
-        win_digit = digits[0] if digits[0] == digits[1] == digits[2] else None
-        reward_card = None
-        if win_digit is not None:
-            reward_card = pick_kazik_reward_card(
-                by_rarity,
-                win_digit,
-                allow_exclusive=False,
-            )
-            if reward_card:
-                user["inventory"].append(make_inventory_item(reward_card.file))
+    trade["status"] = "accepting"
+    lock = context.application.bot_data["db_lock"]
+    async with lock:
+        save_db(db)
+    from_id = trade.get("from_id")
+    from_user = db.get("users", {}).get(from_id, {})
+    offered_item = find_inventory_item(from_user, trade.get("from_item_id", ""))
+    if not offered_item:
+        db.get("trades", {}).pop(token, None)
         lock = context.application.bot_data["db_lock"]
         async with lock:
             save_db(db)
-
-        try:
-            spin_image = build_kazik_spin_image(digits, 0, title="\u041a\u0440\u0443\u0442\u0438\u043c...")
-            await send_or_edit_photo(
-                query.message,
-                spin_image,
-                apply_pressed_by("", pressed_by),
-                None,
-                prefer_edit=True,
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u0422\u0440\u0435\u0439\u0434 \u043e\u0442\u043c\u0435\u043d\u0451\u043d: \u0441\u043e\u0441\u0438\u0441\u043a\u0438 \u043d\u0435\u0442 \u0443 \u0430\u0432\u0442\u043e\u0440\u0430.",
+                pressed_by,
             )
-            await asyncio.sleep(KAZIK_SPIN_DELAY)
-        except Exception:
-            pass
-
-        win_text = ""
-        if win_digit is not None:
-            if reward_card:
-                win_text = (
-                    "\u0412\u044b\u0438\u0433\u0440\u044b\u0448: "
-                    f"{card_display_name(reward_card)} ({RARITY_NAMES[reward_card.rarity]})"
-                )
-            else:
-                win_text = (
-                    "\u0412\u044b\u0438\u0433\u0440\u044b\u0448 \u0435\u0441\u0442\u044c, "
-                    "\u043d\u043e \u043a\u0430\u0440\u0442\u043e\u0447\u0435\u043a \u043d\u0435\u0442."
-                )
-        final_caption = apply_pressed_by(win_text, pressed_by)
-        result_image = build_kazik_spin_image(digits, 3)
-        spin_keyboard = build_kazik_spin_keyboard(kazik_spin_button_label(user))
-        try:
-            await send_or_edit_photo(
-                query.message,
-                result_image,
-                final_caption,
-                spin_keyboard,
-                prefer_edit=True,
-            )
-        except Exception:
-            await edit_message_text(
-                query.message,
-                final_caption,
-                spin_keyboard,
-            )
-        return
-
-    if action == "my_rarity" and len(parts) > 1:
-        rarity = parts[1]
-        await show_inventory_card(
+        )
+        return
+    offered_card = card_map.get(offered_item.get("file"))
+    offer_text = f"\u0422\u044b \u043f\u043e\u043b\u0443\u0447\u0438\u0448\u044c: {card_display_name(offered_card)}"
+    caption = apply_pressed_by(
+        "\n".join(
+            [
+                f"\u0422\u0440\u0435\u0439\u0434 \u043e\u0442: {trade.get('from_tag') or trade.get('from_name') or from_id}",
+                offer_text,
+                "\u0412\u044b\u0431\u0435\u0440\u0438 \u0441\u0432\u043e\u044e \u0441\u043e\u0441\u0438\u0441\u043a\u0443 \u0434\u043b\u044f \u043e\u0431\u043c\u0435\u043d\u0430 \u0438\u043b\u0438 \u043d\u0430\u0436\u043c\u0438 \u00ab\u041d\u0438\u0447\u0435\u0433\u043e \u043d\u0435 \u0432\u044b\u0431\u0438\u0440\u0430\u0442\u044c\u00bb.",
+            ]
+        ),
+        pressed_by,
+    )
+    menu_path = get_cached_menu_image(
+        "trade_accept",
+        "\u0422\u0440\u0435\u0439\u0434",
+        "\u0412\u044b\u0431\u0435\u0440\u0438 \u0441\u043e\u0441\u0438\u0441\u043a\u0443",
+    )
+    with menu_path.open("rb") as photo:
+        await send_or_edit_photo(
             query.message,
-            user,
-            card_map,
-            rarity,
-            0,
-            pressed_by=pressed_by,
+            photo,
+            caption,
+            build_trade_rarity_keyboard(token, "accept"),
+            prefer_edit=False,
             context=context,
+            owner_id=tg_user.id,
+        )
+
+
+async def trade_accept_none_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    token = parts[1]
+    trade = db.get("trades", {}).get(token)
+    if not trade or trade.get("status") != "accepting":
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u0422\u0440\u0435\u0439\u0434 \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d \u0438\u043b\u0438 \u0437\u0430\u043a\u0440\u044b\u0442.",
+                pressed_by,
+            )
+        )
+        return
+    if trade.get("to_id") != str(tg_user.id):
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u042d\u0442\u043e\u0442 \u0442\u0440\u0435\u0439\u0434 \u043f\u0440\u0435\u0434\u043d\u0430\u0437\u043d\u0430\u0447\u0435\u043d \u0434\u0440\u0443\u0433\u043e\u043c\u0443 \u0438\u0433\u0440\u043e\u043a\u0443.",
+                pressed_by,
+            )
         )
         return
-    if action == "my_nav" and len(parts) > 2:
-        rarity = parts[1]
-        index = int(parts[2])
-        await edit_inventory_card(
-            query.message, user, card_map, rarity, index, pressed_by=pressed_by
-        )
+    from_id = trade.get("from_id")
+    from_user = db.get("users", {}).get(from_id)
+    to_user = db.get("users", {}).get(str(tg_user.id))
+    if not from_user or not to_user:
         return
-    if action == "my_sell" and len(parts) > 3:
-        item_id = parts[1]
-        rarity = parts[2]
-        index = int(parts[3])
-        items = user.get("inventory", [])
-        item = next((i for i in items if i.get("id") == item_id), None)
-        if not item:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u042d\u0442\u0430 \u0441\u043e\u0441\u0438\u0441\u043a\u0430 \u0443\u0436\u0435 \u043f\u0440\u043e\u0434\u0430\u043d\u0430.",
-                    pressed_by,
-                )
-            )
-            return
-        card = card_map.get(item.get("file"))
-        if not card or card.price is None:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u0426\u0435\u043d\u0430 \u043d\u0435 \u0437\u0430\u0434\u0430\u043d\u0430, \u043f\u0440\u043e\u0434\u0430\u0442\u044c \u043d\u0435\u043b\u044c\u0437\u044f.",
-                    pressed_by,
-                )
+    offered_item = find_inventory_item(from_user, trade.get("from_item_id", ""))
+    if not offered_item:
+        db.get("trades", {}).pop(token, None)
+        lock = context.application.bot_data["db_lock"]
+        async with lock:
+            save_db(db)
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u0422\u0440\u0435\u0439\u0434 \u043e\u0442\u043c\u0435\u043d\u0451\u043d: \u0441\u043e\u0441\u0438\u0441\u043a\u0438 \u043d\u0435\u0442 \u0443 \u0430\u0432\u0442\u043e\u0440\u0430.",
+                pressed_by,
             )
-            return
-        sale_price = calc_sale_price(card) or 0
-        currency = card_currency(card)
-        sale_label = format_short_amount(sale_price, currency)
-        original_label = format_short_amount(card.price, currency)
-        confirm_caption = apply_pressed_by(
-            "\n".join(
-                [
-                    "\u041f\u0440\u043e\u0434\u0430\u0442\u044c \u044d\u0442\u0443 \u0441\u043e\u0441\u0438\u0441\u043a\u0443?",
-                    f"{escape_html(format_card_label(card))} - {sale_label} <s>{escape_html(original_label)}</s>",
-                ]
-            ),
-            pressed_by,
-        )
-        await query.message.edit_caption(
-            caption=confirm_caption,
-            reply_markup=build_my_sell_confirm_keyboard(item_id, rarity, index),
-            parse_mode=ParseMode.HTML,
-        )
-        return
-
-    if action == "my_sell_cancel" and len(parts) > 3:
-        rarity = parts[2]
-        index = int(parts[3])
-        await edit_inventory_card(
-            query.message,
-            user,
-            card_map,
-            rarity,
-            index,
-            pressed_by=pressed_by,
         )
         return
+    trade["to_item_id"] = None
+    trade["status"] = "confirming"
+    lock = context.application.bot_data["db_lock"]
+    async with lock:
+        save_db(db)
+    offered_card = card_map.get(offered_item.get("file"))
+    from_label = trade_user_label(trade, "from")
+    to_label = trade_user_label(trade, "to")
+    offer_text = (
+        card_display_name(offered_card) if offered_card else "\u0441\u043e\u0441\u0438\u0441\u043a\u0443"
+    )
+    summary = "\n".join(
+        [
+            f"{from_label} \u043e\u0442\u0434\u0430\u0451\u0442: {offer_text}",
+            f"{to_label} \u043e\u0442\u0434\u0430\u0451\u0442: \u043d\u0438\u0447\u0435\u0433\u043e",
+            "\u041f\u043e\u0434\u0442\u0432\u0435\u0440\u0434\u0438 \u0442\u0440\u0435\u0439\u0434.",
+        ]
+    )
+    try:
+        sent = await context.bot.send_message(
+            chat_id=int(from_id),
+            text=summary,
+            reply_markup=build_trade_confirm_keyboard(token),
+        )
+        set_message_owner(
+            context.application.bot_data, sent, int(trade["from_id"])
+        )
+    except Exception:
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u041d\u0435 \u0443\u0434\u0430\u043b\u043e\u0441\u044c \u043e\u0442\u043f\u0440\u0430\u0432\u0438\u0442\u044c \u0437\u0430\u043f\u0440\u043e\u0441 \u043d\u0430 \u043f\u043e\u0434\u0442\u0432\u0435\u0440\u0436\u0434\u0435\u043d\u0438\u0435.",
+                pressed_by,
+            )
+        )
+    await query.message.reply_text(
+        apply_pressed_by(
+            "\u0417\u0430\u043f\u0440\u043e\u0441 \u043e\u0442\u043f\u0440\u0430\u0432\u043b\u0435\u043d. \u0416\u0434\u0438 \u043f\u043e\u0434\u0442\u0432\u0435\u0440\u0436\u0434\u0435\u043d\u0438\u044f.",
+            pressed_by,
+        )
+    )
 
-    if action == "my_sell_confirm" and len(parts) > 3:
-        item_id = parts[1]
-        rarity = parts[2]
-        index = int(parts[3])
-        items = user.get("inventory", [])
-        item = next((i for i in items if i.get("id") == item_id), None)
-        if not item:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u042d\u0442\u0430 \u0441\u043e\u0441\u0438\u0441\u043a\u0430 \u0443\u0436\u0435 \u043f\u0440\u043e\u0434\u0430\u043d\u0430.",
-                    pressed_by,
-                )
+
+async def trade_confirm_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    token = parts[1]
+    trade = db.get("trades", {}).get(token)
+    if not trade or trade.get("status") != "confirming":
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u0422\u0440\u0435\u0439\u0434 \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d \u0438\u043b\u0438 \u0437\u0430\u043a\u0440\u044b\u0442.",
+                pressed_by,
             )
-            return
-        card = card_map.get(item.get("file"))
-        if not card or card.price is None:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u0426\u0435\u043d\u0430 \u043d\u0435 \u0437\u0430\u0434\u0430\u043d\u0430, \u043f\u0440\u043e\u0434\u0430\u0442\u044c \u043d\u0435\u043b\u044c\u0437\u044f.",
-                    pressed_by,
-                )
+        )
+        return
+    if trade.get("from_id") != str(tg_user.id):
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u042d\u0442\u043e \u043d\u0435 \u0442\u0432\u043e\u0439 \u0442\u0440\u0435\u0439\u0434.",
+                pressed_by,
             )
-            return
-        sale_price = calc_sale_price(card) or 0
-        if card_currency(card) == "stars":
-            user["stars"] = get_star_balance(user) + sale_price
-        else:
-            user["balance"] = int(user.get("balance", 0)) + sale_price
-        user["inventory"] = [i for i in items if i.get("id") != item_id]
+        )
+        return
+    from_id = trade.get("from_id")
+    to_id = trade.get("to_id")
+    from_user = db.get("users", {}).get(from_id)
+    to_user = db.get("users", {}).get(to_id)
+    if not from_user or not to_user:
+        return
+    offered_item = find_inventory_item(from_user, trade.get("from_item_id", ""))
+    if not offered_item:
+        db.get("trades", {}).pop(token, None)
         lock = context.application.bot_data["db_lock"]
         async with lock:
             save_db(db)
-        items_left = filter_inventory_by_rarity(user, card_map, rarity)
-        if not items_left:
-            await query.message.edit_caption(
-                apply_pressed_by(
-                    "\u0421\u043e\u0441\u0438\u0441\u043e\u043a \u044d\u0442\u043e\u0439 \u0440\u0435\u0434\u043a\u043e\u0441\u0442\u0438 \u0431\u043e\u043b\u044c\u0448\u0435 \u043d\u0435\u0442.",
-                    pressed_by,
-                ),
-                reply_markup=InlineKeyboardMarkup(
-                    [[InlineKeyboardButton("\u041d\u0430\u0437\u0430\u0434", callback_data="my_menu")]]
-                ),
-            )
-        else:
-            new_index = min(index, len(items_left) - 1)
-            await edit_inventory_card(
-                query.message,
-                user,
-                card_map,
-                rarity,
-                new_index,
-                pressed_by=pressed_by,
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u0422\u0440\u0435\u0439\u0434 \u043e\u0442\u043c\u0435\u043d\u0451\u043d: \u0441\u043e\u0441\u0438\u0441\u043a\u0438 \u043d\u0435\u0442 \u0443 \u0430\u0432\u0442\u043e\u0440\u0430.",
+                pressed_by,
             )
-        await query.message.reply_text(
-            apply_pressed_by(
-                f"\u041f\u0440\u043e\u0434\u0430\u043d\u043e \u0437\u0430 {format_short_amount(sale_price, card_currency(card))}.",
-                pressed_by,
-            )
-        )
+        )
         return
-
-    if action == "my_upgrade" and len(parts) > 3:
-        item_id = parts[1]
-        rarity = parts[2]
-        index = int(parts[3])
-        items = user.get("inventory", [])
-        item = next((i for i in items if i.get("id") == item_id), None)
-        if not item:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u042d\u0442\u0430 \u0441\u043e\u0441\u0438\u0441\u043a\u0430 \u0443\u0436\u0435 \u043f\u0440\u043e\u0434\u0430\u043d\u0430.",
-                    pressed_by,
-                )
-            )
-            return
-        card = card_map.get(item.get("file"))
-        if not card:
+    give_item = None
+    to_item_id = trade.get("to_item_id")
+    if to_item_id:
+        give_item = find_inventory_item(to_user, to_item_id)
+        if not give_item:
+            db.get("trades", {}).pop(token, None)
+            lock = context.application.bot_data["db_lock"]
+            async with lock:
+                save_db(db)
             await query.message.reply_text(
                 apply_pressed_by(
-                    "\u041a\u0430\u0440\u0442\u043e\u0447\u043a\u0430 \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d\u0430.",
+                    "\u0422\u0440\u0435\u0439\u0434 \u043e\u0442\u043c\u0435\u043d\u0451\u043d: \u0441\u043e\u0441\u0438\u0441\u043a\u0438 \u043d\u0435\u0442 \u0443 \u0432\u0442\u043e\u0440\u043e\u0439 \u0441\u0442\u043e\u0440\u043e\u043d\u044b.",
                     pressed_by,
                 )
             )
             return
-        user_label = get_user_label(tg_user)
-        caption = apply_pressed_by(
-            build_upgrade_warning_caption(user_label, card),
+    from_user["inventory"] = [
+        item
+        for item in from_user.get("inventory", [])
+        if item.get("id") != offered_item.get("id")
+    ]
+    to_user.setdefault("inventory", []).append(offered_item)
+    if give_item:
+        to_user["inventory"] = [
+            item
+            for item in to_user.get("inventory", [])
+            if item.get("id") != give_item.get("id")
+        ]
+        from_user.setdefault("inventory", []).append(give_item)
+    db.get("trades", {}).pop(token, None)
+    lock = context.application.bot_data["db_lock"]
+    async with lock:
+        save_db(db)
+    offered_card = card_map.get(offered_item.get("file"))
+    give_card = card_map.get(give_item.get("file")) if give_item else None
+    receive_text = (
+        card_display_name(give_card) if give_card else "\u043d\u0438\u0447\u0435\u0433\u043e"
+    )
+    await query.message.reply_text(
+        apply_pressed_by(
+            f"\u0422\u0440\u0435\u0439\u0434 \u0437\u0430\u0432\u0435\u0440\u0448\u0451\u043d. \u0422\u044b \u043f\u043e\u043b\u0443\u0447\u0438\u043b {receive_text}.",
             pressed_by,
         )
-        await query.message.edit_caption(
-            caption=caption,
-            reply_markup=build_my_upgrade_confirm_keyboard(item_id, rarity, index),
+    )
+    try:
+        offer_text = (
+            card_display_name(offered_card) if offered_card else "\u0441\u043e\u0441\u0438\u0441\u043a\u0443"
         )
-        return
+        await context.bot.send_message(
+            chat_id=int(to_id),
+            text=f"\u0422\u0440\u0435\u0439\u0434 \u0437\u0430\u0432\u0435\u0440\u0448\u0451\u043d. \u0422\u044b \u043f\u043e\u043b\u0443\u0447\u0438\u043b {offer_text}.",
+        )
+    except Exception:
+        pass
 
-    if action == "my_upgrade_cancel" and len(parts) > 3:
-        item_id = parts[1]
-        rarity = parts[2]
-        index = int(parts[3])
-        items = user.get("inventory", [])
-        item = next((i for i in items if i.get("id") == item_id), None)
-        if not item:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u042d\u0442\u0430 \u0441\u043e\u0441\u0438\u0441\u043a\u0430 \u0443\u0436\u0435 \u043f\u0440\u043e\u0434\u0430\u043d\u0430.",
-                    pressed_by,
-                )
-            )
-            return
-        card = card_map.get(item.get("file"))
-        if not card:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u041a\u0430\u0440\u0442\u043e\u0447\u043a\u0430 \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d\u0430.",
-                    pressed_by,
-                )
+
+async def trade_confirm_cancel_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    token = parts[1]
+    trade = db.get("trades", {}).get(token)
+    if not trade:
+        return
+    if trade.get("from_id") != str(tg_user.id):
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u042d\u0442\u043e \u043d\u0435 \u0442\u0432\u043e\u0439 \u0442\u0440\u0435\u0439\u0434.",
+                pressed_by,
             )
-            return
-        items_in_rarity = filter_inventory_by_rarity(user, card_map, rarity)
-        caption = apply_pressed_by(
-            build_inventory_caption(card, index, len(items_in_rarity)),
-            pressed_by,
-        )
-        await query.message.edit_caption(
-            caption=caption,
-            reply_markup=build_inventory_keyboard(
-                rarity, index, len(items_in_rarity), item_id
-            ),
         )
         return
-
-    if action == "my_upgrade_confirm" and len(parts) > 3:
-        item_id = parts[1]
-        rarity = parts[2]
-        index = int(parts[3])
-        items = user.get("inventory", [])
-        item = next((i for i in items if i.get("id") == item_id), None)
-        if not item:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u042d\u0442\u0430 \u0441\u043e\u0441\u0438\u0441\u043a\u0430 \u0443\u0436\u0435 \u043f\u0440\u043e\u0434\u0430\u043d\u0430.",
-                    pressed_by,
-                )
+    to_id = trade.get("to_id")
+    db.get("trades", {}).pop(token, None)
+    lock = context.application.bot_data["db_lock"]
+    async with lock:
+        save_db(db)
+    await query.message.reply_text(
+        apply_pressed_by(
+            "\u0422\u0440\u0435\u0439\u0434 \u043e\u0442\u043c\u0435\u043d\u0451\u043d.",
+            pressed_by,
+        )
+    )
+    try:
+        if to_id:
+            await context.bot.send_message(
+                chat_id=int(to_id),
+                text="\u0422\u0440\u0435\u0439\u0434 \u043e\u0442\u043c\u0435\u043d\u0451\u043d.",
             )
-            return
-        card = card_map.get(item.get("file"))
-        if not card:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u041a\u0430\u0440\u0442\u043e\u0447\u043a\u0430 \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d\u0430.",
-                    pressed_by,
-                )
+    except Exception:
+        pass
+
+
+async def trade_rarity_menu_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    role = parts[1]
+    token = parts[2]
+    trade = db.get("trades", {}).get(token)
+    if not trade:
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u0422\u0440\u0435\u0439\u0434 \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d.",
+                pressed_by,
             )
-            return
-        next_rarity = get_next_rarity(card.rarity)
-        if not next_rarity:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u042d\u0442\u043e \u043c\u0430\u043a\u0441\u0438\u043c\u0430\u043b\u044c\u043d\u0430\u044f \u0440\u0435\u0434\u043a\u043e\u0441\u0442\u044c.",
-                    pressed_by,
-                )
+        )
+        return
+    if role == "offer" and trade.get("from_id") != str(tg_user.id):
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u042d\u0442\u043e \u043d\u0435 \u0442\u0432\u043e\u0439 \u0442\u0440\u0435\u0439\u0434.",
+                pressed_by,
             )
-            return
-        roll = random.randint(0, 1)
-        user_label = get_user_label(tg_user)
-        if roll == 0:
-            user["inventory"] = [i for i in items if i.get("id") != item_id]
-            lock = context.application.bot_data["db_lock"]
-            async with lock:
-                save_db(db)
-            await query.message.edit_caption(
-                caption=apply_pressed_by(
-                    build_upgrade_fail_caption(user_label),
-                    pressed_by,
-                ),
-                reply_markup=InlineKeyboardMarkup(
-                    [[InlineKeyboardButton("\u041d\u0430\u0437\u0430\u0434", callback_data="my_menu")]]
-                ),
+        )
+        return
+    if role == "accept" and trade.get("to_id") != str(tg_user.id):
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u042d\u0442\u043e \u043d\u0435 \u0442\u0432\u043e\u0439 \u0442\u0440\u0435\u0439\u0434.",
+                pressed_by,
             )
-            return
-        available_by_rarity = filter_existing_cards(by_rarity)
-        next_cards = available_by_rarity.get(next_rarity, [])
-        if not next_cards:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u041d\u0435\u0442 \u043a\u0430\u0440\u0442\u043e\u0447\u0435\u043a \u0441\u043b\u0435\u0434\u0443\u044e\u0449\u0435\u0439 \u0440\u0435\u0434\u043a\u043e\u0441\u0442\u0438.",
-                    pressed_by,
-                )
+        )
+        return
+    expected_status = "draft" if role == "offer" else "accepting"
+    if trade.get("status") != expected_status:
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u0422\u0440\u0435\u0439\u0434 \u043d\u0435 \u0433\u043e\u0442\u043e\u0432 \u043a \u044d\u0442\u043e\u043c\u0443 \u0434\u0435\u0439\u0441\u0442\u0432\u0438\u044e.",
+                pressed_by,
             )
-            return
-        upgraded = random.choice(next_cards)
-        item["file"] = upgraded.file
-        lock = context.application.bot_data["db_lock"]
-        async with lock:
-            save_db(db)
-        items_in_new = filter_inventory_by_rarity(user, card_map, upgraded.rarity)
-        new_index = next(
-            (i for i, it in enumerate(items_in_new) if it.get("id") == item_id),
-            0,
         )
-        await edit_inventory_card(
-            query.message,
-            user,
-            card_map,
-            upgraded.rarity,
-            new_index,
-            pressed_by=pressed_by,
+        return
+    await query.message.edit_reply_markup(
+        reply_markup=build_trade_rarity_keyboard(token, role)
+    )
+
+
+async def trade_rarity_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    role = parts[1]
+    token = parts[2]
+    rarity = parts[3]
+    trade = db.get("trades", {}).get(token)
+    if not trade:
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u0422\u0440\u0435\u0439\u0434 \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d.",
+                pressed_by,
+            )
         )
         return
-
-    if action == "shop_rarity" and len(parts) > 1:
-        rarity = parts[1]
-        await show_shop_card(
-            query.message,
-            rarity,
-            0,
-            by_rarity.get(rarity, []),
-            pressed_by=pressed_by,
-            context=context,
+    if role == "offer" and trade.get("from_id") != str(tg_user.id):
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u042d\u0442\u043e \u043d\u0435 \u0442\u0432\u043e\u0439 \u0442\u0440\u0435\u0439\u0434.",
+                pressed_by,
+            )
         )
         return
-    if action == "shop_nav" and len(parts) > 2:
-        rarity = parts[1]
-        index = int(parts[2])
-        await edit_shop_card(
-            query.message,
-            rarity,
-            index,
-            by_rarity.get(rarity, []),
-            pressed_by=pressed_by,
-            context=context,
+    if role == "accept" and trade.get("to_id") != str(tg_user.id):
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u042d\u0442\u043e \u043d\u0435 \u0442\u0432\u043e\u0439 \u0442\u0440\u0435\u0439\u0434.",
+                pressed_by,
+            )
         )
         return
-    if action == "shop_buy" and len(parts) > 2:
-        rarity = parts[1]
-        index = int(parts[2])
-        cards = by_rarity.get(rarity, [])
-        if not cards:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u041d\u0435\u0442 \u043a\u0430\u0440\u0442\u043e\u0447\u0435\u043a \u0434\u043b\u044f \u043f\u043e\u043a\u0443\u043f\u043a\u0438.",
-                    pressed_by,
-                )
-            )
-            return
-        index = max(0, min(index, len(cards) - 1))
-        card = cards[index]
-        if card.rarity == "exclusive":
-            lock = context.application.bot_data["db_lock"]
-            async with lock:
-                remaining, _ = get_exclusive_stock(db, card.file)
-                if remaining <= 0:
-                    await query.message.reply_text(
-                        apply_pressed_by(
-                            "\u042d\u0442\u043e\u0442 \u044d\u043a\u0441\u043a\u043b\u044e\u0437\u0438\u0432 \u0443\u0436\u0435 \u0440\u0430\u0441\u043a\u0443\u043f\u0438\u043b\u0438.",
-                            pressed_by,
-                        )
-                    )
-                    return
-            if card.price is None:
-                await query.message.reply_text(
-                    apply_pressed_by(
-                        "\u0426\u0435\u043d\u0430 \u043d\u0435 \u0437\u0430\u0434\u0430\u043d\u0430, \u043a\u0443\u043f\u0438\u0442\u044c \u043d\u0435\u043b\u044c\u0437\u044f.",
-                        pressed_by,
-                    )
-                )
-                return
-            stars = get_star_balance(user)
-            if stars < int(card.price):
-                await query.message.reply_text(
-                    apply_pressed_by(
-                        f"\u041d\u0443\u0436\u043d\u043e {format_short_amount(card.price, 'stars')} \u0434\u043b\u044f \u043f\u043e\u043a\u0443\u043f\u043a\u0438.",
-                        pressed_by,
-                    )
-                )
-                return
-            async with lock:
-                if not consume_exclusive_stock(db, card.file):
-                    await query.message.reply_text(
-                        apply_pressed_by(
-                            "\u042d\u0442\u043e\u0442 \u044d\u043a\u0441\u043a\u043b\u044e\u0437\u0438\u0432 \u0443\u0436\u0435 \u0440\u0430\u0441\u043a\u0443\u043f\u0438\u043b\u0438.",
-                            pressed_by,
-                        )
-                    )
-                    return
-                user["stars"] = stars - int(card.price)
-                user["inventory"].append(make_inventory_item(card.file))
-                save_db(db)
-            await query.message.reply_text(
-                apply_pressed_by(
-                    f"\u041a\u0443\u043f\u043b\u0435\u043d\u043e \u0437\u0430 {format_short_amount(card.price, 'stars')}.",
-                    pressed_by,
-                )
-            )
-            return
-        if card.price is None:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u0426\u0435\u043d\u0430 \u043d\u0435 \u0437\u0430\u0434\u0430\u043d\u0430, \u043a\u0443\u043f\u0438\u0442\u044c \u043d\u0435\u043b\u044c\u0437\u044f.",
-                    pressed_by,
-                )
-            )
-            return
-        price = int(card.price)
-        used_discount = False
-        discount_lock = context.application.bot_data.setdefault(
-            "discount_lock", asyncio.Lock()
-        )
-        async with discount_lock:
-            discounts = load_discount_data()
-            today = discount_day_key()
-            if discounts.get("date") != today:
-                discounts = generate_discounts(by_rarity)
-            discount = get_discount_item(discounts, card.file)
-            if discount and is_discount_active(discount):
-                price = int(discount.get("discount_price", price))
-                remaining = int(discount.get("remaining", 0))
-                discount["remaining"] = max(0, remaining - 1)
-                used_discount = True
-            save_discount_data(discounts)
-            context.application.bot_data["discounts"] = discounts
-        balance = int(user.get("balance", 0))
-        if balance < price:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u041d\u0435\u0434\u043e\u0441\u0442\u0430\u0442\u043e\u0447\u043d\u043e \u0441\u0440\u0435\u0434\u0441\u0442\u0432.",
-                    pressed_by,
-                )
-            )
-            return
-        user["balance"] = balance - price
-        user["inventory"].append(make_inventory_item(card.file))
-        lock = context.application.bot_data["db_lock"]
-        async with lock:
-            save_db(db)
-        price_label = format_short_amount(price, "rub")
-        if used_discount:
-            price_label += " (\u0430\u043a\u0446\u0438\u044f)"
-        await query.message.reply_text(
-            apply_pressed_by(
-                f"\u041a\u0443\u043f\u043b\u0435\u043d\u043e \u0437\u0430 {price_label}.",
+    expected_status = "draft" if role == "offer" else "accepting"
+    if trade.get("status") != expected_status:
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u0422\u0440\u0435\u0439\u0434 \u043d\u0435 \u0433\u043e\u0442\u043e\u0432 \u043a \u044d\u0442\u043e\u043c\u0443 \u0434\u0435\u0439\u0441\u0442\u0432\u0438\u044e.",
                 pressed_by,
             )
         )
         return
+    await show_trade_card(
+        query.message,
+        user,
+        card_map,
+        token,
+        role,
+        rarity,
+        0,
+        pressed_by=pressed_by,
+        prefer_edit=True,
+        context=context,
+    )
 
-    if action == "discount_view" and len(parts) > 1:
-        try:
-            view_index = int(parts[1]) - 1
-        except ValueError:
-            return
-        discounts = await ensure_discounts(context)
-        items = discounts.get("items", [])
-        if not isinstance(items, list) or view_index < 0 or view_index >= len(items):
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u042d\u0442\u0430 \u0430\u043a\u0446\u0438\u044f \u0443\u0436\u0435 \u043d\u0435\u0434\u043e\u0441\u0442\u0443\u043f\u043d\u0430.",
-                    pressed_by,
-                )
-            )
-            return
-        item = items[view_index]
-        filename = str(item.get("file") or "")
-        card = card_map.get(filename)
-        if not card:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u041a\u0430\u0440\u0442\u043e\u0447\u043a\u0430 \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d\u0430.",
-                    pressed_by,
-                )
+
+async def trade_nav_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    role = parts[1]
+    token = parts[2]
+    rarity = parts[3]
+    try:
+        index = int(parts[4])
+    except ValueError:
+        return
+    trade = db.get("trades", {}).get(token)
+    if not trade:
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u0422\u0440\u0435\u0439\u0434 \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d.",
+                pressed_by,
             )
-            return
-        caption = apply_pressed_by(
-            build_discount_caption(card, view_index, len(items), item),
-            pressed_by,
         )
-        path = get_card_media_path(card)
-        if not path.exists():
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u0424\u043e\u0442\u043e \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d\u043e \u0434\u043b\u044f \u044d\u0442\u043e\u0439 \u043a\u0430\u0440\u0442\u043e\u0447\u043a\u0438.",
-                    pressed_by,
-                )
+        return
+    if role == "offer" and trade.get("from_id") != str(tg_user.id):
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u042d\u0442\u043e \u043d\u0435 \u0442\u0432\u043e\u0439 \u0442\u0440\u0435\u0439\u0434.",
+                pressed_by,
             )
-            return
-        with path.open("rb") as photo:
-            await send_or_edit_photo(
-                query.message,
-                photo,
-                caption,
-                build_discount_view_keyboard(),
-                prefer_edit=True,
-                context=context,
-                owner_id=tg_user.id,
-                parse_mode=ParseMode.HTML,
-            )
-        return
-
-    if action == "draw_sell" and len(parts) > 1:
-        item_id = parts[1]
-        items = user.get("inventory", [])
-        item = next((i for i in items if i.get("id") == item_id), None)
-        if not item:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u042d\u0442\u0430 \u0441\u043e\u0441\u0438\u0441\u043a\u0430 \u0443\u0436\u0435 \u043f\u0440\u043e\u0434\u0430\u043d\u0430.",
-                    pressed_by,
-                )
+        )
+        return
+    if role == "accept" and trade.get("to_id") != str(tg_user.id):
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u042d\u0442\u043e \u043d\u0435 \u0442\u0432\u043e\u0439 \u0442\u0440\u0435\u0439\u0434.",
+                pressed_by,
             )
-            return
-        card = card_map.get(item.get("file"))
-        if not card or card.price is None:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u0426\u0435\u043d\u0430 \u043d\u0435 \u0437\u0430\u0434\u0430\u043d\u0430, \u043f\u0440\u043e\u0434\u0430\u0442\u044c \u043d\u0435\u043b\u044c\u0437\u044f.",
-                    pressed_by,
-                )
+        )
+        return
+    expected_status = "draft" if role == "offer" else "accepting"
+    if trade.get("status") != expected_status:
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u0422\u0440\u0435\u0439\u0434 \u043d\u0435 \u0433\u043e\u0442\u043e\u0432 \u043a \u044d\u0442\u043e\u043c\u0443 \u0434\u0435\u0439\u0441\u0442\u0432\u0438\u044e.",
+                pressed_by,
             )
-            return
-        sale_price = calc_sale_price(card) or 0
-        currency = card_currency(card)
-        sale_label = format_short_amount(sale_price, currency)
-        original_label = format_short_amount(card.price, currency)
-        confirm_caption = apply_pressed_by(
-            "\n".join(
-                [
-                    "\u041f\u0440\u043e\u0434\u0430\u0442\u044c \u044d\u0442\u0443 \u0441\u043e\u0441\u0438\u0441\u043a\u0443?",
-                    f"{escape_html(format_card_label(card))} - {sale_label} <s>{escape_html(original_label)}</s>",
-                ]
-            ),
-            pressed_by,
-        )
-        await query.message.edit_caption(
-            caption=confirm_caption,
-            reply_markup=build_draw_sell_confirm_keyboard(item_id),
-            parse_mode=ParseMode.HTML,
-        )
-        return
+        )
+        return
+    await edit_trade_card(
+        query.message,
+        user,
+        card_map,
+        token,
+        role,
+        rarity,
+        index,
+        pressed_by=pressed_by,
+        context=context,
+    )
 
-    if action == "draw_sell_cancel" and len(parts) > 1:
-        item_id = parts[1]
-        items = user.get("inventory", [])
-        item = next((i for i in items if i.get("id") == item_id), None)
-        if not item:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u042d\u0442\u0430 \u0441\u043e\u0441\u0438\u0441\u043a\u0430 \u0443\u0436\u0435 \u043f\u0440\u043e\u0434\u0430\u043d\u0430.",
-                    pressed_by,
-                )
+
+async def trade_pick_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    role = parts[1]
+    token = parts[2]
+    item_id = parts[3]
+    rarity = parts[4]
+    try:
+        index = int(parts[5])
+    except ValueError:
+        return
+    trade = db.get("trades", {}).get(token)
+    if not trade:
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u0422\u0440\u0435\u0439\u0434 \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d.",
+                pressed_by,
             )
-            return
-        card = card_map.get(item.get("file"))
-        if not card:
+        )
+        return
+    if role == "offer":
+        if trade.get("from_id") != str(tg_user.id):
             await query.message.reply_text(
                 apply_pressed_by(
-                    "\u041a\u0430\u0440\u0442\u043e\u0447\u043a\u0430 \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d\u0430.",
+                    "\u042d\u0442\u043e \u043d\u0435 \u0442\u0432\u043e\u0439 \u0442\u0440\u0435\u0439\u0434.",
                     pressed_by,
                 )
             )
             return
-        user_label = get_user_label(tg_user)
-        caption = apply_pressed_by(build_draw_caption(user_label, card), pressed_by)
-        await query.message.edit_caption(
-            caption=caption,
-            reply_markup=build_draw_keyboard(item_id),
-        )
-        return
-
-    if action == "draw_sell_confirm" and len(parts) > 1:
-        item_id = parts[1]
-        items = user.get("inventory", [])
-        item = next((i for i in items if i.get("id") == item_id), None)
-        if not item:
+        if trade.get("status") != "draft":
             await query.message.reply_text(
                 apply_pressed_by(
-                    "\u042d\u0442\u0430 \u0441\u043e\u0441\u0438\u0441\u043a\u0430 \u0443\u0436\u0435 \u043f\u0440\u043e\u0434\u0430\u043d\u0430.",
+                    "\u0422\u0440\u0435\u0439\u0434 \u0443\u0436\u0435 \u043e\u0442\u043a\u0440\u044b\u0442.",
                     pressed_by,
                 )
             )
             return
-        card = card_map.get(item.get("file"))
-        if not card or card.price is None:
+        item = find_inventory_item(user, item_id)
+        if not item:
             await query.message.reply_text(
                 apply_pressed_by(
-                    "\u0426\u0435\u043d\u0430 \u043d\u0435 \u0437\u0430\u0434\u0430\u043d\u0430, \u043f\u0440\u043e\u0434\u0430\u0442\u044c \u043d\u0435\u043b\u044c\u0437\u044f.",
+                    "\u042d\u0442\u0430 \u0441\u043e\u0441\u0438\u0441\u043a\u0430 \u0443\u0436\u0435 \u043d\u0435 \u0432 \u0438\u043d\u0432\u0435\u043d\u0442\u0430\u0440\u0435.",
                     pressed_by,
                 )
             )
             return
-        sale_price = calc_sale_price(card) or 0
-        if card_currency(card) == "stars":
-            user["stars"] = get_star_balance(user) + sale_price
-        else:
-            user["balance"] = int(user.get("balance", 0)) + sale_price
-        user["inventory"] = [i for i in items if i.get("id") != item_id]
+        trade["from_item_id"] = item_id
+        trade["status"] = "open"
         lock = context.application.bot_data["db_lock"]
         async with lock:
             save_db(db)
-        await query.message.edit_caption(
-            caption=apply_pressed_by(
-                f"\u041f\u0440\u043e\u0434\u0430\u043d\u043e \u0437\u0430 {format_short_amount(sale_price, card_currency(card))}.",
-                pressed_by,
-            ),
-            reply_markup=None,
-        )
-        return
-
-    if action == "draw_upgrade" and len(parts) > 1:
-        item_id = parts[1]
-        items = user.get("inventory", [])
-        item = next((i for i in items if i.get("id") == item_id), None)
-        if not item:
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u042d\u0442\u0430 \u0441\u043e\u0441\u0438\u0441\u043a\u0430 \u0443\u0436\u0435 \u043f\u0440\u043e\u0434\u0430\u043d\u0430.",
-                    pressed_by,
-                )
+        target_label = (
+            f"@{trade.get('to_tag')}"
+            if trade.get("to_tag")
+            else trade.get("to_name")
+        )
+        text = apply_pressed_by(
+            f"\u0422\u0440\u0435\u0439\u0434 \u043e\u0442\u043f\u0440\u0430\u0432\u043b\u0435\u043d \u0434\u043b\u044f {target_label}.",
+            pressed_by,
+        )
+        await edit_message_text(
+            query.message,
+            text,
+            build_trade_accept_keyboard(token),
+        )
+        set_message_owner(
+            context.application.bot_data, query.message, int(trade["to_id"])
+        )
+        offered_card = card_map.get(item.get("file"))
+        offer_line = (
+            f"\u0422\u0435\u0431\u0435 \u043f\u0440\u0435\u0434\u043b\u0430\u0433\u0430\u044e\u0442: {card_display_name(offered_card)}"
+            if offered_card
+            else "\u0422\u0435\u0431\u0435 \u043f\u0440\u0435\u0434\u043b\u0430\u0433\u0430\u044e\u0442 \u0442\u0440\u0435\u0439\u0434."
+        )
+        try:
+            sent = await context.bot.send_message(
+                chat_id=int(trade["to_id"]),
+                text="\n".join(
+                    [
+                        f"\u0422\u0440\u0435\u0439\u0434 \u043e\u0442: {trade.get('from_tag') or trade.get('from_name')}",
+                        offer_line,
+                    ]
+                ),
+                reply_markup=build_trade_accept_keyboard(token),
             )
-            return
-        card = card_map.get(item.get("file"))
-        if not card:
+            set_message_owner(
+                context.application.bot_data, sent, int(trade["to_id"])
+            )
+        except (Forbidden, BadRequest) as exc:
+            message_text = str(exc).lower()
+            if isinstance(exc, Forbidden) or "chat not found" in message_text:
+                username = os.getenv("PUBLIC_BOT_USERNAME", "sosiskikazikbot").lstrip("@")
+                link = f"https://t.me/{username}?start=trade"
+                await query.message.reply_text(
+                    apply_pressed_by(
+                        "\u041d\u0435 \u043c\u043e\u0433\u0443 \u043d\u0430\u043f\u0438\u0441\u0430\u0442\u044c \u043f\u043e\u043b\u044c\u0437\u043e\u0432\u0430\u0442\u0435\u043b\u044e \u0432 \u041b\u0421.\n"
+                        "\u041f\u0443\u0441\u0442\u044c \u043e\u043d \u0437\u0430\u0439\u0434\u0451\u0442 \u0432 \u043b\u0438\u0447\u043a\u0443 \u0441 \u0431\u043e\u0442\u043e\u043c \u0438 \u043d\u0430\u0436\u043c\u0451\u0442 /start:\n"
+                        f"{link}",
+                        pressed_by,
+                    )
+                )
+            else:
+                await query.message.reply_text(
+                    apply_pressed_by(
+                        "\u041d\u0435 \u0443\u0434\u0430\u043b\u043e\u0441\u044c \u043e\u0442\u043f\u0440\u0430\u0432\u0438\u0442\u044c \u0442\u0440\u0435\u0439\u0434 \u0432 \u043b\u0438\u0447\u043a\u0443.",
+                        pressed_by,
+                    )
+                )
+        except Exception:
             await query.message.reply_text(
                 apply_pressed_by(
-                    "\u041a\u0430\u0440\u0442\u043e\u0447\u043a\u0430 \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d\u0430.",
+                    "\u041d\u0435 \u0443\u0434\u0430\u043b\u043e\u0441\u044c \u043e\u0442\u043f\u0440\u0430\u0432\u0438\u0442\u044c \u0442\u0440\u0435\u0439\u0434 \u0432 \u043b\u0438\u0447\u043a\u0443.",
                     pressed_by,
                 )
             )
-            return
-        user_label = get_user_label(tg_user)
-        caption = apply_pressed_by(
-            build_upgrade_warning_caption(user_label, card), pressed_by
-        )
-        await query.message.edit_caption(
-            caption=caption,
-            reply_markup=build_upgrade_confirm_keyboard(item_id),
-        )
         return
-
-    if action == "draw_upgrade_cancel" and len(parts) > 1:
-        item_id = parts[1]
-        items = user.get("inventory", [])
-        item = next((i for i in items if i.get("id") == item_id), None)
-        if not item:
+    if role == "accept":
+        if trade.get("to_id") != str(tg_user.id):
             await query.message.reply_text(
                 apply_pressed_by(
-                    "\u042d\u0442\u0430 \u0441\u043e\u0441\u0438\u0441\u043a\u0430 \u0443\u0436\u0435 \u043f\u0440\u043e\u0434\u0430\u043d\u0430.",
+                    "\u042d\u0442\u043e \u043d\u0435 \u0442\u0432\u043e\u0439 \u0442\u0440\u0435\u0439\u0434.",
                     pressed_by,
                 )
             )
             return
-        card = card_map.get(item.get("file"))
-        if not card:
+        if trade.get("status") != "accepting":
             await query.message.reply_text(
                 apply_pressed_by(
-                    "\u041a\u0430\u0440\u0442\u043e\u0447\u043a\u0430 \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d\u0430.",
+                    "\u0422\u0440\u0435\u0439\u0434 \u043d\u0435 \u0433\u043e\u0442\u043e\u0432 \u043a \u043e\u0431\u043c\u0435\u043d\u0443.",
                     pressed_by,
                 )
             )
             return
-        user_label = get_user_label(tg_user)
-        caption = apply_pressed_by(build_draw_caption(user_label, card), pressed_by)
-        await query.message.edit_caption(
-            caption=caption,
-            reply_markup=build_draw_keyboard(item_id),
-        )
-        return
-
-    if action == "draw_upgrade_confirm" and len(parts) > 1:
-        item_id = parts[1]
-        items = user.get("inventory", [])
-        item = next((i for i in items if i.get("id") == item_id), None)
-        if not item:
+        from_id = trade.get("from_id")
+        from_user = db.get("users", {}).get(from_id)
+        to_user = db.get("users", {}).get(str(tg_user.id))
+        if not from_user or not to_user:
+            return
+        offered_item = find_inventory_item(from_user, trade.get("from_item_id", ""))
+        if not offered_item:
+            db.get("trades", {}).pop(token, None)
+            lock = context.application.bot_data["db_lock"]
+            async with lock:
+                save_db(db)
             await query.message.reply_text(
                 apply_pressed_by(
-                    "\u042d\u0442\u0430 \u0441\u043e\u0441\u0438\u0441\u043a\u0430 \u0443\u0436\u0435 \u043f\u0440\u043e\u0434\u0430\u043d\u0430.",
+                    "\u0422\u0440\u0435\u0439\u0434 \u043e\u0442\u043c\u0435\u043d\u0451\u043d: \u0441\u043e\u0441\u0438\u0441\u043a\u0438 \u043d\u0435\u0442 \u0443 \u0430\u0432\u0442\u043e\u0440\u0430.",
                     pressed_by,
                 )
             )
             return
-        card = card_map.get(item.get("file"))
-        if not card:
+        offered_card = card_map.get(offered_item.get("file"))
+        give_item = find_inventory_item(to_user, item_id)
+        if not give_item:
             await query.message.reply_text(
                 apply_pressed_by(
-                    "\u041a\u0430\u0440\u0442\u043e\u0447\u043a\u0430 \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d\u0430.",
+                    "\u042d\u0442\u0430 \u0441\u043e\u0441\u0438\u0441\u043a\u0430 \u0443\u0436\u0435 \u043d\u0435 \u0432 \u0438\u043d\u0432\u0435\u043d\u0442\u0430\u0440\u0435.",
                     pressed_by,
                 )
             )
             return
-        next_rarity = get_next_rarity(card.rarity)
-        if not next_rarity:
+        trade["to_item_id"] = give_item.get("id")
+        trade["status"] = "confirming"
+        lock = context.application.bot_data["db_lock"]
+        async with lock:
+            save_db(db)
+        give_card = card_map.get(give_item.get("file"))
+        from_label = trade_user_label(trade, "from")
+        to_label = trade_user_label(trade, "to")
+        offer_text = (
+            card_display_name(offered_card) if offered_card else "\u0441\u043e\u0441\u0438\u0441\u043a\u0443"
+        )
+        give_text = (
+            card_display_name(give_card) if give_card else "\u0441\u043e\u0441\u0438\u0441\u043a\u0443"
+        )
+        summary = "\n".join(
+            [
+                f"{from_label} \u043e\u0442\u0434\u0430\u0451\u0442: {offer_text}",
+                f"{to_label} \u043e\u0442\u0434\u0430\u0451\u0442: {give_text}",
+                "\u041f\u043e\u0434\u0442\u0432\u0435\u0440\u0434\u0438 \u0442\u0440\u0435\u0439\u0434.",
+            ]
+        )
+        try:
+            sent = await context.bot.send_message(
+                chat_id=int(from_id),
+                text=summary,
+                reply_markup=build_trade_confirm_keyboard(token),
+            )
+            set_message_owner(
+                context.application.bot_data, sent, int(trade["from_id"])
+            )
+        except Exception:
             await query.message.reply_text(
                 apply_pressed_by(
-                    "\u042d\u0442\u043e \u043c\u0430\u043a\u0441\u0438\u043c\u0430\u043b\u044c\u043d\u0430\u044f \u0440\u0435\u0434\u043a\u043e\u0441\u0442\u044c.",
+                    "\u041d\u0435 \u0443\u0434\u0430\u043b\u043e\u0441\u044c \u043e\u0442\u043f\u0440\u0430\u0432\u0438\u0442\u044c \u0437\u0430\u043f\u0440\u043e\u0441 \u043d\u0430 \u043f\u043e\u0434\u0442\u0432\u0435\u0440\u0436\u0434\u0435\u043d\u0438\u0435.",
                     pressed_by,
                 )
             )
-            return
-        roll = random.randint(0, 1)
-        user_label = get_user_label(tg_user)
-        if roll == 0:
-            user["inventory"] = [i for i in items if i.get("id") != item_id]
-            lock = context.application.bot_data["db_lock"]
-            async with lock:
-                save_db(db)
-            await query.message.edit_caption(
-                caption=apply_pressed_by(
-                    build_upgrade_fail_caption(user_label),
-                    pressed_by,
-                ),
-                reply_markup=None,
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u0417\u0430\u043f\u0440\u043e\u0441 \u043e\u0442\u043f\u0440\u0430\u0432\u043b\u0435\u043d. \u0416\u0434\u0438 \u043f\u043e\u0434\u0442\u0432\u0435\u0440\u0436\u0434\u0435\u043d\u0438\u044f.",
+                pressed_by,
             )
-            return
+        )
+        return
+
+
+async def trade_cancel_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    token = parts[1]
+    trade = db.get("trades", {}).get(token)
+    if not trade or trade.get("from_id") != str(tg_user.id):
+        return
+    db.get("trades", {}).pop(token, None)
+    lock = context.application.bot_data["db_lock"]
+    async with lock:
+        save_db(db)
+    await query.message.reply_text(
+        apply_pressed_by(
+            "\u0422\u0440\u0435\u0439\u0434 \u043e\u0442\u043c\u0435\u043d\u0451\u043d.",
+            pressed_by,
+        )
+    )
+
+
+async def trade_decline_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    token = parts[1]
+    trade = db.get("trades", {}).get(token)
+    if not trade:
+        return
+    if trade.get("to_id") != str(tg_user.id):
+        return
+    from_id = trade.get("from_id")
+    db.get("trades", {}).pop(token, None)
+    lock = context.application.bot_data["db_lock"]
+    async with lock:
+        save_db(db)
+    await query.message.reply_text(
+        apply_pressed_by(
+            "\u0422\u0440\u0435\u0439\u0434 \u043e\u0442\u043c\u0435\u043d\u0451\u043d.",
+            pressed_by,
+        )
+    )
+    try:
+        if from_id:
+            await context.bot.send_message(
+                chat_id=int(from_id),
+                text="\u0422\u0440\u0435\u0439\u0434 \u043e\u0442\u043a\u043b\u043e\u043d\u0451\u043d.",
+            )
+    except Exception:
+        pass
+
+
+async def gift_pick_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    drop_chances = context.application.bot_data["drop_chances"]
+    token = parts[1]
+    try:
+        pick = int(parts[2])
+    except ValueError:
+        return
+    if pick < 1 or pick > GIFT_BUTTONS:
+        return
+    session = user.get("kazik_session") or {}
+    if (
+        not session
+        or session.get("token") != token
+        or session.get("used")
+        or not session.get("win_index")
+    ):
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u0421\u0435\u0441\u0441\u0438\u044f \u043f\u043e\u0434\u0430\u0440\u043a\u0430 \u0443\u0441\u0442\u0430\u0440\u0435\u043b\u0430.",
+                pressed_by,
+            )
+        )
+        return
+    session["used"] = True
+    user["kazik_session"] = None
+    user["last_kazik_at"] = now_utc().isoformat()
+
+    if pick == int(session.get("win_index")):
         available_by_rarity = filter_existing_cards(by_rarity)
-        next_cards = available_by_rarity.get(next_rarity, [])
-        if not next_cards:
+        won_cards = []
+        for _ in range(GIFT_REWARD_COUNT):
+            card = pick_random_card(available_by_rarity, drop_chances)
+            if not card:
+                break
+            user["inventory"].append(make_inventory_item(card.file))
+            won_cards.append(card)
+        lock = context.application.bot_data["db_lock"]
+        async with lock:
+            save_db(db)
+        await query.message.edit_reply_markup(reply_markup=None)
+        if won_cards:
+            lines = [
+                "\u041f\u043e\u0434\u0430\u0440\u043e\u043a \u043f\u043e\u043b\u0443\u0447\u0435\u043d!",
+                "\u041f\u043e\u043b\u0443\u0447\u0435\u043d\u043e \u0441\u043e\u0441\u0438\u0441\u043e\u043a: "
+                f"{len(won_cards)}",
+            ]
+            for index, card in enumerate(won_cards, start=1):
+                lines.append(
+                    f"{index}. {card_display_name(card)} ({RARITY_NAMES[card.rarity]})"
+                )
+            await query.message.reply_text(
+                apply_pressed_by("\n".join(lines), pressed_by)
+            )
+        else:
             await query.message.reply_text(
                 apply_pressed_by(
-                    "\u041d\u0435\u0442 \u043a\u0430\u0440\u0442\u043e\u0447\u0435\u043a \u0441\u043b\u0435\u0434\u0443\u044e\u0449\u0435\u0439 \u0440\u0435\u0434\u043a\u043e\u0441\u0442\u0438.",
+                    "\u041f\u043e\u0434\u0430\u0440\u043e\u043a \u0435\u0441\u0442\u044c, \u043d\u043e \u043a\u0430\u0440\u0442\u043e\u0447\u0435\u043a \u043f\u043e\u043a\u0430 \u043d\u0435\u0442.",
                     pressed_by,
                 )
             )
-            return
-        upgraded = random.choice(next_cards)
-        item["file"] = upgraded.file
+    else:
         lock = context.application.bot_data["db_lock"]
         async with lock:
             save_db(db)
-        caption = apply_pressed_by(
-            build_upgrade_success_caption(user_label, upgraded),
-            pressed_by,
+        await query.message.edit_reply_markup(reply_markup=None)
+        await query.message.reply_text(
+            apply_pressed_by(
+                "\u041d\u0435 \u043f\u043e\u0432\u0435\u0437\u043b\u043e. \u041f\u043e\u043f\u0440\u043e\u0431\u0443\u0439 \u0441\u043d\u043e\u0432\u0430 \u0447\u0435\u0440\u0435\u0437 5 \u0447\u0430\u0441\u043e\u0432.",
+                pressed_by,
+            )
         )
-        path = get_card_media_path(upgraded)
-        if not path.exists():
-            await query.message.reply_text(
-                apply_pressed_by(
-                    "\u0424\u043e\u0442\u043e \u043d\u0435 \u043d\u0430\u0439\u0434\u0435\u043d\u043e \u0434\u043b\u044f \u043d\u043e\u0432\u043e\u0439 \u043a\u0430\u0440\u0442\u043e\u0447\u043a\u0438.",
-                    pressed_by,
-                )
+
+
+async def kazik_spin_callback(
+    query,
+    parts: List[str],
+    user: Dict[str, object],
+    context: ContextTypes.DEFAULT_TYPE,
+    card_map: Dict[str, Card],
+    by_rarity: Dict[str, List[Card]],
+    pressed_by,
+    tg_user,
+    db: Dict[str, object],
+) -> None:
+    now = now_local()
+    daily_key = kazik_daily_key(now)
+    if str(user.get("kazik_daily_date") or "") != daily_key:
+        user["kazik_daily_date"] = daily_key
+        user["kazik_daily_used"] = 0
+
+    bonus_spins = int(user.get("kazik_bonus_spins", 0) or 0)
+    daily_used = int(user.get("kazik_daily_used", 0) or 0)
+    daily_limit = kazik_free_spins_limit(user)
+
+    spent_free = False
+    if bonus_spins > 0:
+        user["kazik_bonus_spins"] = bonus_spins - 1
+        spent_free = True
+    elif daily_used < daily_limit:
+        user["kazik_daily_used"] = daily_used + 1
+        spent_free = True
+    if not spent_free:
+        stars = get_star_balance(user)
+        if stars < KAZIK_STAR_SPIN_COST:
+            reset_in = max(
+                0,
+                int(
+                    (
+                        (now + timedelta(days=1)).replace(
+                            hour=0, minute=0, second=0, microsecond=0
+                        )
+                        - now
+                    ).total_seconds()
+                ),
+            )
+            await edit_message_text(
+                query.message,
+                apply_pressed_by(
+                    "\n".join(
+                        [
+                            "\u0424\u0440\u0438 \u0441\u043f\u0438\u043d\u044b \u0437\u0430\u043a\u043e\u043d\u0447\u0438\u043b\u0438\u0441\u044c.",
+                            f"\u041d\u0443\u0436\u043d\u043e {KAZIK_STAR_SPIN_COST}\u2b50 \u0434\u043b\u044f \u043a\u0440\u0443\u0442\u043a\u0438.",
+                            f"\u0421\u0431\u0440\u043e\u0441 \u0447\u0435\u0440\u0435\u0437: {format_duration(reset_in)}",
+                        ]
+                    ),
+                    pressed_by,
+                ),
+                build_kazik_spin_keyboard(kazik_spin_button_label(user)),
+            )
+            return
+        user["stars"] = stars - KAZIK_STAR_SPIN_COST
+    digits = roll_kazik_digits(win_chance=get_kazik_win_chance(user))
+    win_digit = digits[0] if digits[0] == digits[1] == digits[2] else None
+    reward_card = None
+    if win_digit is not None:
+        reward_card = pick_kazik_reward_card(
+            by_rarity,
+            win_digit,
+            allow_exclusive=False,
+        )
+        if reward_card:
+            user["inventory"].append(make_inventory_item(reward_card.file))
+    lock = context.application.bot_data["db_lock"]
+    async with lock:
+        save_db(db)
+
+    try:
+        spin_image = build_kazik_spin_image(digits, 0, title="\u041a\u0440\u0443\u0442\u0438\u043c...")
+        await send_or_edit_photo(
+            query.message,
+            spin_image,
+            apply_pressed_by("", pressed_by),
+            None,
+            prefer_edit=True,
+        )
+        await asyncio.sleep(KAZIK_SPIN_DELAY)
+    except Exception:
+        pass
+
+    win_text = ""
+    if win_digit is not None:
+        if reward_card:
+            win_text = (
+                "\u0412\u044b\u0438\u0433\u0440\u044b\u0448: "
+                f"{card_display_name(reward_card)} ({RARITY_NAMES[reward_card.rarity]})"
             )
-            return
-        with path.open("rb") as photo:
-            await send_or_edit_photo(
-                query.message,
-                photo,
-                caption,
-                build_draw_keyboard(item_id),
-                prefer_edit=True,
+        else:
+            win_text = (
+                "\u0412\u044b\u0438\u0433\u0440\u044b\u0448 \u0435\u0441\u0442\u044c, "
+                "\u043d\u043e \u043a\u0430\u0440\u0442\u043e\u0447\u0435\u043a \u043d\u0435\u0442."
             )
+    final_caption = apply_pressed_by(win_text, pressed_by)
+    result_image = build_kazik_spin_image(digits, 3)
+    spin_keyboard = build_kazik_spin_keyboard(kazik_spin_button_label(user))
+    try:
+        await send_or_edit_photo(
+            query.message,
+            result_image,
+            final_caption,
+            spin_keyboard,
+            prefer_edit=True,
+        )
+    except Exception:
+        await edit_message_text(
+            query.message,
+            final_caption,
+            spin_keyboard,
+        )
+
+
+CALLBACK_ACTION_HANDLERS: Dict[str, Tuple[int, Callable]] = {
+    "my_rarity": (1, my_rarity_callback),
+    "my_nav": (2, my_nav_callback),
+    "my_sell": (3, my_sell_callback),
+    "my_sell_cancel": (3, my_sell_cancel_callback),
+    "my_sell_confirm": (3, my_sell_confirm_callback),
+    "my_upgrade": (3, my_upgrade_callback),
+    "my_upgrade_cancel": (3, my_upgrade_cancel_callback),
+    "my_upgrade_confirm": (3, my_upgrade_confirm_callback),
+    "shop_rarity": (1, shop_rarity_callback),
+    "shop_nav": (2, shop_nav_callback),
+    "shop_buy": (2, shop_buy_callback),
+    "discount_view": (1, discount_view_callback),
+    "draw_sell": (1, draw_sell_callback),
+    "draw_sell_cancel": (1, draw_sell_cancel_callback),
+    "draw_sell_confirm": (1, draw_sell_confirm_callback),
+    "draw_upgrade": (1, draw_upgrade_callback),
+    "draw_upgrade_cancel": (1, draw_upgrade_cancel_callback),
+    "draw_upgrade_confirm": (1, draw_upgrade_confirm_callback),
+    "stars_buy": (1, stars_buy_callback),
+    "vip_reward_nav": (1, vip_reward_nav_callback),
+    "vip_reward_pick": (1, vip_reward_pick_callback),
+    "trade_accept_btn": (1, trade_accept_btn_callback),
+    "trade_accept_none": (1, trade_accept_none_callback),
+    "trade_confirm": (1, trade_confirm_callback),
+    "trade_confirm_cancel": (1, trade_confirm_cancel_callback),
+    "trade_rarity_menu": (2, trade_rarity_menu_callback),
+    "trade_rarity": (3, trade_rarity_callback),
+    "trade_nav": (4, trade_nav_callback),
+    "trade_pick": (5, trade_pick_callback),
+    "trade_cancel": (1, trade_cancel_callback),
+    "trade_decline": (1, trade_decline_callback),
+    "gift_pick": (2, gift_pick_callback),
+    "kazik_spin": (0, kazik_spin_callback),
+}
+
+
+def mark_db_dirty(context: ContextTypes.DEFAULT_TYPE) -> None:
+    application = context.application
+    if application.job_queue is None:
+        save_db(application.bot_data["db"])
+        return
+    application.bot_data["db_dirty"] = True
+
+
+def mark_discounts_dirty(context: ContextTypes.DEFAULT_TYPE) -> None:
+    application = context.application
+    if application.job_queue is None:
+        save_discount_data(application.bot_data["discounts"])
+        return
+    application.bot_data["discounts_dirty"] = True
+
+
+async def flush_db(application) -> None:
+    if not application.bot_data.get("db_dirty"):
+        return
+    lock = application.bot_data["db_lock"]
+    async with lock:
+        application.bot_data["db_dirty"] = False
+        save_db(application.bot_data["db"])
+
+
+async def flush_discounts(application) -> None:
+    if not application.bot_data.get("discounts_dirty"):
         return
+    lock = application.bot_data.setdefault("discount_lock", asyncio.Lock())
+    async with lock:
+        application.bot_data["discounts_dirty"] = False
+        save_discount_data(application.bot_data["discounts"])
+
+
+async def flush_tick(context: ContextTypes.DEFAULT_TYPE) -> None:
+    try:
+        await flush_db(context.application)
+    except Exception:
+        context.application.bot_data["db_dirty"] = True
+        logging.exception("DB flush failed")
+    try:
+        await flush_discounts(context.application)
+    except Exception:
+        context.application.bot_data["discounts_dirty"] = True
+        logging.exception("Discounts flush failed")
 
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -6307,16 +6661,29 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
 
 async def background_tick(context: ContextTypes.DEFAULT_TYPE) -> None:
+    bot_data = context.application.bot_data
     try:
-        await ensure_discounts(context)
+        day_key = discount_day_key()
+        if bot_data.get("discount_day") != day_key:
+            await ensure_discounts(context)
+            bot_data["discount_day"] = day_key
         giveaway = await ensure_giveaway(context)
         phase = giveaway_phase()
+        state = (
+            giveaway.get("date"),
+            phase,
+            giveaway.get("status"),
+            bool(giveaway.get("start_announced")),
+        )
+        if bot_data.get("giveaway_state") == state:
+            return
         if phase == "open":
             await announce_giveaway_start(context, giveaway)
         if phase == "announce" and giveaway.get("status") != "announced":
             await announce_giveaway(context, giveaway)
         if phase == "idle" and giveaway.get("status") != "announced":
             await announce_giveaway(context, giveaway)
+        bot_data["giveaway_state"] = state
     except Exception:
         logging.exception("Background tick failed")
 
@@ -6355,37 +6722,60 @@ async def reminder_tick(context: ContextTypes.DEFAULT_TYPE) -> None:
     )
 
     now = now_utc()
-    touch_ids: List[str] = []
-
+    cutoff = now - timedelta(seconds=interval_sec)
+    cutoff_iso = cutoff.isoformat()
+    targets: List[Tuple[str, Dict[str, object]]] = []
     for uid, user in users.items():
         if not isinstance(user, dict):
             continue
-        last = parse_iso(user.get("last_reminder_at"))
-        if last and (now - last).total_seconds() < interval_sec:
+        raw_last = user.get("last_reminder_at")
+        if not raw_last:
+            targets.append((uid, user))
             continue
-        try:
-            await context.bot.send_message(
-                chat_id=int(uid),
-                text=text,
-                reply_markup=reply_markup,
-                disable_web_page_preview=True,
-            )
-            touch_ids.append(uid)
-        except Forbidden:
-            touch_ids.append(uid)
-        except Exception:
-            pass
-        await asyncio.sleep(0.04)
+        if isinstance(raw_last, str) and raw_last.endswith("+00:00"):
+            # UTC ISO timestamps written by now_utc() sort lexicographically.
+            if raw_last > cutoff_iso:
+                continue
+            targets.append((uid, user))
+            continue
+        last = parse_iso(raw_last)
+        if last and last > cutoff:
+            continue
+        targets.append((uid, user))
+    if not targets:
+        return
+
+    touched: List[Dict[str, object]] = []
+    # 5 slots held for at least 0.4 s each cap reminders at 12.5 msg/s,
+    # leaving the rest of the shared rate limit to interactive replies.
+    semaphore = asyncio.Semaphore(5)
+
+    async def send_one(uid: str, user: Dict[str, object]) -> None:
+        async with semaphore:
+            try:
+                await context.bot.send_message(
+                    chat_id=int(uid),
+                    text=text,
+                    reply_markup=reply_markup,
+                    disable_web_page_preview=True,
+                )
+                touched.append(user)
+            except Forbidden:
+                touched.append(user)
+            except Exception:
+                pass
+            await asyncio.sleep(0.4)
 
-    if not touch_ids:
+    await asyncio.gather(*(send_one(uid, user) for uid, user in targets))
+
+    if not touched:
         return
+    now_iso = now.isoformat()
     lock = context.application.bot_data["db_lock"]
     async with lock:
-        for uid in touch_ids:
-            user = users.get(uid)
-            if isinstance(user, dict):
-                user["last_reminder_at"] = now.isoformat()
-        save_db(db)
+        for user in touched:
+            user["last_reminder_at"] = now_iso
+    mark_db_dirty(context)
 
 
 async def precheckout_handler(
@@ -6419,44 +6809,48 @@ async def successful_payment_handler(
         return
     db = context.application.bot_data["db"]
     user = ensure_user(db, tg_user)
-    user["stars"] = get_star_balance(user) + amount
-    lock = context.application.bot_data["db_lock"]
-    async with lock:
-        save_db(db)
+    new_balance = get_star_balance(user) + amount
+    user["stars"] = new_balance
+    mark_db_dirty(context)
+    await flush_db(context.application)
     await message.reply_text(
-        f"\u2705 \u0417\u0430\u0447\u0438\u0441\u043b\u0435\u043d\u043e {amount} \u2b50. \u0422\u0435\u043f\u0435\u0440\u044c \u043d\u0430 \u0431\u0430\u043b\u0430\u043d\u0441\u0435 {get_star_balance(user)} \u2b50."
+        f"\u2705 \u0417\u0430\u0447\u0438\u0441\u043b\u0435\u043d\u043e {amount} \u2b50. \u0422\u0435\u043f\u0435\u0440\u044c \u043d\u0430 \u0431\u0430\u043b\u0430\u043d\u0441\u0435 {new_balance} \u2b50."
     )
 
 
+COMMON_BOT_COMMANDS = [
+    BotCommand("start", "\u041c\u0435\u043d\u044e"),
+    BotCommand("sosiska", "\u041a\u0440\u0443\u0442\u043a\u0430 (\u043e\u0431\u044b\u0447\u043d\u0430\u044f)"),
+    BotCommand("kazik", "\u041a\u0430\u0437\u0438\u043a"),
+    BotCommand("my", "\u041c\u043e\u0438 \u0441\u043e\u0441\u0438\u0441\u043a\u0438"),
+    BotCommand("shop", "\u041a\u0443\u043f\u0438\u0442\u044c \u0441\u043e\u0441\u0438\u0441\u043a\u0438"),
+    BotCommand("trade", "\u0422\u0440\u0435\u0439\u0434"),
+    BotCommand("trade_accept", "\u041f\u0440\u0438\u043d\u044f\u0442\u044c \u0442\u0440\u0435\u0439\u0434"),
+    BotCommand("vip", "VIP"),
+    BotCommand("top", "\u0422\u043e\u043f"),
+]
+PRIVATE_BOT_COMMANDS = [
+    BotCommand("pay", "\u041f\u043e\u043f\u043e\u043b\u043d\u0438\u0442\u044c \u0437\u0432\u0451\u0437\u0434\u044b"),
+    BotCommand("ref", "\u0420\u0435\u0444\u0435\u0440\u0430\u043b\u044c\u043d\u0430\u044f \u0441\u0441\u044b\u043b\u043a\u0430"),
+    BotCommand("rozigrish", "\u0420\u043e\u0437\u044b\u0433\u0440\u044b\u0448 \u0434\u043d\u044f"),
+]
+
+
 async def setup_bot_commands(application) -> None:
-    common = [
-        BotCommand("start", "\u041c\u0435\u043d\u044e"),
-        BotCommand("sosiska", "\u041a\u0440\u0443\u0442\u043a\u0430 (\u043e\u0431\u044b\u0447\u043d\u0430\u044f)"),
-        BotCommand("kazik", "\u041a\u0430\u0437\u0438\u043a"),
-        BotCommand("my", "\u041c\u043e\u0438 \u0441\u043e\u0441\u0438\u0441\u043a\u0438"),
-        BotCommand("shop", "\u041a\u0443\u043f\u0438\u0442\u044c \u0441\u043e\u0441\u0438\u0441\u043a\u0438"),
-        BotCommand("trade", "\u0422\u0440\u0435\u0439\u0434"),
-        BotCommand("trade_accept", "\u041f\u0440\u0438\u043d\u044f\u0442\u044c \u0442\u0440\u0435\u0439\u0434"),
-        BotCommand("vip", "VIP"),
-        BotCommand("top", "\u0422\u043e\u043f"),
-    ]
-    private_only = [
-        BotCommand("pay", "\u041f\u043e\u043f\u043e\u043b\u043d\u0438\u0442\u044c \u0437\u0432\u0451\u0437\u0434\u044b"),
-        BotCommand("ref", "\u0420\u0435\u0444\u0435\u0440\u0430\u043b\u044c\u043d\u0430\u044f \u0441\u0441\u044b\u043b\u043a\u0430"),
-        BotCommand("rozigrish", "\u0420\u043e\u0437\u044b\u0433\u0440\u044b\u0448 \u0434\u043d\u044f"),
-    ]
-    await application.bot.set_my_commands(common)
-    await application.bot.set_my_commands(
-        common + private_only, scope=BotCommandScopeAllPrivateChats()
-    )
-    await application.bot.set_my_commands(
-        common, scope=BotCommandScopeAllGroupChats()
-    )
+    await application.bot.set_my_commands(COMMON_BOT_COMMANDS)
+    await application.bot.set_my_commands(
+        COMMON_BOT_COMMANDS + PRIVATE_BOT_COMMANDS,
+        scope=BotCommandScopeAllPrivateChats(),
+    )
+    await application.bot.set_my_commands(
+        COMMON_BOT_COMMANDS, scope=BotCommandScopeAllGroupChats()
+    )
 
 
 async def post_init(application) -> None:
     await setup_bot_commands(application)
     if application.job_queue:
+        application.job_queue.run_repeating(flush_tick, interval=1.0, first=1.0)
         application.job_queue.run_repeating(background_tick, interval=60, first=10)
         tick_raw = os.getenv("REMINDER_TICK_SEC", "").strip()
         try:
@@ -6464,6 +6858,83 @@ async def post_init(application) -> None:
         except ValueError:
             tick_sec = 6 * 60 * 60
         application.job_queue.run_repeating(reminder_tick, interval=tick_sec, first=60)
+    else:
+        logging.warning("Job queue is unavailable, saving the DB on every change")
+
+
+async def post_shutdown(application) -> None:
+    async with application.bot_data["db_lock"]:
+        application.bot_data["db_dirty"] = False
+        compact_db(application.bot_data["db"])
+    await flush_discounts(application)
+
+
+CARDS_CACHE_VERSION = 1
+
+
+def cards_cache_signature() -> Optional[Tuple[object, ...]]:
+    try:
+        stamps = [
+            (SAUSAGE_DIR / RARITY_DIRS[rarity]).stat().st_mtime_ns
+            for rarity in RARITY_ORDER
+        ]
+        stamps.append(ENV_PATH.stat().st_mtime_ns)
+    except OSError:
+        return None
+    settings = (
+        RARITY_ORDER,
+        ROLL_RARITY_ORDER,
+        tuple(sorted(RARITY_DIRS.items())),
+        tuple(sorted(IMAGE_EXTENSIONS)),
+        tuple(sorted(DROP_CHANCE_KEYS.items())),
+        tuple(sorted(RARITY_PRICE_MULTIPLIERS.items())),
+    )
+    return (CARDS_CACHE_VERSION, settings, tuple(stamps))
+
+
+def load_cards_cache(signature: Optional[Tuple[object, ...]]) -> Optional[Tuple[
+    Dict[str, Card],
+    Dict[str, List[Card]],
+    Dict[str, float],
+]]:
+    if signature is None:
+        return None
+    try:
+        cached = pickle.loads(CARDS_CACHE_FILE.read_bytes())
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logging.warning("Cards cache is unreadable, rebuilding")
+        return None
+    if not isinstance(cached, dict) or cached.get("signature") != signature:
+        return None
+    return cached["card_map"], cached["cards_by_rarity"], cached["drop_chances"]
+
+
+def save_cards_cache(
+    card_map: Dict[str, Card],
+    cards_by_rarity: Dict[str, List[Card]],
+    drop_chances: Dict[str, float],
+) -> None:
+    signature = cards_cache_signature()
+    if signature is None:
+        return
+    payload = pickle.dumps(
+        {
+            "signature": signature,
+            "card_map": card_map,
+            "cards_by_rarity": cards_by_rarity,
+            "drop_chances": drop_chances,
+        },
+        protocol=pickle.HIGHEST_PROTOCOL,
+    )
+    try:
+        CARDS_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = CARDS_CACHE_FILE.with_suffix(CARDS_CACHE_FILE.suffix + ".tmp")
+        tmp_path.write_bytes(payload)
+        os.replace(tmp_path, CARDS_CACHE_FILE)
+    except OSError:
+        logging.warning("Failed to write cards cache", exc_info=True)
 
 
 def bootstrap_env_and_cards() -> Tuple[
@@ -6471,23 +6942,25 @@ def bootstrap_env_and_cards() -> Tuple[
     Dict[str, List[Card]],
     Dict[str, float],
 ]:
-    lines, env = read_env_file(ENV_PATH)
-    lines, env = ensure_env_defaults(lines, env)
+    cached = load_cards_cache(cards_cache_signature())
+    if cached is not None:
+        return cached
+    original_lines, env = read_env_file(ENV_PATH)
+    lines, env = ensure_env_defaults(original_lines, env)
     raw_cards = env.get("SOSISKA_CARDS", "")
     cards_data: Dict[str, List[Dict[str, object]]] = {}
     if raw_cards:
         try:
-            cards_data = json.loads(strip_quotes(raw_cards))
+            cards_data = parse_cards_json(strip_quotes(raw_cards))
         except json.JSONDecodeError:
             cards_data = {}
     for rarity in RARITY_ORDER:
         cards_data.setdefault(rarity, [])
     scanned = scan_card_files()
     merged = merge_cards(cards_data, scanned)
-    updated_cards_json = json.dumps(merged, ensure_ascii=False)
     updates = {}
-    if env.get("SOSISKA_CARDS") != updated_cards_json:
-        updates["SOSISKA_CARDS"] = updated_cards_json
+    if cards_data != merged or "SOSISKA_CARDS" not in env:
+        updates["SOSISKA_CARDS"] = dump_cards_json(merged)
 
     default_drop = compute_default_drop_chances(merged)
     if "meme" in default_drop and "platinum" in default_drop:
@@ -6500,50 +6973,56 @@ def bootstrap_env_and_cards() -> Tuple[
     if updates:
         lines = upsert_env_lines(lines, updates)
         env.update(updates)
-    ENV_PATH.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    if lines != original_lines:
+        write_env_file(ENV_PATH, lines)
 
-    load_dotenv(ENV_PATH)
+    for key, value in env.items():
+        os.environ.setdefault(key, strip_quotes(value))
     card_map, cards_by_rarity = build_card_index(merged)
     drop_chances = load_drop_chances(env, default_drop)
+    save_cards_cache(card_map, cards_by_rarity, drop_chances)
     return card_map, cards_by_rarity, drop_chances
 
 
-def migrate_db(db: Dict[str, object]) -> None:
+DB_SCHEMA_VERSION = 2
+
+
+def migrate_db(db: Dict[str, object]) -> bool:
+    meta = db.get("meta")
+    if not isinstance(meta, dict):
+        meta = db["meta"] = {}
+    if meta.get("version") == DB_SCHEMA_VERSION:
+        return False
     users = db.get("users", {})
     if not isinstance(users, dict):
-        return
-    changed = False
+        return False
     now = now_utc()
     for user in users.values():
         if not isinstance(user, dict):
             continue
         if user.get("vip_reward_pending"):
             user["vip_reward_pending"] = False
-            changed = True
         if user.get("vip") and not user.get("vip_until"):
             user["vip_until"] = (now + timedelta(days=VIP_DURATION_DAYS)).isoformat()
-            changed = True
         vip_until = parse_iso(user.get("vip_until"))
         if vip_until and vip_until <= now and user.get("vip"):
             user["vip"] = False
-            changed = True
-    if changed:
-        save_db(db)
+    meta["version"] = DB_SCHEMA_VERSION
+    return True
 
 
-def acquire_single_instance_lock(path: Path) -> object:
+def acquire_single_instance_lock(path: Path) -> int:
     path.parent.mkdir(parents=True, exist_ok=True)
-    handle = path.open("a+", encoding="utf-8")
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
     try:
-        fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
     except OSError as exc:
-        handle.close()
+        os.close(fd)
         raise RuntimeError(f"Lock busy: {path}") from exc
-    handle.seek(0)
-    handle.truncate(0)
-    handle.write(f"pid={os.getpid()}\nstarted_at={datetime.utcnow().isoformat()}Z\n")
-    handle.flush()
-    return handle
+    info = f"pid={os.getpid()}\nstarted_at={datetime.utcnow().isoformat()}Z\n"
+    os.ftruncate(fd, 0)
+    os.write(fd, info.encode("ascii"))
+    return fd
 
 
 def normalize_webhook_path(path: str) -> str:
@@ -6557,13 +7036,15 @@ def main() -> None:
     ensure_utf8()
     ensure_fonts(BASE_DIR)
     card_map, cards_by_rarity, drop_chances = bootstrap_env_and_cards()
+    collect_font_candidates.cache_clear()
+    collect_font_candidates()
     bot_token = os.getenv("BOT_TOKEN", "").strip()
     if not bot_token:
         raise SystemExit("BOT_TOKEN \u043d\u0435 \u0437\u0430\u0434\u0430\u043d \u0432 .env")
 
     db = load_db()
-    migrate_db(db)
-    if sync_exclusive_stock(db, card_map, EXCLUSIVE_STOCK_LIMIT):
+    migrated = migrate_db(db)
+    if sync_exclusive_stock(db, card_map, EXCLUSIVE_STOCK_LIMIT) or migrated:
         save_db(db)
     logging.basicConfig(level=logging.INFO)
     request = HTTPXRequest(
@@ -6596,20 +7077,26 @@ def main() -> None:
             )
         )
         .post_init(post_init)
+        .post_shutdown(post_shutdown)
         .build()
     )
     application.bot_data["db"] = db
     application.bot_data["db_lock"] = asyncio.Lock()
+    application.bot_data["db_dirty"] = False
     application.bot_data["discount_lock"] = asyncio.Lock()
     application.bot_data["giveaway_lock"] = asyncio.Lock()
     application.bot_data["card_map"] = card_map
     application.bot_data["cards_by_rarity"] = cards_by_rarity
     application.bot_data["drop_chances"] = drop_chances
+    application.bot_data["non_vip_drop_chances"] = boost_drop_chances(
+        drop_chances, NON_VIP_DROP_NERF_RARITIES, NON_VIP_DROP_CHANCE_MULTIPLIER
+    )
     discounts = load_discount_data()
     if discounts.get("date") != discount_day_key():
         discounts = generate_discounts(cards_by_rarity)
         save_discount_data(discounts)
     application.bot_data["discounts"] = discounts
+    application.bot_data["discounts_dirty"] = False
     giveaway = load_giveaway_data()
     if giveaway.get("date") != giveaway_day_key():
         giveaway = create_giveaway(cards_by_rarity)
@@ -1,7 +1,19 @@
+import json
+import os
 import random
+import sys
+from bisect import bisect_right
 from dataclasses import dataclass
+from functools import lru_cache
+from itertools import accumulate, islice
+from operator import le
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from config import (
     DROP_CHANCE_KEYS,
@@ -13,7 +25,7 @@ from config import (
 )
 
 
-@dataclass
+@dataclass(**({"slots": True} if sys.version_info >= (3, 10) else {}))
 class Card:
     rarity: str
     file: str
@@ -24,26 +36,30 @@ class Card:
 def parse_price(value: Optional[object]) -> Optional[int]:
     if value is None:
         return None
-    if isinstance(value, int):
+    if type(value) is int:
         return value
-    if isinstance(value, float):
-        return int(value)
     if isinstance(value, str):
         cleaned = value.strip()
         if not cleaned or cleaned.lower() == "none":
             return None
+        try:
+            return int(cleaned)
+        except ValueError:
+            pass
         try:
             return int(float(cleaned))
         except ValueError:
             return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return int(value)
     return None
 
 
 def parse_drop_chance(value: Optional[object]) -> Optional[float]:
     if value is None:
         return None
-    if isinstance(value, (int, float)):
-        return float(value)
     if isinstance(value, str):
         cleaned = value.strip()
         if not cleaned or cleaned.lower() == "none":
@@ -52,11 +68,13 @@ def parse_drop_chance(value: Optional[object]) -> Optional[float]:
             return float(cleaned.replace(",", "."))
         except ValueError:
             return None
+    if isinstance(value, (int, float)):
+        return float(value)
     return None
 
 
 def format_drop_chance(value: float) -> str:
-    return f"{value:.2f}".rstrip("0").rstrip(".")
+    return f"{round(value, 2):.15g}"
 
 
 def format_price(value: Optional[int]) -> str:
@@ -86,57 +104,90 @@ def format_card_price(card: Card) -> str:
 
 
 def calc_sale_price(card: Card) -> Optional[int]:
-    if card.price is None:
+    price = card.price
+    if price is None:
         return None
     if card.rarity == "exclusive":
-        return card.price
-    return int(card.price * 0.6)
+        return price
+    if price < 0:
+        return -(-price * 3 // 5)
+    return price * 3 // 5
 
 
 def format_card_sale_price(card: Card) -> str:
     return format_amount(calc_sale_price(card), card_currency(card))
 
 
+@lru_cache(maxsize=8)
+def _default_drop_chances(counts: Tuple[int, ...]) -> Tuple[float, ...]:
+    total = sum(counts)
+    if total <= 0:
+        equal = 100 / len(counts)
+        return tuple(equal for _ in counts)
+    return tuple((count / total) * 100 for count in counts)
+
+
 def compute_default_drop_chances(
     cards: Dict[str, List[Dict[str, object]]],
 ) -> Dict[str, float]:
-    total = sum(len(cards.get(rarity, [])) for rarity in ROLL_RARITY_ORDER)
-    if total <= 0:
-        equal = 100 / len(ROLL_RARITY_ORDER)
-        return {rarity: equal for rarity in ROLL_RARITY_ORDER}
-    result = {}
-    for rarity in ROLL_RARITY_ORDER:
-        count = len(cards.get(rarity, []))
-        result[rarity] = (count / total) * 100
-    return result
+    counts = tuple(len(cards.get(rarity, [])) for rarity in ROLL_RARITY_ORDER)
+    return dict(zip(ROLL_RARITY_ORDER, _default_drop_chances(counts)))
+
+
+@lru_cache(maxsize=8)
+def _drop_chances(
+    raw_values: Tuple[Optional[str], ...],
+    defaults: Tuple[float, ...],
+) -> Tuple[float, ...]:
+    result = []
+    for raw, default in zip(raw_values, defaults):
+        parsed = parse_drop_chance(raw)
+        if parsed is None:
+            parsed = default
+        result.append(max(0.0, float(parsed)))
+    return tuple(result)
 
 
 def load_drop_chances(
     env: Dict[str, str],
     defaults: Dict[str, float],
 ) -> Dict[str, float]:
-    result: Dict[str, float] = {}
-    for rarity in ROLL_RARITY_ORDER:
-        key = DROP_CHANCE_KEYS[rarity]
-        parsed = parse_drop_chance(env.get(key))
-        if parsed is None:
-            parsed = defaults.get(rarity, 0.0)
-        result[rarity] = max(0.0, float(parsed))
-    return result
+    raw_values = tuple(
+        env.get(DROP_CHANCE_KEYS[rarity]) for rarity in ROLL_RARITY_ORDER
+    )
+    default_values = tuple(defaults.get(rarity, 0.0) for rarity in ROLL_RARITY_ORDER)
+    return dict(zip(ROLL_RARITY_ORDER, _drop_chances(raw_values, default_values)))
+
+
+def parse_cards_json(raw: str) -> Dict[str, List[Dict[str, object]]]:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def dump_cards_json(cards: Dict[str, List[Dict[str, object]]]) -> str:
+    if orjson is not None:
+        return orjson.dumps(cards).decode("utf-8")
+    return json.dumps(cards, ensure_ascii=False, separators=(",", ":"))
 
 
 def scan_card_files() -> Dict[str, List[str]]:
-    result: Dict[str, List[str]] = {rarity: [] for rarity in RARITY_ORDER}
+    result: Dict[str, List[str]] = {}
     for rarity in RARITY_ORDER:
         folder = SAUSAGE_DIR / RARITY_DIRS[rarity]
         folder.mkdir(parents=True, exist_ok=True)
-        for path in folder.iterdir():
-            if not path.is_file():
-                continue
-            if path.suffix.lower() not in IMAGE_EXTENSIONS:
-                continue
-            result[rarity].append(path.name)
-        result[rarity].sort()
+        names: List[str] = []
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                name = entry.name
+                dot = name.rfind(".")
+                if dot <= 0 or name[dot:].lower() not in IMAGE_EXTENSIONS:
+                    continue
+                if not entry.is_file():
+                    continue
+                names.append(name)
+        names.sort()
+        result[rarity] = names
     return result
 
 
@@ -144,100 +195,141 @@ def merge_cards(
     existing: Dict[str, List[Dict[str, object]]],
     scanned: Dict[str, List[str]],
 ) -> Dict[str, List[Dict[str, object]]]:
-    merged = {rarity: list(existing.get(rarity, [])) for rarity in RARITY_ORDER}
-    file_to_item: Dict[str, Tuple[str, Dict[str, object]]] = {}
+    merged: Dict[str, Dict[str, Dict[str, object]]] = {
+        rarity: {} for rarity in RARITY_ORDER
+    }
+    file_to_rarity: Dict[str, str] = {}
+    touched = set()
     for rarity in RARITY_ORDER:
-        cleaned = []
-        for item in merged[rarity]:
+        items = merged[rarity]
+        for item in existing.get(rarity, []):
             if not isinstance(item, dict):
                 continue
             filename = item.get("file")
             if not filename or not isinstance(filename, str):
                 continue
-            if filename in file_to_item:
+            if filename in file_to_rarity:
                 continue
-            file_to_item[filename] = (rarity, item)
-            cleaned.append(item)
-        merged[rarity] = cleaned
+            file_to_rarity[filename] = rarity
+            items[filename] = item
 
     for rarity in RARITY_ORDER:
+        items = merged[rarity]
         for filename in scanned.get(rarity, []):
-            if filename in file_to_item:
-                old_rarity, item = file_to_item[filename]
-                if old_rarity != rarity:
-                    merged[old_rarity] = [
-                        existing_item
-                        for existing_item in merged[old_rarity]
-                        if existing_item.get("file") != filename
-                    ]
-                    merged[rarity].append(item)
-                    file_to_item[filename] = (rarity, item)
+            old_rarity = file_to_rarity.get(filename)
+            if old_rarity is None:
+                items[filename] = {"file": filename, "name": None, "price": None}
+            elif old_rarity != rarity:
+                items[filename] = merged[old_rarity].pop(filename)
+                touched.add(old_rarity)
             else:
-                new_item = {"file": filename, "name": None, "price": None}
-                merged[rarity].append(new_item)
-                file_to_item[filename] = (rarity, new_item)
-
-    for rarity in RARITY_ORDER:
-        merged[rarity].sort(key=lambda item: str(item.get("file", "")).lower())
-    return merged
+                continue
+            file_to_rarity[filename] = rarity
+            touched.add(rarity)
+
+    result: Dict[str, List[Dict[str, object]]] = {}
+    for rarity, items in merged.items():
+        keys = [filename.lower() for filename in items]
+        original = existing.get(rarity)
+        if (
+            rarity not in touched
+            and isinstance(original, list)
+            and len(original) == len(items)
+            and all(map(le, keys, islice(keys, 1, None)))
+        ):
+            result[rarity] = original
+            continue
+        values = list(items.values())
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        result[rarity] = [values[index] for index in order]
+    return result
 
 
 def build_card_index(
     cards: Dict[str, List[Dict[str, object]]],
 ) -> Tuple[Dict[str, Card], Dict[str, List[Card]]]:
     card_map: Dict[str, Card] = {}
-    by_rarity: Dict[str, List[Card]] = {rarity: [] for rarity in RARITY_ORDER}
+    by_rarity: Dict[str, List[Card]] = {}
+    make_card = Card
+    to_price = parse_price
     for rarity in RARITY_ORDER:
-        for item in cards.get(rarity, []):
+        rarity_cards: List[Card] = []
+        append = rarity_cards.append
+        for item in cards.get(rarity, ()):
             filename = item.get("file")
             if not filename or not isinstance(filename, str):
                 continue
-            card = Card(
-                rarity=rarity,
-                file=filename,
-                name=item.get("name"),
-                price=parse_price(item.get("price")),
-            )
-            by_rarity[rarity].append(card)
+            card = make_card(rarity, filename, item.get("name"), to_price(item.get("price")))
+            append(card)
             card_map[filename] = card
+        by_rarity[rarity] = rarity_cards
     return card_map, by_rarity
 
 
-def card_display_name(card: Card) -> str:
-    if card.name and str(card.name).strip():
-        return str(card.name).strip()
-    stem = Path(card.file).stem
+def display_name_for(file: str, name: Optional[object]) -> str:
+    if name and str(name).strip():
+        return str(name).strip()
+    stem = Path(file).stem
     return stem if stem else "Без имени"
 
 
+def card_display_name(card: Card) -> str:
+    return display_name_for(card.file, card.name)
+
+
 def card_file_path(card: Card) -> Path:
     return SAUSAGE_DIR / RARITY_DIRS[card.rarity] / card.file
 
 
+@lru_cache(maxsize=32)
+def _folder_names(folder: Path, mtime_ns: int) -> frozenset:
+    with os.scandir(folder) as entries:
+        return frozenset(entry.name for entry in entries)
+
+
+def _existing_card_files(rarity: str) -> frozenset:
+    folder = SAUSAGE_DIR / RARITY_DIRS[rarity]
+    try:
+        return _folder_names(folder, folder.stat().st_mtime_ns)
+    except OSError:
+        return frozenset()
+
+
 def filter_existing_cards(
     by_rarity: Dict[str, List[Card]],
 ) -> Dict[str, List[Card]]:
     result: Dict[str, List[Card]] = {}
     for rarity, cards in by_rarity.items():
-        result[rarity] = [card for card in cards if card_file_path(card).exists()]
+        present = _existing_card_files(rarity)
+        result[rarity] = [card for card in cards if card.file in present]
     return result
 
 
+@lru_cache(maxsize=32)
+def _roll_table(
+    weights: Tuple[float, ...],
+) -> Tuple[Tuple[float, ...], float]:
+    if sum(weights) <= 0:
+        weights = (1.0,) * len(weights)
+    cum_weights = tuple(accumulate(weights))
+    return cum_weights, cum_weights[-1]
+
+
 def pick_random_card(
     by_rarity: Dict[str, List[Card]],
     drop_chances: Dict[str, float],
-    rarity_order: Optional[List[str]] = None,
+    rarity_order: Optional[Sequence[str]] = None,
 ) -> Optional[Card]:
     if rarity_order is None:
         rarity_order = ROLL_RARITY_ORDER
     available = [rarity for rarity in rarity_order if by_rarity.get(rarity)]
     if not available:
         return None
-    weights = [drop_chances.get(rarity, 0.0) for rarity in available]
-    if sum(weights) <= 0:
-        weights = [1.0 for _ in available]
-    picked_rarity = random.choices(available, weights=weights, k=1)[0]
-    return random.choice(by_rarity[picked_rarity])
+    cum_weights, total = _roll_table(
+        tuple(float(drop_chances.get(rarity, 0.0)) for rarity in available)
+    )
+    index = bisect_right(cum_weights, random.random() * total, 0, len(available) - 1)
+    return random.choice(by_rarity[available[index]])
 
 
 __all__ = [
@@ -254,10 +346,13 @@ __all__ = [
     "format_card_sale_price",
     "compute_default_drop_chances",
     "load_drop_chances",
+    "parse_cards_json",
+    "dump_cards_json",
     "scan_card_files",
     "merge_cards",
     "build_card_index",
     "card_display_name",
+    "display_name_for",
     "card_file_path",
     "filter_existing_cards",
     "pick_random_card",
@@ -1,41 +1,61 @@
 import json
 import os
+import sys
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from dotenv import load_dotenv
 
 BASE_DIR = Path(__file__).resolve().parent
 ENV_PATH = Path(os.getenv("ENV_PATH", BASE_DIR / ".env"))
-load_dotenv(ENV_PATH, override=True)
+_env_loaded = False
+
+
+def load_env() -> None:
+    global _env_loaded
+    if _env_loaded:
+        return
+    load_dotenv(ENV_PATH, override=True)
+    _env_loaded = True
+
+
+load_env()
+_ENV = os.environ.copy()
+_getenv = _ENV.get
 
 
 def _parse_int(value: Optional[str], default: int) -> int:
+    if value is None:
+        return default
     try:
         return int(str(value).strip())
     except (TypeError, ValueError):
         return default
-TIMEZONE = os.getenv("TIMEZONE", "Europe/Moscow").strip()
-BOT_TOKEN = os.getenv("BOT_TOKEN", "").strip()
-STARS_PROVIDER_TOKEN = os.getenv("STARS_PROVIDER_TOKEN", "").strip()
-DATABASE_URL = os.getenv("DATABASE_URL", "").strip()
-REDIS_URL = os.getenv("REDIS_URL", "").strip()
-PUBLIC_BOT_USERNAME = os.getenv("PUBLIC_BOT_USERNAME", "").strip()
-ADMIN_BROADCAST_USER_ID = _parse_int(os.getenv("ADMIN_BROADCAST_USER_ID"), 6603471853)
-BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
-WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").strip()
-MINIAPP_URL = os.getenv("MINIAPP_URL", "").strip()
-WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram").strip()
-WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "").strip()
-WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0").strip()
-WEBHOOK_PORT = _parse_int(os.getenv("WEBHOOK_PORT"), 8080)
-
-
-def load_env() -> None:
-    load_dotenv(ENV_PATH, override=True)
+TIMEZONE = _getenv("TIMEZONE", "Europe/Moscow").strip()
+BOT_TOKEN = _getenv("BOT_TOKEN", "").strip()
+STARS_PROVIDER_TOKEN = _getenv("STARS_PROVIDER_TOKEN", "").strip()
+DATABASE_URL = _getenv("DATABASE_URL", "").strip()
+REDIS_URL = _getenv("REDIS_URL", "").strip()
+PUBLIC_BOT_USERNAME = _getenv("PUBLIC_BOT_USERNAME", "").strip()
+ADMIN_BROADCAST_USER_ID = _parse_int(_getenv("ADMIN_BROADCAST_USER_ID"), 6603471853)
+BOT_MODE = _getenv("BOT_MODE", "polling").strip().lower()
+WEBHOOK_URL = _getenv("WEBHOOK_URL", "").strip()
+MINIAPP_URL = _getenv("MINIAPP_URL", "").strip()
+WEBHOOK_PATH = _getenv("WEBHOOK_PATH", "/telegram").strip()
+WEBHOOK_SECRET_TOKEN = _getenv("WEBHOOK_SECRET_TOKEN", "").strip()
+WEBHOOK_LISTEN = _getenv("WEBHOOK_LISTEN", "0.0.0.0").strip()
+WEBHOOK_PORT = _parse_int(_getenv("WEBHOOK_PORT"), 8080)
 
 
 def _parse_float(value: Optional[str], default: float) -> float:
+    if value is None:
+        return default
     try:
         return float(str(value).strip().replace(",", "."))
     except (TypeError, ValueError):
@@ -56,68 +76,82 @@ def _parse_csv(
 ) -> List[str]:
     if not value:
         return list(default)
-    parts = [item.strip() for item in value.replace(";", ",").split(",")]
-    parts = [item for item in parts if item]
-    return [cast(item) for item in parts]
+    parts = map(str.strip, value.replace(";", ",").split(","))
+    return [cast(item) for item in parts if item]
 
 
 def _parse_json(value: Optional[str], default):
     if not value:
         return default
     try:
+        if orjson is not None:
+            return orjson.loads(value)
         return json.loads(value)
     except json.JSONDecodeError:
         return default
 
 
-def _resolve_path(raw: Optional[str], default: Path) -> Path:
-    if not raw:
-        return default
-    path = Path(raw)
-    if path.is_absolute() or (len(raw) >= 2 and raw[1] == ":"):
-        return path
-    return BASE_DIR / path
+def _rarity_key(key) -> str:
+    return sys.intern(str(key))
 
 
-def _resolve_path_from(base: Path, raw: Optional[str], default: Path) -> Path:
-    if not raw:
-        return default
-    path = Path(raw)
-    if path.is_absolute() or (len(raw) >= 2 and raw[1] == ":"):
-        return path
-    return base / path
+def _coerce_dict(mapping: Dict, key_cast, value_cast) -> Dict:
+    for key, value in mapping.items():
+        if key_cast(key) is not key or type(value) is not value_cast:
+            return {key_cast(key): value_cast(value) for key, value in mapping.items()}
+    return mapping
 
 
-def _resolve_optional_path(raw: Optional[str]) -> Optional[Path]:
+def _resolve_path(
+    raw: Optional[str],
+    default: Optional[Path],
+    base: Path = BASE_DIR,
+) -> Optional[Path]:
     if not raw:
-        return None
-    path = Path(raw)
-    if path.is_absolute() or (len(raw) >= 2 and raw[1] == ":"):
-        return path
-    return BASE_DIR / path
-
-
-LOG_DIR = _resolve_path(os.getenv("LOG_DIR"), BASE_DIR / "logs")
-LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").strip()
-LOG_RUNTIME_FILE = _resolve_path_from(
-    LOG_DIR,
-    os.getenv("LOG_RUNTIME_FILE"),
+        return default
+    if os.path.isabs(raw) or raw[1:2] == ":":
+        return Path(raw)
+    return base / raw
+
+
+def filter_existing_paths(paths: List[Path]) -> List[Path]:
+    listings: Dict[Path, FrozenSet[str]] = {}
+    result = []
+    for path in paths:
+        parent = path.parent
+        names = listings.get(parent)
+        if names is None:
+            try:
+                names = frozenset(map(os.path.normcase, os.listdir(parent)))
+            except OSError:
+                names = frozenset()
+            listings[parent] = names
+        if os.path.normcase(path.name) in names:
+            result.append(path)
+    return result
+
+
+LOG_DIR = _resolve_path(_getenv("LOG_DIR"), BASE_DIR / "logs")
+LOG_LEVEL = _getenv("LOG_LEVEL", "INFO").strip()
+LOG_RUNTIME_FILE = _resolve_path(
+    _getenv("LOG_RUNTIME_FILE"),
     LOG_DIR / "runtime" / "runtime.log",
-)
-LOG_KAZIK_FILE = _resolve_path_from(
     LOG_DIR,
-    os.getenv("LOG_KAZIK_FILE"),
-    LOG_DIR / "kazik" / "kazik.log",
 )
-LOG_CARDS_FILE = _resolve_path_from(
+LOG_KAZIK_FILE = _resolve_path(
+    _getenv("LOG_KAZIK_FILE"),
+    LOG_DIR / "kazik" / "kazik.log",
     LOG_DIR,
-    os.getenv("LOG_CARDS_FILE"),
-    LOG_DIR / "cards" / "cards.log",
 )
-LOG_GIVEAWAY_FILE = _resolve_path_from(
+LOG_CARDS_FILE = _resolve_path(
+    _getenv("LOG_CARDS_FILE"),
+    LOG_DIR / "cards" / "cards.log",
     LOG_DIR,
-    os.getenv("LOG_GIVEAWAY_FILE"),
+)
+LOG_GIVEAWAY_FILE = _resolve_path(
+    _getenv("LOG_GIVEAWAY_FILE"),
     LOG_DIR / "giveaway" / "giveaway.log",
+    LOG_DIR,
 )
 
 if not MINIAPP_URL and WEBHOOK_URL:
@@ -125,62 +159,80 @@ if not MINIAPP_URL and WEBHOOK_URL:
 
 
 def strip_quotes(value: str) -> str:
-    if len(value) >= 2 and value[0] == value[-1] and value[0] in {"'", '"'}:
+    if len(value) >= 2 and value[0] in "'\"" and value[-1] == value[0]:
         return value[1:-1]
     return value
 
 
 def read_env_file(path: Path) -> Tuple[List[str], Dict[str, str]]:
-    if not path.exists():
+    try:
+        lines = path.read_text(encoding="utf-8").splitlines()
+    except FileNotFoundError:
         return [], {}
-    lines = path.read_text(encoding="utf-8").splitlines()
     data = {}
     for line in lines:
-        stripped = line.strip()
-        if not stripped or stripped.startswith("#") or "=" not in line:
+        key, sep, value = line.partition("=")
+        if not sep:
+            continue
+        key = key.strip()
+        if key[:1] == "#":
             continue
-        key, value = line.split("=", 1)
-        data[key.strip()] = value.strip()
+        data[key] = value.strip()
     return lines, data
 
 
 def upsert_env_lines(lines: List[str], updates: Dict[str, str]) -> List[str]:
     new_lines = []
-    seen = set()
+    pending = dict(updates)
     for line in lines:
-        stripped = line.strip()
-        if not stripped or stripped.startswith("#") or "=" not in line:
-            new_lines.append(line)
-            continue
-        key = line.split("=", 1)[0].strip()
-        if key in updates:
+        key, sep, _ = line.partition("=")
+        key = key.strip()
+        if sep and key in updates:
             new_lines.append(f"{key}={updates[key]}")
-            seen.add(key)
+            pending.pop(key, None)
         else:
             new_lines.append(line)
-    for key, value in updates.items():
-        if key not in seen:
-            new_lines.append(f"{key}={value}")
+    new_lines.extend(f"{key}={value}" for key, value in pending.items())
     return new_lines
 
 
+def write_env_file(path: Path, lines: List[str]) -> None:
+    path.write_bytes("\n".join([*lines, ""]).encode("utf-8"))
+
+
+def _format_env_items(value) -> str:
+    return ",".join(str(item) for item in value)
+
+
+def _format_env_set(value) -> str:
+    return _format_env_items(sorted(value))
+
+
+def _format_env_json(value) -> str:
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+_ENV_VALUE_FORMATTERS = {
+    type(None): lambda value: "",
+    bool: lambda value: "1" if value else "0",
+    list: _format_env_items,
+    tuple: _format_env_items,
+    set: _format_env_set,
+    frozenset: _format_env_set,
+    dict: _format_env_json,
+}
+
+
 def _format_env_value(value) -> str:
-    if value is None:
-        return ""
-    if isinstance(value, bool):
-        return "1" if value else "0"
-    if isinstance(value, (list, tuple, set)):
-        items = list(value)
-        if isinstance(value, set):
-            items = sorted(items)
-        return ",".join(str(item) for item in items)
-    if isinstance(value, dict):
-        return json.dumps(value, ensure_ascii=False)
-    if isinstance(value, Path):
-        return str(value)
-    return str(value)
+    value_type = type(value)
+    if value_type is str:
+        return value
+    return _ENV_VALUE_FORMATTERS.get(value_type, str)(value)
 
 
+@lru_cache(maxsize=None)
 def _build_env_defaults() -> Dict[str, str]:
     defaults = {
         "ENV_PATH": ENV_PATH,
@@ -213,6 +265,9 @@ def _build_env_defaults() -> Dict[str, str]:
         "IMAGE_EXTENSIONS": IMAGE_EXTENSIONS,
         "DATA_DIR": DATA_DIR,
         "DB_PATH": DB_PATH,
+        "DB_JOURNAL_PATH": DB_JOURNAL_PATH,
+        "DB_JOURNAL_MAX_BYTES": DB_JOURNAL_MAX_BYTES,
+        "CARDS_CACHE_FILE": CARDS_CACHE_FILE,
         "SAUSAGE_DIR": SAUSAGE_DIR,
         "PHOTO_CACHE_DIR": PHOTO_CACHE_DIR,
         "LEADERBOARD_BG": LEADERBOARD_BG,
@@ -357,15 +412,32 @@ DEFAULT_RARITY_ORDER = [
     "exclusive",
 ]
 
-RARITY_ORDER = _parse_csv(os.getenv("RARITY_ORDER"), DEFAULT_RARITY_ORDER)
-ROLL_RARITY_EXCLUDE = set(_parse_csv(os.getenv("ROLL_RARITY_EXCLUDE"), []))
-SHOP_RARITY_EXCLUDE = set(_parse_csv(os.getenv("SHOP_RARITY_EXCLUDE"), []))
-ROLL_RARITY_ORDER = [
+RARITY_ORDER: Tuple[str, ...] = tuple(
+    _parse_csv(_getenv("RARITY_ORDER"), DEFAULT_RARITY_ORDER, cast=sys.intern)
+)
+ROLL_RARITY_EXCLUDE: FrozenSet[str] = frozenset(
+    _parse_csv(_getenv("ROLL_RARITY_EXCLUDE"), [])
+)
+SHOP_RARITY_EXCLUDE: FrozenSet[str] = frozenset(
+    _parse_csv(_getenv("SHOP_RARITY_EXCLUDE"), [])
+)
+ROLL_RARITY_ORDER: Tuple[str, ...] = tuple(
     rarity
     for rarity in RARITY_ORDER
     if rarity != "exclusive" and rarity not in ROLL_RARITY_EXCLUDE
-]
-SHOP_RARITY_ORDER = [rarity for rarity in RARITY_ORDER if rarity not in SHOP_RARITY_EXCLUDE]
+)
+SHOP_RARITY_ORDER: Tuple[str, ...] = tuple(
+    rarity for rarity in RARITY_ORDER if rarity not in SHOP_RARITY_EXCLUDE
+)
+RARITY_INDEX: Dict[str, int] = {
+    rarity: index for index, rarity in enumerate(RARITY_ORDER)
+}
+ROLL_RARITY_INDEX: Dict[str, int] = {
+    rarity: index for index, rarity in enumerate(ROLL_RARITY_ORDER)
+}
+SHOP_RARITY_INDEX: Dict[str, int] = {
+    rarity: index for index, rarity in enumerate(SHOP_RARITY_ORDER)
+}
 
 DEFAULT_RARITY_NAMES = {
     "dno": "💩 Дно",
@@ -378,7 +450,9 @@ DEFAULT_RARITY_NAMES = {
     "meme": "😂 Мемные",
     "exclusive": "👑 Exclusive",
 }
-RARITY_NAMES = _parse_json(os.getenv("RARITY_NAMES"), DEFAULT_RARITY_NAMES)
+RARITY_NAMES = _parse_json(_getenv("RARITY_NAMES"), DEFAULT_RARITY_NAMES)
+if isinstance(RARITY_NAMES, dict):
+    RARITY_NAMES = _coerce_dict(RARITY_NAMES, _rarity_key, str)
 
 DEFAULT_RARITY_DIRS = {
     "dno": "Дно",
@@ -391,123 +465,129 @@ DEFAULT_RARITY_DIRS = {
     "meme": "Мемные",
     "exclusive": "Exclusive",
 }
-RARITY_DIRS = _parse_json(os.getenv("RARITY_DIRS"), DEFAULT_RARITY_DIRS)
+RARITY_DIRS = _parse_json(_getenv("RARITY_DIRS"), DEFAULT_RARITY_DIRS)
+if isinstance(RARITY_DIRS, dict):
+    RARITY_DIRS = _coerce_dict(RARITY_DIRS, _rarity_key, str)
 
-RARITY_PRICE_MULTIPLIERS = _parse_json(os.getenv("RARITY_PRICE_MULTIPLIERS"), {})
+RARITY_PRICE_MULTIPLIERS = _parse_json(_getenv("RARITY_PRICE_MULTIPLIERS"), {})
 if not isinstance(RARITY_PRICE_MULTIPLIERS, dict):
     RARITY_PRICE_MULTIPLIERS = {}
-RARITY_PRICE_MULTIPLIERS = {
-    str(key): float(value) for key, value in RARITY_PRICE_MULTIPLIERS.items()
-}
+RARITY_PRICE_MULTIPLIERS = _coerce_dict(RARITY_PRICE_MULTIPLIERS, _rarity_key, float)
 
 DEFAULT_IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png", ".webp", ".gif", ".mp4", ".webm"]
-IMAGE_EXTENSIONS: Set[str] = set(
+IMAGE_EXTENSIONS: FrozenSet[str] = frozenset(
     ext.lower()
-    for ext in _parse_csv(os.getenv("IMAGE_EXTENSIONS"), DEFAULT_IMAGE_EXTENSIONS)
+    for ext in _parse_csv(_getenv("IMAGE_EXTENSIONS"), DEFAULT_IMAGE_EXTENSIONS)
 )
 
-DATA_DIR = _resolve_path(os.getenv("DATA_DIR"), BASE_DIR / "data")
-DB_PATH = _resolve_path(os.getenv("DB_PATH"), DATA_DIR / "db.json")
-SAUSAGE_DIR = _resolve_path(os.getenv("SAUSAGE_DIR"), BASE_DIR / "Сосиски")
-PHOTO_CACHE_DIR = _resolve_path(os.getenv("PHOTO_CACHE_DIR"), BASE_DIR / "photo")
-LEADERBOARD_BG = _resolve_path(os.getenv("LEADERBOARD_BG"), BASE_DIR / "photo.png")
+_BASE_DATA_DIR = BASE_DIR / "data"
+DATA_DIR = _resolve_path(_getenv("DATA_DIR"), _BASE_DATA_DIR)
+DB_PATH = _resolve_path(_getenv("DB_PATH"), DATA_DIR / "db.json")
+DB_JOURNAL_PATH = _resolve_path(
+    _getenv("DB_JOURNAL_PATH"), DB_PATH.with_name(DB_PATH.name + ".log")
+)
+DB_JOURNAL_MAX_BYTES = _parse_int(_getenv("DB_JOURNAL_MAX_BYTES"), 4 * 1024 * 1024)
+CARDS_CACHE_FILE = _resolve_path(
+    _getenv("CARDS_CACHE_FILE"), DATA_DIR / "cards.cache.pkl"
+)
+SAUSAGE_DIR = _resolve_path(_getenv("SAUSAGE_DIR"), BASE_DIR / "Сосиски")
+PHOTO_CACHE_DIR = _resolve_path(_getenv("PHOTO_CACHE_DIR"), BASE_DIR / "photo")
+LEADERBOARD_BG = _resolve_path(_getenv("LEADERBOARD_BG"), BASE_DIR / "photo.png")
 
-ROLL_COOLDOWN_SEC = _parse_int(os.getenv("ROLL_COOLDOWN_SEC"), 3 * 60 * 60)
-VIP_ROLL_COOLDOWN_SEC = _parse_int(os.getenv("VIP_ROLL_COOLDOWN_SEC"), 60 * 60)
-VIP_DAILY_ROLL_LIMIT = _parse_int(os.getenv("VIP_DAILY_ROLL_LIMIT"), 7)
+ROLL_COOLDOWN_SEC = _parse_int(_getenv("ROLL_COOLDOWN_SEC"), 3 * 60 * 60)
+VIP_ROLL_COOLDOWN_SEC = _parse_int(_getenv("VIP_ROLL_COOLDOWN_SEC"), 60 * 60)
+VIP_DAILY_ROLL_LIMIT = _parse_int(_getenv("VIP_DAILY_ROLL_LIMIT"), 7)
 VIP_DROP_CHANCE_MULTIPLIER = _parse_float(
-    os.getenv("VIP_DROP_CHANCE_MULTIPLIER"), 1.0
+    _getenv("VIP_DROP_CHANCE_MULTIPLIER"), 1.0
 )
 VIP_DROP_BOOST_RARITIES = _parse_csv(
-    os.getenv("VIP_DROP_BOOST_RARITIES"),
+    _getenv("VIP_DROP_BOOST_RARITIES"),
     ["rare", "epic", "legendary", "platinum", "meme", "exclusive"],
 )
 NON_VIP_DROP_CHANCE_MULTIPLIER = _parse_float(
-    os.getenv("NON_VIP_DROP_CHANCE_MULTIPLIER"), 0.7
+    _getenv("NON_VIP_DROP_CHANCE_MULTIPLIER"), 0.7
 )
 NON_VIP_DROP_NERF_RARITIES = _parse_csv(
-    os.getenv("NON_VIP_DROP_NERF_RARITIES"),
+    _getenv("NON_VIP_DROP_NERF_RARITIES"),
     list(VIP_DROP_BOOST_RARITIES),
 )
-NEWBIE_DAYS_STRONG = _parse_int(os.getenv("NEWBIE_DAYS_STRONG"), 1)
-NEWBIE_DAYS_VIP = _parse_int(os.getenv("NEWBIE_DAYS_VIP"), 3)
+NEWBIE_DAYS_STRONG = _parse_int(_getenv("NEWBIE_DAYS_STRONG"), 1)
+NEWBIE_DAYS_VIP = _parse_int(_getenv("NEWBIE_DAYS_VIP"), 3)
 NEWBIE_DROP_CHANCE_MULTIPLIER = _parse_float(
-    os.getenv("NEWBIE_DROP_CHANCE_MULTIPLIER"), 1.0
+    _getenv("NEWBIE_DROP_CHANCE_MULTIPLIER"), 1.0
 )
 NEWBIE_KAZIK_WIN_MULTIPLIER = _parse_float(
-    os.getenv("NEWBIE_KAZIK_WIN_MULTIPLIER"), 1.0
-)
-GIFT_COOLDOWN_SEC = _parse_int(os.getenv("GIFT_COOLDOWN_SEC"), 6 * 60 * 60)
-GIFT_BUTTONS = _parse_int(os.getenv("GIFT_BUTTONS"), 3)
-GIFT_REWARD_COUNT = _parse_int(os.getenv("GIFT_REWARD_COUNT"), 3)
-CONTRACT_REQUIRED_COUNT = _parse_int(os.getenv("CONTRACT_REQUIRED_COUNT"), 4)
-CONTRACT_SUCCESS_CHANCE = _parse_float(os.getenv("CONTRACT_SUCCESS_CHANCE"), 0.8)
-CONTRACT_COST_BALANCE = _parse_int(os.getenv("CONTRACT_COST_BALANCE"), 250)
-SHOWCASE_CRAFT_COUNT = _parse_int(os.getenv("SHOWCASE_CRAFT_COUNT"), 5)
+    _getenv("NEWBIE_KAZIK_WIN_MULTIPLIER"), 1.0
+)
+GIFT_COOLDOWN_SEC = _parse_int(_getenv("GIFT_COOLDOWN_SEC"), 6 * 60 * 60)
+GIFT_BUTTONS = _parse_int(_getenv("GIFT_BUTTONS"), 3)
+GIFT_REWARD_COUNT = _parse_int(_getenv("GIFT_REWARD_COUNT"), 3)
+CONTRACT_REQUIRED_COUNT = _parse_int(_getenv("CONTRACT_REQUIRED_COUNT"), 4)
+CONTRACT_SUCCESS_CHANCE = _parse_float(_getenv("CONTRACT_SUCCESS_CHANCE"), 0.8)
+CONTRACT_COST_BALANCE = _parse_int(_getenv("CONTRACT_COST_BALANCE"), 250)
+SHOWCASE_CRAFT_COUNT = _parse_int(_getenv("SHOWCASE_CRAFT_COUNT"), 5)
 SHOWCASE_CRAFT_COST_BALANCE = _parse_int(
-    os.getenv("SHOWCASE_CRAFT_COST_BALANCE"), 5000
+    _getenv("SHOWCASE_CRAFT_COST_BALANCE"), 5000
 )
-SHOWCASE_MAX_ACTIVE = _parse_int(os.getenv("SHOWCASE_MAX_ACTIVE"), 3)
-VIP_INFINITE_DAYS = _parse_int(os.getenv("VIP_INFINITE_DAYS"), 36500)
-NEWBIE_START_BALANCE = _parse_int(os.getenv("NEWBIE_START_BALANCE"), 500)
-NEWBIE_START_FREE_ROLLS = _parse_int(os.getenv("NEWBIE_START_FREE_ROLLS"), 50)
+SHOWCASE_MAX_ACTIVE = _parse_int(_getenv("SHOWCASE_MAX_ACTIVE"), 3)
+VIP_INFINITE_DAYS = _parse_int(_getenv("VIP_INFINITE_DAYS"), 36500)
+NEWBIE_START_BALANCE = _parse_int(_getenv("NEWBIE_START_BALANCE"), 500)
+NEWBIE_START_FREE_ROLLS = _parse_int(_getenv("NEWBIE_START_FREE_ROLLS"), 50)
 
-KAZIK_SPIN_COST = _parse_int(os.getenv("KAZIK_SPIN_COST"), 10)
-VIP_KAZIK_SPIN_COST = _parse_int(os.getenv("VIP_KAZIK_SPIN_COST"), 5)
-KAZIK_STAR_SPIN_COST = _parse_int(os.getenv("KAZIK_STAR_SPIN_COST"), 1)
+KAZIK_SPIN_COST = _parse_int(_getenv("KAZIK_SPIN_COST"), 10)
+VIP_KAZIK_SPIN_COST = _parse_int(_getenv("VIP_KAZIK_SPIN_COST"), 5)
+KAZIK_STAR_SPIN_COST = _parse_int(_getenv("KAZIK_STAR_SPIN_COST"), 1)
 KAZIK_FREE_SPIN_COOLDOWN_SEC = _parse_int(
-    os.getenv("KAZIK_FREE_SPIN_COOLDOWN_SEC"), 86400
+    _getenv("KAZIK_FREE_SPIN_COOLDOWN_SEC"), 86400
 )
-KAZIK_FREE_SPINS_FREE = _parse_int(os.getenv("KAZIK_FREE_SPINS_FREE"), 5)
-KAZIK_FREE_SPINS_VIP = _parse_int(os.getenv("KAZIK_FREE_SPINS_VIP"), 10)
+KAZIK_FREE_SPINS_FREE = _parse_int(_getenv("KAZIK_FREE_SPINS_FREE"), 5)
+KAZIK_FREE_SPINS_VIP = _parse_int(_getenv("KAZIK_FREE_SPINS_VIP"), 10)
 KAZIK_PAID_SPINS_FOR_BONUS = _parse_int(
-    os.getenv("KAZIK_PAID_SPINS_FOR_BONUS"), 5
+    _getenv("KAZIK_PAID_SPINS_FOR_BONUS"), 5
 )
 KAZIK_BONUS_SPINS_PER_BATCH = _parse_int(
-    os.getenv("KAZIK_BONUS_SPINS_PER_BATCH"), 1
+    _getenv("KAZIK_BONUS_SPINS_PER_BATCH"), 1
 )
-KAZIK_GUARANTEE_SPINS = _parse_int(os.getenv("KAZIK_GUARANTEE_SPINS"), 0)
-KAZIK_WIN_CHANCE = _parse_float(os.getenv("KAZIK_WIN_CHANCE"), 0.01)
-VIP_KAZIK_WIN_CHANCE = _parse_float(os.getenv("VIP_KAZIK_WIN_CHANCE"), 0.015)
+KAZIK_GUARANTEE_SPINS = _parse_int(_getenv("KAZIK_GUARANTEE_SPINS"), 0)
+KAZIK_WIN_CHANCE = _parse_float(_getenv("KAZIK_WIN_CHANCE"), 0.01)
+VIP_KAZIK_WIN_CHANCE = _parse_float(_getenv("VIP_KAZIK_WIN_CHANCE"), 0.015)
 KAZIK_WIN_WEIGHTS = _parse_json(
-    os.getenv("KAZIK_WIN_WEIGHTS"), {1: 0.6, 2: 0.3, 3: 0.1}
+    _getenv("KAZIK_WIN_WEIGHTS"), {1: 0.6, 2: 0.3, 3: 0.1}
 )
 if isinstance(KAZIK_WIN_WEIGHTS, dict):
-    KAZIK_WIN_WEIGHTS = {
-        int(key): float(value) for key, value in KAZIK_WIN_WEIGHTS.items()
-    }
-KAZIK_DIGITS = [int(item) for item in _parse_csv(os.getenv("KAZIK_DIGITS"), ["1", "2", "3"])]
+    KAZIK_WIN_WEIGHTS = _coerce_dict(KAZIK_WIN_WEIGHTS, int, float)
+KAZIK_DIGITS = [int(item) for item in _parse_csv(_getenv("KAZIK_DIGITS"), ["1", "2", "3"])]
 VIP_KAZIK_EXCLUSIVE_CHANCE = _parse_float(
-    os.getenv("VIP_KAZIK_EXCLUSIVE_CHANCE"), 0.04
-)
-
-KAZIK_IMAGE_WIDTH = _parse_int(os.getenv("KAZIK_IMAGE_WIDTH"), 900)
-KAZIK_IMAGE_HEIGHT = _parse_int(os.getenv("KAZIK_IMAGE_HEIGHT"), 360)
-KAZIK_DIGIT_SIZE = _parse_int(os.getenv("KAZIK_DIGIT_SIZE"), 120)
-KAZIK_SLOT_GAP = _parse_int(os.getenv("KAZIK_SLOT_GAP"), 30)
-KAZIK_SLOT_RADIUS = _parse_int(os.getenv("KAZIK_SLOT_RADIUS"), 26)
-KAZIK_SPIN_DELAY = _parse_float(os.getenv("KAZIK_SPIN_DELAY"), 1.0)
-KAZIK_TITLE_SIZE = _parse_int(os.getenv("KAZIK_TITLE_SIZE"), 60)
-KAZIK_SUBTITLE_SIZE = _parse_int(os.getenv("KAZIK_SUBTITLE_SIZE"), 30)
-
-STAR_SPIN_COST = _parse_int(os.getenv("STAR_SPIN_COST"), 5)
-STAR_ROLL_FREE_PER_DAY = _parse_int(os.getenv("STAR_ROLL_FREE_PER_DAY"), 1)
-VIP_COST_STARS = _parse_int(os.getenv("VIP_COST_STARS"), 25)
-VIP_COST_RUB = _parse_int(os.getenv("VIP_COST_RUB"), 50)
-VIP_DURATION_DAYS = _parse_int(os.getenv("VIP_DURATION_DAYS"), 30)
-VIP_RENEW_WINDOW_DAYS = _parse_int(os.getenv("VIP_RENEW_WINDOW_DAYS"), 3)
+    _getenv("VIP_KAZIK_EXCLUSIVE_CHANCE"), 0.04
+)
+
+KAZIK_IMAGE_WIDTH = _parse_int(_getenv("KAZIK_IMAGE_WIDTH"), 900)
+KAZIK_IMAGE_HEIGHT = _parse_int(_getenv("KAZIK_IMAGE_HEIGHT"), 360)
+KAZIK_DIGIT_SIZE = _parse_int(_getenv("KAZIK_DIGIT_SIZE"), 120)
+KAZIK_SLOT_GAP = _parse_int(_getenv("KAZIK_SLOT_GAP"), 30)
+KAZIK_SLOT_RADIUS = _parse_int(_getenv("KAZIK_SLOT_RADIUS"), 26)
+KAZIK_SPIN_DELAY = _parse_float(_getenv("KAZIK_SPIN_DELAY"), 1.0)
+KAZIK_TITLE_SIZE = _parse_int(_getenv("KAZIK_TITLE_SIZE"), 60)
+KAZIK_SUBTITLE_SIZE = _parse_int(_getenv("KAZIK_SUBTITLE_SIZE"), 30)
+
+STAR_SPIN_COST = _parse_int(_getenv("STAR_SPIN_COST"), 5)
+STAR_ROLL_FREE_PER_DAY = _parse_int(_getenv("STAR_ROLL_FREE_PER_DAY"), 1)
+VIP_COST_STARS = _parse_int(_getenv("VIP_COST_STARS"), 25)
+VIP_COST_RUB = _parse_int(_getenv("VIP_COST_RUB"), 50)
+VIP_DURATION_DAYS = _parse_int(_getenv("VIP_DURATION_DAYS"), 30)
+VIP_RENEW_WINDOW_DAYS = _parse_int(_getenv("VIP_RENEW_WINDOW_DAYS"), 3)
 VIP_STAR_SPIN_COOLDOWN_SEC = _parse_int(
-    os.getenv("VIP_STAR_SPIN_COOLDOWN_SEC"), 86400
+    _getenv("VIP_STAR_SPIN_COOLDOWN_SEC"), 86400
 )
 STARS_TOPUP_AMOUNTS = tuple(
     int(item)
     for item in _parse_csv(
-        os.getenv("STARS_TOPUP_AMOUNTS"), ["5", "15", "25", "50", "100"]
+        _getenv("STARS_TOPUP_AMOUNTS"), ["5", "15", "25", "50", "100"]
     )
 )
-STARS_CURRENCY = os.getenv("STARS_CURRENCY", "XTR")
+STARS_CURRENCY = _getenv("STARS_CURRENCY", "XTR")
 STAR_DROP_CHANCES = _parse_json(
-    os.getenv("STAR_DROP_CHANCES"),
+    _getenv("STAR_DROP_CHANCES"),
     {
         "uncommon": 5.0,
         "rare": 18.0,
@@ -518,24 +598,22 @@ STAR_DROP_CHANCES = _parse_json(
         "exclusive": 6.0,
     },
 )
-STAR_DROP_CHANCES = {
-    str(key): float(value) for key, value in STAR_DROP_CHANCES.items()
-}
+STAR_DROP_CHANCES = _coerce_dict(STAR_DROP_CHANCES, _rarity_key, float)
 STAR_RARITY_ORDER = _parse_csv(
-    os.getenv("STAR_RARITY_ORDER"),
+    _getenv("STAR_RARITY_ORDER"),
     ["uncommon", "rare", "epic", "legendary", "platinum", "meme"],
 )
 
-EXCLUSIVE_STOCK_LIMIT = _parse_int(os.getenv("EXCLUSIVE_STOCK_LIMIT"), 3)
+EXCLUSIVE_STOCK_LIMIT = _parse_int(_getenv("EXCLUSIVE_STOCK_LIMIT"), 3)
 
 DISCOUNT_FILE = _resolve_path(
-    os.getenv("DISCOUNT_FILE"), BASE_DIR / "data" / "discounts.json"
+    _getenv("DISCOUNT_FILE"), _BASE_DATA_DIR / "discounts.json"
 )
-DISCOUNT_ITEMS_PER_DAY = _parse_int(os.getenv("DISCOUNT_ITEMS_PER_DAY"), 5)
-DISCOUNT_PERCENT_MIN = _parse_int(os.getenv("DISCOUNT_PERCENT_MIN"), 10)
-DISCOUNT_PERCENT_MAX = _parse_int(os.getenv("DISCOUNT_PERCENT_MAX"), 40)
+DISCOUNT_ITEMS_PER_DAY = _parse_int(_getenv("DISCOUNT_ITEMS_PER_DAY"), 5)
+DISCOUNT_PERCENT_MIN = _parse_int(_getenv("DISCOUNT_PERCENT_MIN"), 10)
+DISCOUNT_PERCENT_MAX = _parse_int(_getenv("DISCOUNT_PERCENT_MAX"), 40)
 DISCOUNT_RARITY_WEIGHTS = _parse_json(
-    os.getenv("DISCOUNT_RARITY_WEIGHTS"),
+    _getenv("DISCOUNT_RARITY_WEIGHTS"),
     {
         "dno": 6,
         "common": 5,
@@ -547,11 +625,9 @@ DISCOUNT_RARITY_WEIGHTS = _parse_json(
         "meme": 0.5,
     },
 )
-DISCOUNT_RARITY_WEIGHTS = {
-    str(key): float(value) for key, value in DISCOUNT_RARITY_WEIGHTS.items()
-}
+DISCOUNT_RARITY_WEIGHTS = _coerce_dict(DISCOUNT_RARITY_WEIGHTS, _rarity_key, float)
 DISCOUNT_QUANTITY_BY_RARITY = _parse_json(
-    os.getenv("DISCOUNT_QUANTITY_BY_RARITY"),
+    _getenv("DISCOUNT_QUANTITY_BY_RARITY"),
     {
         "dno": 20,
         "common": 20,
@@ -563,69 +639,70 @@ DISCOUNT_QUANTITY_BY_RARITY = _parse_json(
         "meme": 1,
     },
 )
-DISCOUNT_QUANTITY_BY_RARITY = {
-    str(key): int(value) for key, value in DISCOUNT_QUANTITY_BY_RARITY.items()
-}
+DISCOUNT_QUANTITY_BY_RARITY = _coerce_dict(
+    DISCOUNT_QUANTITY_BY_RARITY, _rarity_key, int
+)
 
 GIVEAWAY_FILE = _resolve_path(
-    os.getenv("GIVEAWAY_FILE"), BASE_DIR / "data" / "giveaway.json"
+    _getenv("GIVEAWAY_FILE"), _BASE_DATA_DIR / "giveaway.json"
 )
-GIVEAWAY_START_HOUR = _parse_int(os.getenv("GIVEAWAY_START_HOUR"), 12)
-GIVEAWAY_SIGNUP_END_HOUR = _parse_int(os.getenv("GIVEAWAY_SIGNUP_END_HOUR"), 17)
-GIVEAWAY_ANNOUNCE_HOUR = _parse_int(os.getenv("GIVEAWAY_ANNOUNCE_HOUR"), 18)
-GIVEAWAY_WINNERS = _parse_int(os.getenv("GIVEAWAY_WINNERS"), 5)
+GIVEAWAY_START_HOUR = _parse_int(_getenv("GIVEAWAY_START_HOUR"), 12)
+GIVEAWAY_SIGNUP_END_HOUR = _parse_int(_getenv("GIVEAWAY_SIGNUP_END_HOUR"), 17)
+GIVEAWAY_ANNOUNCE_HOUR = _parse_int(_getenv("GIVEAWAY_ANNOUNCE_HOUR"), 18)
+GIVEAWAY_WINNERS = _parse_int(_getenv("GIVEAWAY_WINNERS"), 5)
 GIVEAWAY_BALANCE_PRIZES = tuple(
     int(item)
-    for item in _parse_csv(os.getenv("GIVEAWAY_BALANCE_PRIZES"), ["100", "250", "500"])
+    for item in _parse_csv(_getenv("GIVEAWAY_BALANCE_PRIZES"), ["100", "250", "500"])
 )
-GIVEAWAY_FREE_ROLLS = _parse_int(os.getenv("GIVEAWAY_FREE_ROLLS"), 1)
-GIVEAWAY_MIN_RARITY = os.getenv("GIVEAWAY_MIN_RARITY", "epic")
+GIVEAWAY_FREE_ROLLS = _parse_int(_getenv("GIVEAWAY_FREE_ROLLS"), 1)
+GIVEAWAY_MIN_RARITY = _getenv("GIVEAWAY_MIN_RARITY", "epic")
 GIVEAWAY_EXCLUSIVE_CHANCE = _parse_float(
-    os.getenv("GIVEAWAY_EXCLUSIVE_CHANCE"), 0.02
+    _getenv("GIVEAWAY_EXCLUSIVE_CHANCE"), 0.02
 )
 REMINDER_INTERVAL_SEC = _parse_int(
-    os.getenv("REMINDER_INTERVAL_SEC"), 2 * 24 * 60 * 60
+    _getenv("REMINDER_INTERVAL_SEC"), 2 * 24 * 60 * 60
 )
-REMINDER_TICK_SEC = _parse_int(os.getenv("REMINDER_TICK_SEC"), 6 * 60 * 60)
-GIVEAWAY_TICK_SEC = _parse_int(os.getenv("GIVEAWAY_TICK_SEC"), 10 * 60)
+REMINDER_TICK_SEC = _parse_int(_getenv("REMINDER_TICK_SEC"), 6 * 60 * 60)
+GIVEAWAY_TICK_SEC = _parse_int(_getenv("GIVEAWAY_TICK_SEC"), 10 * 60)
 
-RATE_LIMIT_OVERALL_MAX = _parse_int(os.getenv("RATE_LIMIT_OVERALL_MAX"), 25)
-RATE_LIMIT_OVERALL_PERIOD = _parse_float(os.getenv("RATE_LIMIT_OVERALL_PERIOD"), 1.0)
-RATE_LIMIT_GROUP_MAX = _parse_int(os.getenv("RATE_LIMIT_GROUP_MAX"), 18)
-RATE_LIMIT_GROUP_PERIOD = _parse_float(os.getenv("RATE_LIMIT_GROUP_PERIOD"), 60.0)
-RATE_LIMIT_MAX_RETRIES = _parse_int(os.getenv("RATE_LIMIT_MAX_RETRIES"), 2)
+RATE_LIMIT_OVERALL_MAX = _parse_int(_getenv("RATE_LIMIT_OVERALL_MAX"), 25)
+RATE_LIMIT_OVERALL_PERIOD = _parse_float(_getenv("RATE_LIMIT_OVERALL_PERIOD"), 1.0)
+RATE_LIMIT_GROUP_MAX = _parse_int(_getenv("RATE_LIMIT_GROUP_MAX"), 18)
+RATE_LIMIT_GROUP_PERIOD = _parse_float(_getenv("RATE_LIMIT_GROUP_PERIOD"), 60.0)
+RATE_LIMIT_MAX_RETRIES = _parse_int(_getenv("RATE_LIMIT_MAX_RETRIES"), 2)
 RATE_LIMIT_MIN_DELAY_SEC = _parse_float(
-    os.getenv("RATE_LIMIT_MIN_DELAY_SEC"), 0.0
-)
-
-TOP_LIMIT = _parse_int(os.getenv("TOP_LIMIT"), 10)
-
-MENU_IMAGE_WIDTH = _parse_int(os.getenv("MENU_IMAGE_WIDTH"), 900)
-MENU_IMAGE_HEIGHT = _parse_int(os.getenv("MENU_IMAGE_HEIGHT"), 480)
-MENU_TITLE_SIZE = _parse_int(os.getenv("MENU_TITLE_SIZE"), 44)
-MENU_SUBTITLE_SIZE = _parse_int(os.getenv("MENU_SUBTITLE_SIZE"), 26)
-PROFILE_TITLE_SIZE = _parse_int(os.getenv("PROFILE_TITLE_SIZE"), 40)
-PROFILE_INFO_SIZE = _parse_int(os.getenv("PROFILE_INFO_SIZE"), 28)
-LEADERBOARD_TITLE_SIZE = _parse_int(os.getenv("LEADERBOARD_TITLE_SIZE"), 52)
-LEADERBOARD_SUBTITLE_SIZE = _parse_int(os.getenv("LEADERBOARD_SUBTITLE_SIZE"), 28)
-LEADERBOARD_ENTRY_SIZE = _parse_int(os.getenv("LEADERBOARD_ENTRY_SIZE"), 34)
-LEADERBOARD_AVATAR_SIZE = _parse_int(os.getenv("LEADERBOARD_AVATAR_SIZE"), 64)
-LEADERBOARD_ROW_GAP = _parse_int(os.getenv("LEADERBOARD_ROW_GAP"), 18)
-LEADERBOARD_OUTER_MARGIN = _parse_int(os.getenv("LEADERBOARD_OUTER_MARGIN"), 80)
-LEADERBOARD_PLATE_PADDING = _parse_int(os.getenv("LEADERBOARD_PLATE_PADDING"), 50)
-LEADERBOARD_HEADER_GAP = _parse_int(os.getenv("LEADERBOARD_HEADER_GAP"), 12)
+    _getenv("RATE_LIMIT_MIN_DELAY_SEC"), 0.0
+)
+
+TOP_LIMIT = _parse_int(_getenv("TOP_LIMIT"), 10)
+
+MENU_IMAGE_WIDTH = _parse_int(_getenv("MENU_IMAGE_WIDTH"), 900)
+MENU_IMAGE_HEIGHT = _parse_int(_getenv("MENU_IMAGE_HEIGHT"), 480)
+MENU_TITLE_SIZE = _parse_int(_getenv("MENU_TITLE_SIZE"), 44)
+MENU_SUBTITLE_SIZE = _parse_int(_getenv("MENU_SUBTITLE_SIZE"), 26)
+PROFILE_TITLE_SIZE = _parse_int(_getenv("PROFILE_TITLE_SIZE"), 40)
+PROFILE_INFO_SIZE = _parse_int(_getenv("PROFILE_INFO_SIZE"), 28)
+LEADERBOARD_TITLE_SIZE = _parse_int(_getenv("LEADERBOARD_TITLE_SIZE"), 52)
+LEADERBOARD_SUBTITLE_SIZE = _parse_int(_getenv("LEADERBOARD_SUBTITLE_SIZE"), 28)
+LEADERBOARD_ENTRY_SIZE = _parse_int(_getenv("LEADERBOARD_ENTRY_SIZE"), 34)
+LEADERBOARD_AVATAR_SIZE = _parse_int(_getenv("LEADERBOARD_AVATAR_SIZE"), 64)
+LEADERBOARD_ROW_GAP = _parse_int(_getenv("LEADERBOARD_ROW_GAP"), 18)
+LEADERBOARD_OUTER_MARGIN = _parse_int(_getenv("LEADERBOARD_OUTER_MARGIN"), 80)
+LEADERBOARD_PLATE_PADDING = _parse_int(_getenv("LEADERBOARD_PLATE_PADDING"), 50)
+LEADERBOARD_HEADER_GAP = _parse_int(_getenv("LEADERBOARD_HEADER_GAP"), 12)
 LEADERBOARD_HEADER_TO_ROWS_GAP = _parse_int(
-    os.getenv("LEADERBOARD_HEADER_TO_ROWS_GAP"), 28
+    _getenv("LEADERBOARD_HEADER_TO_ROWS_GAP"), 28
 )
 
+_BASE_FONTS_DIR = BASE_DIR / "fonts"
 DEFAULT_FONT_CANDIDATES = [
-    BASE_DIR / "fonts" / "NotoSans-Regular.ttf",
-    BASE_DIR / "fonts" / "NotoSansCJK-Regular.ttc",
-    BASE_DIR / "fonts" / "NotoSansSymbols2-Regular.ttf",
-    BASE_DIR / "fonts" / "NotoColorEmoji.ttf",
-    BASE_DIR / "fonts" / "NotoEmoji-Regular.ttf",
-    BASE_DIR / "fonts" / "DejaVuSans.ttf",
-    BASE_DIR / "fonts" / "Symbola.ttf",
+    _BASE_FONTS_DIR / "NotoSans-Regular.ttf",
+    _BASE_FONTS_DIR / "NotoSansCJK-Regular.ttc",
+    _BASE_FONTS_DIR / "NotoSansSymbols2-Regular.ttf",
+    _BASE_FONTS_DIR / "NotoColorEmoji.ttf",
+    _BASE_FONTS_DIR / "NotoEmoji-Regular.ttf",
+    _BASE_FONTS_DIR / "DejaVuSans.ttf",
+    _BASE_FONTS_DIR / "Symbola.ttf",
     Path("/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc"),
     Path("/usr/share/fonts/truetype/noto/NotoColorEmoji.ttf"),
     Path("/usr/share/fonts/truetype/noto/NotoEmoji-Regular.ttf"),
@@ -640,7 +717,7 @@ DEFAULT_FONT_CANDIDATES = [
     Path("C:/Windows/Fonts/arialuni.ttf"),
 ]
 
-_fonts_raw = os.getenv("FONT_CANDIDATES")
+_fonts_raw = _getenv("FONT_CANDIDATES")
 if _fonts_raw:
     FONT_CANDIDATES = [
         _resolve_path(item, BASE_DIR / item)
@@ -649,12 +726,12 @@ if _fonts_raw:
 else:
     FONT_CANDIDATES = DEFAULT_FONT_CANDIDATES
 
-CJK_FONT_NAMES = set(
-    _parse_csv(os.getenv("CJK_FONT_NAMES"), ["NotoSansCJK-Regular.ttc"])
+CJK_FONT_NAMES: FrozenSet[str] = frozenset(
+    _parse_csv(_getenv("CJK_FONT_NAMES"), ["NotoSansCJK-Regular.ttc"])
 )
-SYMBOL_FONT_NAMES = set(
+SYMBOL_FONT_NAMES: FrozenSet[str] = frozenset(
     _parse_csv(
-        os.getenv("SYMBOL_FONT_NAMES"),
+        _getenv("SYMBOL_FONT_NAMES"),
         [
             "NotoSansSymbols2-Regular.ttf",
             "Symbola.ttf",
@@ -663,18 +740,18 @@ SYMBOL_FONT_NAMES = set(
         ],
     )
 )
-BASE_FONT_PATH = _resolve_optional_path(os.getenv("BASE_FONT_PATH"))
-BASE_FONT_CJK_PATH = _resolve_optional_path(os.getenv("BASE_FONT_CJK_PATH"))
-BASE_FONT_SYMBOL_PATH = _resolve_optional_path(os.getenv("BASE_FONT_SYMBOL_PATH"))
-SOSISKI_FONT_PATH = os.getenv("SOSISKI_FONT_PATH", "").strip()
-SOSISKI_FONT_PATHS = os.getenv("SOSISKI_FONT_PATHS", "").strip()
-LOGO_FILE = os.getenv("LOGO_FILE", "").strip()
-IMAGE_CACHE_VERSION = os.getenv("IMAGE_CACHE_VERSION", "v5").strip() or "v5"
-PROFILE_FONT_PATH = _resolve_optional_path(os.getenv("PROFILE_FONT_PATH"))
-PROFILE_FONT_CJK_PATH = _resolve_optional_path(os.getenv("PROFILE_FONT_CJK_PATH"))
-PROFILE_FONT_SYMBOL_PATH = _resolve_optional_path(os.getenv("PROFILE_FONT_SYMBOL_PATH"))
+BASE_FONT_PATH = _resolve_path(_getenv("BASE_FONT_PATH"), None)
+BASE_FONT_CJK_PATH = _resolve_path(_getenv("BASE_FONT_CJK_PATH"), None)
+BASE_FONT_SYMBOL_PATH = _resolve_path(_getenv("BASE_FONT_SYMBOL_PATH"), None)
+SOSISKI_FONT_PATH = _getenv("SOSISKI_FONT_PATH", "").strip()
+SOSISKI_FONT_PATHS = _getenv("SOSISKI_FONT_PATHS", "").strip()
+LOGO_FILE = _getenv("LOGO_FILE", "").strip()
+IMAGE_CACHE_VERSION = _getenv("IMAGE_CACHE_VERSION", "v5").strip() or "v5"
+PROFILE_FONT_PATH = _resolve_path(_getenv("PROFILE_FONT_PATH"), None)
+PROFILE_FONT_CJK_PATH = _resolve_path(_getenv("PROFILE_FONT_CJK_PATH"), None)
+PROFILE_FONT_SYMBOL_PATH = _resolve_path(_getenv("PROFILE_FONT_SYMBOL_PATH"), None)
 
-AVATAR_CACHE_TTL_SEC = _parse_int(os.getenv("AVATAR_CACHE_TTL_SEC"), 21600)
+AVATAR_CACHE_TTL_SEC = _parse_int(_getenv("AVATAR_CACHE_TTL_SEC"), 21600)
 
 DROP_CHANCE_KEYS = {
     "dno": "DROP_CHANCE_DNO",
@@ -706,6 +783,9 @@ __all__ = [
     "WEBHOOK_PORT",
     "DATA_DIR",
     "DB_PATH",
+    "DB_JOURNAL_PATH",
+    "DB_JOURNAL_MAX_BYTES",
+    "CARDS_CACHE_FILE",
     "SAUSAGE_DIR",
     "PHOTO_CACHE_DIR",
     "LEADERBOARD_BG",
@@ -714,6 +794,9 @@ __all__ = [
     "ROLL_RARITY_EXCLUDE",
     "SHOP_RARITY_ORDER",
     "SHOP_RARITY_EXCLUDE",
+    "RARITY_INDEX",
+    "ROLL_RARITY_INDEX",
+    "SHOP_RARITY_INDEX",
     "RARITY_NAMES",
     "RARITY_DIRS",
     "RARITY_PRICE_MULTIPLIERS",
@@ -831,7 +914,9 @@ __all__ = [
     "PROFILE_FONT_SYMBOL_PATH",
     "AVATAR_CACHE_TTL_SEC",
     "strip_quotes",
+    "filter_existing_paths",
     "read_env_file",
     "upsert_env_lines",
+    "write_env_file",
     "ensure_env_defaults",
 ]
@@ -6,6 +6,7 @@ import platform
 import shutil
 import subprocess
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict
 
@@ -36,12 +37,18 @@ def _download_font(url: str, dest: Path) -> None:
         return
     dest.parent.mkdir(parents=True, exist_ok=True)
     tmp = dest.with_suffix(dest.suffix + ".tmp")
-    with urllib.request.urlopen(url, timeout=30) as response:
-        data = response.read()
-    tmp.write_bytes(data)
+    with urllib.request.urlopen(url, timeout=30) as response, tmp.open("wb") as handle:
+        shutil.copyfileobj(response, handle, 1 << 16)
     tmp.replace(dest)
 
 
+def _try_download_font(url: str, dest: Path) -> None:
+    try:
+        _download_font(url, dest)
+    except Exception:
+        pass
+
+
 def _install_user_fonts(fonts_dir: Path) -> None:
     system = platform.system().lower()
     if system == "linux":
@@ -74,11 +81,9 @@ def _install_user_fonts(fonts_dir: Path) -> None:
 def ensure_fonts(base_dir: Path) -> None:
     fonts_dir = base_dir / "fonts"
     fonts_dir.mkdir(parents=True, exist_ok=True)
-    for name, url in FONT_SOURCES.items():
-        try:
-            _download_font(url, fonts_dir / name)
-        except Exception:
-            continue
+    with ThreadPoolExecutor(max_workers=len(FONT_SOURCES)) as executor:
+        for name, url in FONT_SOURCES.items():
+            executor.submit(_try_download_font, url, fonts_dir / name)
     _install_user_fonts(fonts_dir)
 
     font_paths = [str(fonts_dir / name) for name in FONT_SOURCES]
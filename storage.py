@@ -1,10 +1,23 @@
+import heapq
 import json
-import secrets
+import mmap
+import os
+from base64 import urlsafe_b64encode
 from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+from secrets import token_bytes
 from typing import Dict, List, Optional, Tuple
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from cards import Card
 from config import (
+    DB_JOURNAL_MAX_BYTES,
+    DB_JOURNAL_PATH,
     DB_PATH,
     KAZIK_SPIN_COST,
     KAZIK_WIN_CHANCE,
@@ -19,6 +32,7 @@ def now_utc() -> datetime:
     return datetime.now(timezone.utc)
 
 
+@lru_cache(maxsize=4096)
 def parse_iso(ts: Optional[str]) -> Optional[datetime]:
     if not ts:
         return None
@@ -31,29 +45,176 @@ def parse_iso(ts: Optional[str]) -> Optional[datetime]:
     return parsed
 
 
+_SNAPSHOT_TMP_PATH = DB_PATH.with_suffix(DB_PATH.suffix + ".tmp")
+_saved_records: Optional[Dict[Tuple[str, Optional[str]], bytes]] = None
+_journal_size = 0
+_tag_index: Dict[str, str] = {}
+_tag_index_db: Optional[Dict[str, object]] = None
+_card_values: Dict[str, int] = {}
+_card_values_source: Optional[Dict[str, Card]] = None
+
+
+def _dump_db(db: Dict[str, object]) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(
+            db, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+        )
+    return json.dumps(db, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def _load_json(raw: bytes) -> object:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def _read_snapshot(path: Path = DB_PATH) -> object:
+    with path.open("rb") as handle:
+        if orjson is None or os.fstat(handle.fileno()).st_size == 0:
+            return _load_json(handle.read())
+        with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                return orjson.loads(view)
+            finally:
+                view.release()
+
+
+def _dump_value(value: object) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode(
+        "utf-8"
+    )
+
+
+def _db_records(db: Dict[str, object]) -> Dict[Tuple[str, Optional[str]], bytes]:
+    records: Dict[Tuple[str, Optional[str]], bytes] = {}
+    for key, value in db.items():
+        if isinstance(value, dict):
+            records[(key, None)] = b"{}"
+            for sub_key, item in value.items():
+                records[(key, str(sub_key))] = _dump_value(item)
+        else:
+            records[(key, None)] = _dump_value(value)
+    return records
+
+
+def _apply_journal_ops(db: Dict[str, object], ops: List[list]) -> None:
+    for op in ops:
+        key, sub_key = op[0], op[1]
+        if len(op) == 3:
+            if sub_key is None:
+                db[key] = op[2]
+                continue
+            container = db.get(key)
+            if not isinstance(container, dict):
+                container = db[key] = {}
+            container[sub_key] = op[2]
+        elif sub_key is None:
+            db.pop(key, None)
+        else:
+            container = db.get(key)
+            if isinstance(container, dict):
+                container.pop(sub_key, None)
+
+
+def _replay_journal(db: Dict[str, object], path: Path = DB_JOURNAL_PATH) -> bool:
+    try:
+        raw = path.read_bytes()
+    except FileNotFoundError:
+        return False
+    for line in raw.splitlines():
+        try:
+            ops = _load_json(line)
+        except ValueError:
+            break
+        _apply_journal_ops(db, ops)
+    return bool(raw)
+
+
+def _write_snapshot(db: Dict[str, object]) -> None:
+    global _journal_size
+    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    _SNAPSHOT_TMP_PATH.write_bytes(_dump_db(db))
+    os.replace(_SNAPSHOT_TMP_PATH, DB_PATH)
+    DB_JOURNAL_PATH.unlink(missing_ok=True)
+    _journal_size = 0
+
+
+def read_db_file(path: Path = DB_PATH, journal_path: Path = DB_JOURNAL_PATH) -> object:
+    """Read a snapshot with its journal applied, without touching either file."""
+    db = _read_snapshot(path)
+    if isinstance(db, dict):
+        _replay_journal(db, journal_path)
+    return db
+
+
 def load_db() -> Dict[str, object]:
+    global _saved_records
     if not DB_PATH.exists():
         DB_PATH.parent.mkdir(parents=True, exist_ok=True)
         DB_PATH.write_text(
             json.dumps({"meta": {"version": 1}, "users": {}, "trades": {}}, indent=2),
             encoding="utf-8",
         )
-    db = json.loads(DB_PATH.read_text(encoding="utf-8"))
+        DB_JOURNAL_PATH.unlink(missing_ok=True)
+    db = _read_snapshot()
     if not isinstance(db, dict):
         db = {"meta": {"version": 1}, "users": {}, "trades": {}}
     db.setdefault("meta", {"version": 1})
     db.setdefault("users", {})
     db.setdefault("trades", {})
     db.setdefault("exclusive_stock", {})
+    DB_JOURNAL_PATH.parent.mkdir(parents=True, exist_ok=True)
+    if _replay_journal(db):
+        _write_snapshot(db)
+    _saved_records = _db_records(db)
+    _build_tag_index(db)
     return db
 
 
 def save_db(db: Dict[str, object]) -> None:
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    payload = json.dumps(db, ensure_ascii=False, indent=2)
-    tmp_path = DB_PATH.with_suffix(DB_PATH.suffix + ".tmp")
-    tmp_path.write_text(payload, encoding="utf-8")
-    tmp_path.replace(DB_PATH)
+    global _saved_records, _journal_size
+    records = _db_records(db)
+    previous = _saved_records
+    if previous is None:
+        DB_JOURNAL_PATH.unlink(missing_ok=True)
+        _write_snapshot(db)
+        _saved_records = records
+        return
+    ops = [
+        b"[" + _dump_value(key) + b"," + _dump_value(sub_key) + b"]"
+        for key, sub_key in previous.keys() - records.keys()
+    ]
+    for record_key, payload in records.items():
+        if previous.get(record_key) != payload:
+            key, sub_key = record_key
+            ops.append(
+                b"["
+                + _dump_value(key)
+                + b","
+                + _dump_value(sub_key)
+                + b","
+                + payload
+                + b"]"
+            )
+    if not ops:
+        return
+    line = b"[" + b",".join(ops) + b"]\n"
+    with DB_JOURNAL_PATH.open("ab") as handle:
+        handle.write(line)
+    _journal_size += len(line)
+    _saved_records = records
+    if _journal_size >= DB_JOURNAL_MAX_BYTES:
+        _write_snapshot(db)
+
+
+def compact_db(db: Dict[str, object]) -> None:
+    """Save pending changes and fold the journal into the snapshot."""
+    save_db(db)
+    if _journal_size or DB_JOURNAL_PATH.exists():
+        _write_snapshot(db)
 
 
 def get_user_label(tg_user) -> str:
@@ -68,84 +229,118 @@ def normalize_user_tag(tag: str) -> str:
     return tag.strip().lstrip("@").lower()
 
 
+def _normalize_stored_tag(raw_tag: object) -> str:
+    return str(raw_tag or "").lstrip("@").lower()
+
+
+def _build_tag_index(db: Dict[str, object]) -> None:
+    global _tag_index_db
+    _tag_index.clear()
+    for uid, data in db.get("users", {}).items():
+        user_tag = _normalize_stored_tag(data.get("user_tag"))
+        if user_tag:
+            _tag_index.setdefault(user_tag, uid)
+    _tag_index_db = db
+
+
 def find_user_by_tag(
     db: Dict[str, object], tag: str
 ) -> Optional[Tuple[str, Dict[str, object]]]:
     normalized = normalize_user_tag(tag)
     if not normalized:
         return None
-    for uid, data in db.get("users", {}).items():
-        user_tag = str(data.get("user_tag") or "").lstrip("@").lower()
-        if user_tag and user_tag == normalized:
-            return uid, data
-    return None
+    if _tag_index_db is not db:
+        _build_tag_index(db)
+    uid = _tag_index.get(normalized)
+    if uid is None:
+        return None
+    data = db.get("users", {}).get(uid)
+    if data is None or _normalize_stored_tag(data.get("user_tag")) != normalized:
+        _build_tag_index(db)
+        uid = _tag_index.get(normalized)
+        if uid is None:
+            return None
+        data = db["users"][uid]
+    return uid, data
+
+
+_USER_DEFAULTS: Dict[str, object] = {
+    "balance": 0,
+    "stars": 0,
+    "last_roll_at": None,
+    "last_kazik_at": None,
+    "kazik_session": None,
+    "kazik_daily_date": None,
+    "kazik_daily_used": 0,
+    "kazik_bonus_spins": 0,
+    "star_roll_daily_date": None,
+    "star_roll_daily_used": 0,
+    "referred_by": None,
+    "vip": False,
+    "vip_until": None,
+    "vip_reward_pending": False,
+    "free_rolls": 0,
+    "last_vip_star_spin_at": None,
+    "last_reminder_at": None,
+    "input_mode": None,
+}
+# Mutable defaults such as "inventory" are created per user in ensure_user.
+_USER_KEYS = frozenset(_USER_DEFAULTS) | {"inventory"}
 
 
 def ensure_user(db: Dict[str, object], tg_user) -> Dict[str, object]:
+    global _tag_index_db
     users = db.setdefault("users", {})
     user_id = str(tg_user.id)
-    if user_id not in users:
-        users[user_id] = {
+    user = users.get(user_id)
+    old_raw_tag = None if user is None else user.get("user_tag")
+    created = user is None
+    if created:
+        user = users[user_id] = {
             "username": tg_user.full_name,
             "user_tag": tg_user.username or "",
-            "balance": 0,
-            "stars": 0,
+            **_USER_DEFAULTS,
             "inventory": [],
-            "last_roll_at": None,
-            "last_kazik_at": None,
-            "kazik_session": None,
-            "kazik_daily_date": None,
-            "kazik_daily_used": 0,
-            "kazik_bonus_spins": 0,
-            "star_roll_daily_date": None,
-            "star_roll_daily_used": 0,
-            "referred_by": None,
-            "vip": False,
-            "vip_until": None,
-            "vip_reward_pending": False,
-            "free_rolls": 0,
-            "last_vip_star_spin_at": None,
-            "last_reminder_at": None,
-            "input_mode": None,
         }
-    user = users[user_id]
-    user.setdefault("balance", 0)
-    user.setdefault("stars", 0)
-    user.setdefault("inventory", [])
-    user.setdefault("last_roll_at", None)
-    user.setdefault("last_kazik_at", None)
-    user.setdefault("kazik_session", None)
-    user.setdefault("kazik_daily_date", None)
-    user.setdefault("kazik_daily_used", 0)
-    user.setdefault("kazik_bonus_spins", 0)
-    user.setdefault("star_roll_daily_date", None)
-    user.setdefault("star_roll_daily_used", 0)
-    user.setdefault("referred_by", None)
-    user.setdefault("vip", False)
-    user.setdefault("vip_until", None)
-    user.setdefault("vip_reward_pending", False)
-    user.setdefault("free_rolls", 0)
-    user.setdefault("last_vip_star_spin_at", None)
-    user.setdefault("last_reminder_at", None)
-    user.setdefault("input_mode", None)
+    elif not _USER_KEYS <= user.keys():
+        if "inventory" not in user:
+            user["inventory"] = []
+        for key, value in _USER_DEFAULTS.items():
+            if key not in user:
+                user[key] = value
     user["username"] = str(tg_user.full_name or "")
     if tg_user.username:
         user["user_tag"] = tg_user.username
+    raw_tag = user.get("user_tag")
+    if raw_tag != old_raw_tag and _tag_index_db is db:
+        new_tag = _normalize_stored_tag(raw_tag)
+        if created:
+            # New users are last in dict order, so an existing holder wins.
+            if new_tag:
+                _tag_index.setdefault(new_tag, user_id)
+        elif _normalize_stored_tag(old_raw_tag) != new_tag:
+            # Another user may share either tag; rebuild on the next lookup.
+            _tag_index_db = None
     return user
 
 
+def _priced_card_values(card_map: Dict[str, Card]) -> Dict[str, int]:
+    global _card_values, _card_values_source
+    if _card_values_source is not card_map:
+        _card_values = {
+            filename: card.price
+            for filename, card in card_map.items()
+            if card.price is not None and card.rarity != "exclusive"
+        }
+        _card_values_source = card_map
+    return _card_values
+
+
 def inventory_value(user: Dict[str, object], card_map: Dict[str, Card]) -> int:
+    price_of = _priced_card_values(card_map).get
     total = 0
     for item in user.get("inventory", []):
-        filename = item.get("file")
-        if not filename:
-            continue
-        card = card_map.get(filename)
-        if not card or card.price is None:
-            continue
-        if card.rarity == "exclusive":
-            continue
-        total += card.price
+        total += price_of(item.get("file"), 0)
     return total
 
 
@@ -163,23 +358,29 @@ def get_star_balance(user: Dict[str, object]) -> int:
         return 0
 
 
-def is_vip(user: Dict[str, object]) -> bool:
+def is_vip(user: Dict[str, object], now: Optional[datetime] = None) -> bool:
     until = parse_iso(user.get("vip_until"))
     if until:
-        return until > now_utc()
+        return until > (now or now_utc())
     return bool(user.get("vip"))
 
 
-def get_kazik_spin_cost(user: Dict[str, object]) -> int:
-    return VIP_KAZIK_SPIN_COST if is_vip(user) else KAZIK_SPIN_COST
+def get_kazik_spin_cost(
+    user: Dict[str, object], now: Optional[datetime] = None
+) -> int:
+    return VIP_KAZIK_SPIN_COST if is_vip(user, now) else KAZIK_SPIN_COST
 
 
-def get_kazik_win_chance(user: Dict[str, object]) -> float:
-    return VIP_KAZIK_WIN_CHANCE if is_vip(user) else KAZIK_WIN_CHANCE
+def get_kazik_win_chance(
+    user: Dict[str, object], now: Optional[datetime] = None
+) -> float:
+    return VIP_KAZIK_WIN_CHANCE if is_vip(user, now) else KAZIK_WIN_CHANCE
 
 
-def get_cooldown_seconds(user: Dict[str, object]) -> int:
-    return VIP_ROLL_COOLDOWN_SEC if is_vip(user) else ROLL_COOLDOWN_SEC
+def get_cooldown_seconds(
+    user: Dict[str, object], now: Optional[datetime] = None
+) -> int:
+    return VIP_ROLL_COOLDOWN_SEC if is_vip(user, now) else ROLL_COOLDOWN_SEC
 
 
 def total_wealth(user: Dict[str, object], card_map: Dict[str, Card]) -> int:
@@ -208,24 +409,29 @@ def compute_leaderboard(
     db: Dict[str, object],
     card_map: Dict[str, Card],
     limit: int,
+    now: Optional[datetime] = None,
 ) -> Tuple[List[Tuple[str, str, int, bool]], int]:
     users = db.get("users", {})
-    leaderboard = []
+    entries = []
     for uid, data in users.items():
         raw_name = data.get("username")
         name = str(raw_name).strip() if raw_name else "Без имени"
         if not name:
             name = "Без имени"
-        total = total_wealth(data, card_map)
-        vip = is_vip(data)
-        leaderboard.append((uid, name, total, vip))
-    leaderboard.sort(key=lambda item: (-item[2], item[1].lower(), item[0]))
-    trimmed = [(uid, name, total, vip) for uid, name, total, vip in leaderboard[:limit]]
-    return trimmed, len(leaderboard)
+        entries.append((-total_wealth(data, card_map), name.lower(), uid, name, data))
+    top = heapq.nsmallest(limit, entries)
+    if now is None:
+        now = now_utc()
+    trimmed = [
+        (uid, name, -negative_total, is_vip(data, now))
+        for negative_total, _, uid, name, data in top
+    ]
+    return trimmed, len(users)
 
 
 def make_inventory_item(filename: str) -> Dict[str, object]:
-    return {"id": f"it_{secrets.token_urlsafe(6)}", "file": filename}
+    item_id = "it_" + urlsafe_b64encode(token_bytes(6)).decode("ascii")
+    return {"id": item_id, "file": filename}
 
 
 def find_inventory_item(
@@ -237,26 +443,34 @@ def find_inventory_item(
     return None
 
 
+def remove_inventory_item(user: Dict[str, object], item: Dict[str, object]) -> bool:
+    items = user.get("inventory", [])
+    for index in range(len(items) - 1, -1, -1):
+        if items[index] is item:
+            del items[index]
+            return True
+    return False
+
+
 def sync_exclusive_stock(
     db: Dict[str, object], card_map: Dict[str, Card], limit: int
 ) -> bool:
     stock = db.setdefault("exclusive_stock", {})
-    owned_counts: Dict[str, int] = {}
-    for user in db.get("users", {}).values():
-        if not isinstance(user, dict):
-            continue
-        for item in user.get("inventory", []):
-            filename = item.get("file")
-            if not filename:
+    owned_counts: Dict[str, int] = {
+        filename: 0
+        for filename, card in card_map.items()
+        if card.rarity == "exclusive"
+    }
+    if owned_counts:
+        for user in db.get("users", {}).values():
+            if not isinstance(user, dict):
                 continue
-            card = card_map.get(filename)
-            if card and card.rarity == "exclusive":
-                owned_counts[filename] = owned_counts.get(filename, 0) + 1
+            for item in user.get("inventory", []):
+                filename = item.get("file")
+                if filename in owned_counts:
+                    owned_counts[filename] += 1
     changed = False
-    for filename, card in card_map.items():
-        if card.rarity != "exclusive":
-            continue
-        owned = owned_counts.get(filename, 0)
+    for filename, owned in owned_counts.items():
         remaining = max(0, limit - owned)
         record = stock.get(filename)
         if not isinstance(record, dict):
@@ -278,6 +492,8 @@ __all__ = [
     "parse_iso",
     "load_db",
     "save_db",
+    "compact_db",
+    "read_db_file",
     "get_user_label",
     "normalize_user_tag",
     "find_user_by_tag",
@@ -294,5 +510,6 @@ __all__ = [
     "compute_leaderboard",
     "make_inventory_item",
     "find_inventory_item",
+    "remove_inventory_item",
     "sync_exclusive_stock",
 ]